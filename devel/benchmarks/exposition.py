@@ -0,0 +1,90 @@
+"""
+Benchmark of `SeriesRenderer` against `generate_latest()`.
+
+Renders a registry with a counter family of the given numbers of series, like
+the `http_requests_total` metric of an app with many handlers. Values change
+before every scrape. Prints the median time of a scrape with each renderer.
+
+    poetry run python devel/benchmarks/exposition.py
+    poetry run python devel/benchmarks/exposition.py --series 10000 --rounds 10
+"""
+
+import argparse
+import statistics
+import time
+from typing import Callable, Iterable, List
+
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.metrics_core import CounterMetricFamily, Metric
+
+from prometheus_fastapi_instrumentator.exposition import SeriesRenderer
+
+METHODS = ("GET", "POST", "PUT", "DELETE")
+STATUSES = ("2xx", "3xx", "4xx", "5xx")
+
+
+class RequestsCollector:
+    """Collects a requests counter with `series` label combinations."""
+
+    def __init__(self, series: int) -> None:
+        self.labels = [
+            (
+                f"/api/v1/items/{i // 16}",
+                METHODS[i // 4 % 4],
+                STATUSES[i % 4],
+            )
+            for i in range(series)
+        ]
+        self.values = [0.0] * series
+
+    def bump(self) -> None:
+        self.values = [value + 1.5 for value in self.values]
+
+    def collect(self) -> Iterable[Metric]:
+        family = CounterMetricFamily(
+            "http_requests",
+            "Total number of requests by method, status and handler.",
+            labels=("handler", "method", "status"),
+        )
+        for labels, value in zip(self.labels, self.values):
+            family.add_metric(labels, value)
+        yield family
+
+
+def measure(render: Callable[[], bytes], collector: RequestsCollector, rounds: int):
+    timings: List[float] = []
+    for _ in range(rounds):
+        collector.bump()
+        start = time.perf_counter()
+        render()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--series", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'series':>10} {'generate_latest':>16} {'SeriesRenderer':>16} {'speedup':>8}")
+    for series in args.series:
+        collector = RequestsCollector(series)
+        registry = CollectorRegistry()
+        registry.register(collector)
+
+        renderer = SeriesRenderer()
+        assert renderer.render(registry) == generate_latest(registry)
+
+        baseline = measure(lambda: generate_latest(registry), collector, args.rounds)
+        cached = measure(lambda: renderer.render(registry), collector, args.rounds)
+        print(
+            f"{series:>10} {baseline:>15.3f}s {cached:>15.3f}s "
+            f"{baseline / cached:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
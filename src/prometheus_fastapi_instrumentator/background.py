@@ -0,0 +1,263 @@
+"""
+This module contains the optional queue for async instrumentations.
+
+By default the middleware awaits all async instrumentations before the request
+is finished. With the queue, `Info` objects are handed to a bounded queue per
+event loop instead and a pool of worker tasks runs the instrumentations in the
+background, off the response path.
+"""
+
+import asyncio
+import logging
+import weakref
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from prometheus_fastapi_instrumentator import metrics
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest")
+
+logger = logging.getLogger(__name__)
+
+# Queues by their depth gauge, which is shared by all queues of a registry.
+_queues_by_depth: "weakref.WeakKeyDictionary[Gauge, weakref.WeakSet[Any]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+class _LoopState:
+    """Queue and workers of a single event loop."""
+
+    __slots__ = ("queue", "workers")
+
+    def __init__(self, maxsize: int) -> None:
+        self.queue: "asyncio.Queue[metrics.Info]" = asyncio.Queue(maxsize)
+        self.workers: List["asyncio.Task[None]"] = []
+
+
+class InstrumentationQueue:
+    def __init__(
+        self,
+        instrumentations: Sequence[Callable[[metrics.Info], Awaitable[None]]],
+        maxsize: int = 1000,
+        workers: int = 1,
+        overflow: str = "drop_oldest",
+        timeout: Optional[float] = None,
+        shutdown_timeout: Optional[float] = 5.0,
+        metric_namespace: str = "",
+        metric_subsystem: str = "",
+        registry: CollectorRegistry = REGISTRY,
+    ) -> None:
+        """Creates a bounded queue for async instrumentations.
+
+        Registers the following metrics:
+
+        * `http_instrumentation_queue_depth`: Number of requests waiting for
+            their async instrumentations to be run.
+        * `http_instrumentation_dropped_total`: Requests that have not been
+            instrumented because the queue was full.
+        * `http_instrumentation_timeouts_total`: Async instrumentations that
+            have been cancelled because they exceeded the timeout.
+
+        Args:
+            instrumentations: Async instrumentations to run for every queued
+                `Info`. The sequence is not copied, so instrumentations added
+                later on are picked up.
+
+            maxsize (int): Maximum number of queued requests per event loop.
+                Defaults to `1000`.
+
+            workers (int): Number of worker tasks per event loop. Defaults
+                to `1`.
+
+            overflow (str): What to do if the queue is full. Either
+                `"drop_oldest"` to make room by dropping the oldest queued
+                request or `"drop_newest"` to drop the new request. Defaults
+                to `"drop_oldest"`.
+
+            timeout (float, optional): Seconds after which a single async
+                instrumentation call is cancelled. Defaults to `None`.
+
+            shutdown_timeout (float, optional): Seconds to process remaining
+                requests on shutdown of the app at most. Requests still queued
+                afterwards are dropped and logged. Defaults to `5.0`.
+
+        Raises:
+            ValueError: If `maxsize` or `workers` is not positive or if
+                `overflow` is unknown.
+        """
+
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive.")
+        if workers < 1:
+            raise ValueError("workers must be positive.")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"overflow must be one of {OVERFLOW_POLICIES}, got '{overflow}'."
+            )
+
+        self.instrumentations = instrumentations
+        self.maxsize = maxsize
+        self.workers = workers
+        self.overflow = overflow
+        self.timeout = timeout
+        self.shutdown_timeout = shutdown_timeout
+
+        self._states: Dict[asyncio.AbstractEventLoop, _LoopState] = {}
+
+        self.depth = metrics.register_or_reuse(
+            Gauge,
+            name="http_instrumentation_queue_depth",
+            documentation="Number of requests waiting for async instrumentations.",
+            namespace=metric_namespace,
+            subsystem=metric_subsystem,
+            registry=registry,
+        )
+        queues = _queues_by_depth.setdefault(self.depth, weakref.WeakSet())
+        queues.add(self)
+        self.depth.set_function(lambda: sum(queue.qsize() for queue in list(queues)))
+
+        self.dropped = metrics.register_or_reuse(
+            Counter,
+            name="http_instrumentation_dropped_total",
+            documentation="Requests not instrumented because the queue was full.",
+            namespace=metric_namespace,
+            subsystem=metric_subsystem,
+            registry=registry,
+        )
+
+        self.timeouts = metrics.register_or_reuse(
+            Counter,
+            name="http_instrumentation_timeouts_total",
+            documentation="Async instrumentations cancelled after the timeout.",
+            namespace=metric_namespace,
+            subsystem=metric_subsystem,
+            registry=registry,
+        )
+
+    def put(self, info: metrics.Info) -> None:
+        """Queues `info` without waiting. Must be called from a running loop.
+
+        Starts the workers of the running event loop on first use.
+        """
+
+        if not self.instrumentations:
+            return
+
+        queue = self._get_state().queue
+        if queue.full():
+            if self.overflow == "drop_newest":
+                self.dropped.inc()
+                return
+            queue.get_nowait()
+            queue.task_done()
+            self.dropped.inc()
+        queue.put_nowait(info)
+
+    def qsize(self) -> int:
+        """Returns number of queued requests across all event loops."""
+
+        return sum(state.queue.qsize() for state in list(self._states.values()))
+
+    async def join(self, timeout: Optional[float] = None) -> None:
+        """Waits until the queue of the running event loop is processed.
+
+        Args:
+            timeout (float, optional): Seconds to wait at most. Defaults
+                to `None`.
+        """
+
+        state = self._states.get(asyncio.get_running_loop())
+        if state is None:
+            return
+        try:
+            await asyncio.wait_for(state.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def close(self, timeout: Optional[float] = None) -> None:
+        """Processes remaining requests and stops workers of the running loop.
+
+        Args:
+            timeout (float, optional): Seconds to wait for remaining requests
+                at most. Defaults to `None`.
+        """
+
+        await self.join(timeout)
+        state = self._states.pop(asyncio.get_running_loop(), None)
+        if state is None:
+            return
+        for worker in state.workers:
+            worker.cancel()
+
+        remaining = state.queue.qsize()
+        if remaining:
+            logger.warning(
+                "Dropped %d queued requests whose async instrumentations did "
+                "not run within %s seconds.",
+                remaining,
+                timeout,
+            )
+
+    async def lifespan(
+        self, app: ASGIApp, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        """Runs lifespan of `app` and processes remaining requests on shutdown.
+
+        Waits at most `shutdown_timeout` seconds for the remaining requests.
+        """
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"].startswith("lifespan.shutdown."):
+                await self.close(self.shutdown_timeout)
+            await send(message)
+
+        await app(scope, receive, send_wrapper)
+
+    def _get_state(self) -> _LoopState:
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None:
+            # Forget states of loops that have been closed in the meantime.
+            for closed in [other for other in self._states if other.is_closed()]:
+                del self._states[closed]
+
+            state = _LoopState(self.maxsize)
+            state.workers = [
+                loop.create_task(self._work(state.queue)) for _ in range(self.workers)
+            ]
+            self._states[loop] = state
+        return state
+
+    async def _work(self, queue: "asyncio.Queue[metrics.Info]") -> None:
+        while True:
+            info = await queue.get()
+            try:
+                for instrumentation in self.instrumentations:
+                    await self._run(instrumentation, info)
+            finally:
+                queue.task_done()
+
+    async def _run(
+        self,
+        instrumentation: Callable[[metrics.Info], Awaitable[None]],
+        info: metrics.Info,
+    ) -> None:
+        try:
+            if self.timeout is None:
+                await instrumentation(info)
+            else:
+                await asyncio.wait_for(instrumentation(info), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts.inc()
+        except Exception as exc:
+            # There is no request to fail anymore, so report like any other
+            # exception in a background task.
+            asyncio.get_running_loop().call_exception_handler(
+                {
+                    "message": "Exception in async instrumentation",
+                    "exception": exc,
+                }
+            )
@@ -0,0 +1,252 @@
+"""
+This module contains the optional batching of metric observations.
+
+Every `inc()` and `observe()` on a Prometheus client metric takes a lock. With
+batching enabled, the instrumentation functions in `metrics` record into plain
+per event loop buffers instead. The buffers are merged into the actual metrics
+periodically by a background task and always right before the metrics are
+rendered by the endpoint added with `expose()`.
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional
+
+from prometheus_client import Counter, Histogram, Summary
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class _Buffer:
+    """Pending observations of a single event loop.
+
+    Only ever modified from the thread running the event loop, so no locking
+    is required.
+    """
+
+    __slots__ = ("counters", "summaries", "histograms")
+
+    def __init__(self) -> None:
+        self.counters: Dict[Any, float] = {}
+        self.summaries: Dict[Any, List[float]] = {}
+        self.histograms: Dict[Any, List[Any]] = {}
+
+    def merge(self) -> None:
+        """Merges pending observations into the metrics and resets buffer."""
+
+        counters, self.counters = self.counters, {}
+        summaries, self.summaries = self.summaries, {}
+        histograms, self.histograms = self.histograms, {}
+
+        for counter, amount in counters.items():
+            counter.inc(amount)
+
+        for summary, (count, total) in summaries.items():
+            summary._count.inc(count)
+            summary._sum.inc(total)
+
+        for histogram, (bucket_counts, total) in histograms.items():
+            for bucket, count in zip(histogram._buckets, bucket_counts):
+                if count:
+                    bucket.inc(count)
+            histogram._sum.inc(total)
+
+
+class MetricBatcher:
+    def __init__(self, flush_interval: float = 1.0) -> None:
+        """Creates a batcher for metric observations.
+
+        Args:
+            flush_interval (float): Seconds between periodic flushes. Only
+                relevant if the background task is started via `lifespan()`.
+                Defaults to `1.0`.
+        """
+
+        self.flush_interval = flush_interval
+        self._buffers: Dict[asyncio.AbstractEventLoop, _Buffer] = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, metric: Any) -> Any:
+        """Returns batching proxy for a `Counter`, `Summary` or `Histogram`.
+
+        Works with both unlabeled metrics and labeled children. Other metric
+        types are returned as they are.
+        """
+
+        if isinstance(metric, Counter):
+            return _BatchedCounter(self, metric)
+        if isinstance(metric, Summary):
+            return _BatchedSummary(self, metric)
+        if isinstance(metric, Histogram):
+            return _BatchedHistogram(self, metric)
+        return metric
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Merges all pending observations into the metrics.
+
+        Buffers of event loops running in other threads are merged within
+        these loops to avoid racing with requests that are being recorded.
+
+        Args:
+            timeout (float): Seconds to wait for each event loop running in
+                another thread. Observations of loops that do not respond in
+                time are merged with the next flush. Defaults to `5.0`.
+        """
+
+        with self._lock:
+            buffers = list(self._buffers.items())
+
+        try:
+            current_loop: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+        except RuntimeError:
+            current_loop = None
+
+        for loop, buffer in buffers:
+            if loop is current_loop or not loop.is_running():
+                buffer.merge()
+                if loop.is_closed():
+                    with self._lock:
+                        self._buffers.pop(loop, None)
+                continue
+
+            future: "concurrent.futures.Future[None]" = concurrent.futures.Future()
+
+            def merge(buffer: _Buffer = buffer, future: Any = future) -> None:
+                try:
+                    buffer.merge()
+                finally:
+                    future.set_result(None)
+
+            try:
+                loop.call_soon_threadsafe(merge)
+            except RuntimeError:
+                # Loop got closed in the meantime.
+                buffer.merge()
+                continue
+            concurrent.futures.wait([future], timeout=timeout)
+
+    async def lifespan(
+        self, app: ASGIApp, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        """Runs lifespan of `app` with periodic flushing in the background.
+
+        The background task is started on startup. On shutdown it is stopped
+        and all pending observations are flushed.
+        """
+
+        task: Optional["asyncio.Task[None]"] = None
+
+        async def receive_wrapper() -> Message:
+            nonlocal task
+            message = await receive()
+            if message["type"] == "lifespan.startup" and task is None:
+                task = asyncio.create_task(self._flush_periodically())
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"].startswith("lifespan.shutdown."):
+                if task is not None:
+                    task.cancel()
+                self.flush()
+            await send(message)
+
+        try:
+            await app(scope, receive_wrapper, send_wrapper)
+        finally:
+            if task is not None:
+                task.cancel()
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            buffer = self._buffers.get(asyncio.get_running_loop())
+            if buffer is not None:
+                buffer.merge()
+
+    def _buffer(self) -> Optional[_Buffer]:
+        """Returns buffer of the running event loop or `None` if no loop."""
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+
+        buffer = self._buffers.get(loop)
+        if buffer is None:
+            with self._lock:
+                buffer = self._buffers.setdefault(loop, _Buffer())
+        return buffer
+
+
+class _BatchedCounter:
+    __slots__ = ("_batcher", "_counter")
+
+    def __init__(self, batcher: MetricBatcher, counter: Counter) -> None:
+        self._batcher = batcher
+        self._counter = counter
+
+    def inc(self, amount: float = 1) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only be incremented by non-negative amounts.")
+
+        buffer = self._batcher._buffer()
+        if buffer is None:
+            self._counter.inc(amount)
+            return
+
+        counters = buffer.counters
+        counters[self._counter] = counters.get(self._counter, 0.0) + amount
+
+
+class _BatchedSummary:
+    __slots__ = ("_batcher", "_summary")
+
+    def __init__(self, batcher: MetricBatcher, summary: Summary) -> None:
+        self._batcher = batcher
+        self._summary = summary
+
+    def observe(self, amount: float) -> None:
+        self.observe_weighted(amount, 1)
+
+    def observe_weighted(self, amount: float, weight: float) -> None:
+        """Records `amount` as if it had been observed `weight` times."""
+
+        buffer = self._batcher._buffer()
+        if buffer is None:
+            self._summary._count.inc(weight)
+            self._summary._sum.inc(amount * weight)
+            return
+
+        pending = buffer.summaries.get(self._summary)
+        if pending is None:
+            buffer.summaries[self._summary] = [weight, amount * weight]
+        else:
+            pending[0] += weight
+            pending[1] += amount * weight
+
+
+class _BatchedHistogram:
+    __slots__ = ("_batcher", "_histogram")
+
+    def __init__(self, batcher: MetricBatcher, histogram: Histogram) -> None:
+        self._batcher = batcher
+        self._histogram = histogram
+
+    def observe(self, amount: float) -> None:
+        buffer = self._batcher._buffer()
+        if buffer is None:
+            self._histogram.observe(amount)
+            return
+
+        histogram = self._histogram
+        pending: Optional[List[Any]] = buffer.histograms.get(histogram)
+        if pending is None:
+            pending = buffer.histograms[histogram] = [
+                [0] * len(histogram._upper_bounds),
+                0.0,
+            ]
+        # Same bucket as chosen by `Histogram.observe()`: First upper bound
+        # that is greater than or equal to the amount.
+        pending[0][bisect_left(histogram._upper_bounds, amount)] += 1
+        pending[1] += amount
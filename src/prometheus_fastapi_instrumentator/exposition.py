@@ -0,0 +1,648 @@
+"""
+This module contains helpers for the metrics endpoint added with `expose()`.
+
+Rendering all metrics is expensive for registries with many series. The
+`ExpositionCache` keeps the rendered bytes for a while, so scrapes that arrive
+within the time to live share one render. `SingleFlight` lets scrapes that
+arrive while a render is in flight wait for it instead of starting their own.
+`ExecutorRender` moves rendering to a dedicated executor, away from the
+threadpool that serves sync request handlers. `iter_latest()` and
+`iter_gzip()` render and compress family by family for streaming responses.
+`SeriesRenderer` reuses the rendered names and labels of series across scrapes.
+"""
+
+import asyncio
+import concurrent.futures
+import contextlib
+import copy
+import gzip
+import os
+import threading
+import time
+import zlib
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    ParamSpec,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.metrics_core import Metric
+from prometheus_client.samples import Sample
+from prometheus_client.utils import floatToGoString
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+from prometheus_fastapi_instrumentator import metrics
+
+
+class Snapshot:
+    """Rendered metrics at a point in time."""
+
+    __slots__ = ("data", "created", "_gzipped")
+
+    def __init__(self, data: bytes, created: float) -> None:
+        self.data = data
+        self.created = created
+        self._gzipped: Optional[bytes] = None
+
+    @property
+    def gzipped(self) -> bytes:
+        """Data compressed with gzip. Compressed on first access."""
+
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.data)
+        return self._gzipped
+
+
+class ExpositionCache:
+    def __init__(
+        self,
+        render: Callable[[], bytes],
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Creates a cache for rendered metrics.
+
+        Args:
+            render: Function without arguments that renders all metrics.
+
+            ttl (float): Seconds a snapshot is served before it is rendered
+                again.
+
+            clock: Function without arguments that returns the current time in
+                seconds. Defaults to `time.monotonic`.
+
+        Raises:
+            ValueError: If `ttl` is not positive.
+        """
+
+        if ttl <= 0:
+            raise ValueError(f"ttl must be positive, got {ttl}.")
+
+        self.render = render
+        self.ttl = ttl
+        self.clock = clock
+        self._snapshot: Optional[Snapshot] = None
+
+    def get(self) -> Snapshot:
+        """Returns current snapshot. Renders a new one if it has expired."""
+
+        snapshot = self.fresh()
+        if snapshot is None:
+            snapshot = self.store(self.render())
+        return snapshot
+
+    def fresh(self) -> Optional[Snapshot]:
+        """Returns current snapshot or `None` if it has expired."""
+
+        snapshot = self._snapshot
+        if snapshot is None or self.clock() - snapshot.created >= self.ttl:
+            return None
+        return snapshot
+
+    def store(self, data: bytes) -> Snapshot:
+        """Replaces current snapshot with newly rendered `data`."""
+
+        snapshot = Snapshot(data, self.clock())
+        self._snapshot = snapshot
+        return snapshot
+
+    def age(self, snapshot: Snapshot) -> float:
+        """Returns seconds since `snapshot` has been rendered."""
+
+        return max(self.clock() - snapshot.created, 0.0)
+
+
+class SingleFlight:
+    def __init__(
+        self,
+        render: Callable[[], bytes],
+        render_async: Optional[Callable[[], Awaitable[bytes]]] = None,
+    ) -> None:
+        """Coalesces concurrent calls of `render` into a single call.
+
+        Calls that arrive while another call is in flight wait for it and get
+        the same bytes, or the same exception. Calls that arrive afterwards
+        start a new render. With `call_async()` the render runs in its own
+        task, so cancelling the call that started it, for example because its
+        client disconnected, does not cancel the render for the others.
+
+        Args:
+            render: Function without arguments that renders all metrics.
+
+            render_async: Coroutine function used by `call_async()` to render.
+                Defaults to running `render` in the threadpool.
+        """
+
+        self.render = render
+        self.render_async = render_async or (lambda: run_in_threadpool(render))
+        self._lock = threading.Lock()
+        self._flight: Optional["concurrent.futures.Future[bytes]"] = None
+        # Strong references to renders in flight. The event loop keeps weak
+        # references to tasks only.
+        self._tasks: Set["asyncio.Task[bytes]"] = set()
+
+    def __call__(self) -> bytes:
+        """Renders or waits for the render in flight. Blocks the thread."""
+
+        flight, is_leader = self._join()
+        if not is_leader:
+            return flight.result()
+
+        try:
+            data = self.render()
+        except BaseException as exc:
+            self._land(flight, exc=exc)
+            raise
+        self._land(flight, data=data)
+        return data
+
+    async def call_async(self) -> bytes:
+        """Like calling the object, but without blocking the event loop."""
+
+        flight, is_leader = self._join()
+        if is_leader:
+            task = asyncio.ensure_future(self.render_async())
+            self._tasks.add(task)
+            task.add_done_callback(lambda task: self._land_task(flight, task))
+
+        # Shielded, so a cancelled caller neither cancels the render nor the
+        # shared future.
+        return await asyncio.shield(asyncio.wrap_future(flight))
+
+    def _join(self) -> Tuple["concurrent.futures.Future[bytes]", bool]:
+        """Returns the flight to wait for and whether the caller leads it."""
+
+        with self._lock:
+            if self._flight is not None:
+                return self._flight, False
+            self._flight = concurrent.futures.Future()
+            return self._flight, True
+
+    def _land_task(
+        self, flight: "concurrent.futures.Future[bytes]", task: "asyncio.Task[bytes]"
+    ) -> None:
+        self._tasks.discard(task)
+        if task.cancelled():
+            self._land(flight, exc=asyncio.CancelledError())
+        elif task.exception() is not None:
+            self._land(flight, exc=task.exception())
+        else:
+            self._land(flight, data=task.result())
+
+    def _land(
+        self,
+        flight: "concurrent.futures.Future[bytes]",
+        data: bytes = b"",
+        exc: Optional[BaseException] = None,
+    ) -> None:
+        with self._lock:
+            self._flight = None
+        if exc is not None:
+            flight.set_exception(exc)
+        else:
+            flight.set_result(data)
+
+
+def multiprocess_registry() -> CollectorRegistry:
+    """Returns registry that collects all processes from the multiprocess dir."""
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_multiprocess() -> bytes:
+    """Renders metrics of all processes from `PROMETHEUS_MULTIPROC_DIR`.
+
+    Defined on module level, so it can be sent to a process executor.
+    """
+
+    return generate_latest(multiprocess_registry())
+
+
+class _FamilyCollector:
+    """Collector that returns a single, already collected metric family."""
+
+    __slots__ = ("family",)
+
+    def __init__(self, family: Metric) -> None:
+        self.family = family
+
+    def collect(self) -> Iterable[Metric]:
+        return (self.family,)
+
+
+def iter_latest(registry: CollectorRegistry = REGISTRY) -> Iterator[bytes]:
+    """Renders metrics like `generate_latest()`, one family at a time.
+
+    The chunks joined are identical to the output of `generate_latest()`, but
+    only a single family is held in memory at once.
+    """
+
+    for family in registry.collect():
+        yield generate_latest(_FamilyCollector(family))
+
+
+# Suffixes of OpenMetrics samples that `generate_latest()` moves into gauges
+# after the family, in this order.
+OM_SUFFIXES = ("_created", "_gcount", "_gsum")
+
+
+class _CachedSeries:
+    """Rendered parts of a series that do not change between scrapes."""
+
+    __slots__ = ("prefix", "suffix", "header")
+
+    def __init__(self, prefix: str, suffix: str = "", header: str = "") -> None:
+        self.prefix = prefix
+        self.suffix = suffix
+        self.header = header
+
+
+class _CachedFamily:
+    """Rendered header of a family and the series seen in it."""
+
+    __slots__ = ("header", "series")
+
+    def __init__(self, header: str) -> None:
+        self.header = header
+        self.series: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], _CachedSeries] = {}
+
+
+class SeriesRenderer:
+    def __init__(self) -> None:
+        """Renders metrics like `generate_latest()`, reusing unchanged parts.
+
+        Most of the time spent in `generate_latest()` goes into escaping and
+        formatting names and labels, although usually only values change
+        between scrapes. This renderer keeps the `HELP` and `TYPE` lines of
+        every family and the `name{labels} ` prefix of every series, so
+        subsequent scrapes only format values and timestamps.
+
+        The cached parts are produced by `generate_latest()` itself on first
+        sight, so the output is identical to it for every supported version
+        of the Prometheus client. Families and series that disappear from the
+        registry are dropped from the cache.
+        """
+
+        self._families: Dict[Tuple[str, str, str], _CachedFamily] = {}
+
+    def render(self, registry: CollectorRegistry = REGISTRY) -> bytes:
+        """Renders all metrics of `registry`. Identical to `generate_latest()`."""
+
+        return "".join(self._render_all(registry)).encode("utf-8")
+
+    def iter_render(self, registry: CollectorRegistry = REGISTRY) -> Iterator[bytes]:
+        """Like `iter_latest()`, with the cached parts reused."""
+
+        for text in self._render_all(registry):
+            yield text.encode("utf-8")
+
+    def _render_all(self, registry: CollectorRegistry) -> Iterator[str]:
+        families = self._families
+        seen: Dict[Tuple[str, str, str], _CachedFamily] = {}
+        for family in registry.collect():
+            key = (family.name, family.type, family.documentation)
+            cached = families.get(key)
+            if cached is None:
+                cached = _CachedFamily(_probe(family, [])[0])
+            seen[key] = cached
+            yield self.render_family(family, cached)
+        self._families = seen
+
+    def render_family(self, family: Metric, cached: _CachedFamily) -> str:
+        """Renders a single family with the cached parts of its series."""
+
+        output = [cached.header]
+        om_samples: Dict[str, List[str]] = {}
+        series = cached.series
+        for sample in family.samples:
+            key = (sample.name, tuple(sample.labels.items()))
+            entry = series.get(key)
+            if entry is None:
+                entry = series[key] = _cache_series(family, sample)
+
+            if sample.timestamp is None:
+                line = entry.prefix + floatToGoString(sample.value) + "\n"
+            else:
+                line = "{}{} {:d}\n".format(
+                    entry.prefix,
+                    floatToGoString(sample.value),
+                    int(float(sample.timestamp) * 1000),
+                )
+
+            if entry.suffix:
+                om_samples.setdefault(entry.suffix, [entry.header]).append(line)
+            else:
+                output.append(line)
+
+        # Every sample is cached by now, so more entries mean stale series.
+        if len(series) > len(family.samples):
+            cached.series = {}
+
+        for suffix in sorted(om_samples):
+            output.extend(om_samples[suffix])
+        return "".join(output)
+
+
+def _probe(family: Metric, samples: List[Sample]) -> List[str]:
+    """Renders `family` with `samples` by `generate_latest()` into lines."""
+
+    probe = copy.copy(family)
+    probe.samples = samples
+    text = generate_latest(_FamilyCollector(probe)).decode("utf-8")
+    lines = text.splitlines(keepends=True)
+    return ["".join(lines[:2])] + lines[2:]
+
+
+def _cache_series(family: Metric, sample: Sample) -> _CachedSeries:
+    """Renders the parts of `sample` that do not change between scrapes."""
+
+    lines = _probe(family, [sample._replace(value=0.0, timestamp=None)])
+    prefix = lines[-1][: -len(floatToGoString(0.0)) - 1]
+    for suffix in OM_SUFFIXES:
+        if sample.name == family.name + suffix:
+            return _CachedSeries(prefix, suffix, "".join(lines[1:-1]))
+    return _CachedSeries(prefix)
+
+
+def iter_gzip(chunks: Iterable[bytes], compresslevel: int = 9) -> Iterator[bytes]:
+    """Compresses `chunks` incrementally into the gzip format.
+
+    Memory is bounded by the compression window instead of the total size.
+    The level defaults to the one of `gzip.compress()`.
+    """
+
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _timed_call(render: Callable[[], bytes], submitted: float) -> Tuple[float, bytes]:
+    """Calls `render` and returns the time spent in the queue with its result.
+
+    `time.monotonic` is system wide, so this works in other processes too.
+    """
+
+    return time.monotonic() - submitted, render()
+
+
+class ExecutorRender:
+    # Buckets of the queue wait histogram in seconds.
+    queue_wait_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+    def __init__(
+        self,
+        executor: concurrent.futures.Executor,
+        render: Callable[[], bytes],
+        prepare: Optional[Callable[[], None]] = None,
+        registry: CollectorRegistry = REGISTRY,
+    ) -> None:
+        """Renders metrics in `executor` when awaited.
+
+        Registers the histogram `http_instrumentation_render_queue_wait_seconds`
+        with the time renders wait in the executor before they start.
+
+        Args:
+            executor: Executor to render in. Usually a dedicated executor with
+                a single worker. Process executors are only supported in
+                multiprocess mode, as the metrics of other processes are read
+                from `PROMETHEUS_MULTIPROC_DIR` anyway.
+
+            render: Function without arguments that renders all metrics. Used
+                with thread executors.
+
+            prepare: Function without arguments that is called in this process
+                before rendering in a process executor. For example to flush
+                batched observations. Defaults to `None`.
+
+        Raises:
+            ValueError: If `executor` is a process executor but the
+                multiprocess mode is not enabled.
+        """
+
+        self.executor = executor
+        self.render = render
+        self.prepare = prepare
+
+        self.is_process_executor = isinstance(
+            executor, concurrent.futures.ProcessPoolExecutor
+        )
+        if self.is_process_executor and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+            raise ValueError(
+                "Process executors need PROMETHEUS_MULTIPROC_DIR to be set, "
+                "the metrics of this process cannot be read otherwise."
+            )
+
+        self.queue_wait = metrics.register_or_reuse(
+            Histogram,
+            name="http_instrumentation_render_queue_wait_seconds",
+            documentation="Time renders of the metrics wait in the executor.",
+            buckets=self.queue_wait_buckets,
+            registry=registry,
+        )
+
+    async def __call__(self) -> bytes:
+        """Renders metrics in the executor without blocking the event loop."""
+
+        render = self.render
+        if self.is_process_executor:
+            if self.prepare is not None:
+                self.prepare()
+            render = render_multiprocess
+
+        future = self.executor.submit(_timed_call, render, time.monotonic())
+        queue_wait, data = await asyncio.wrap_future(future)
+        self.queue_wait.observe(max(queue_wait, 0.0))
+        return data
+
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+class LazyExecutor(concurrent.futures.Executor):
+    def __init__(self, factory: Callable[[], concurrent.futures.Executor]) -> None:
+        """Executor that creates the executor it submits to on first use.
+
+        Shutting it down shuts down the current executor only. The next
+        submit creates a new one, so it can be shut down at the end of every
+        lifespan of an app and still serve the next lifespan.
+
+        Args:
+            factory: Function without arguments that creates the executor.
+        """
+
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._executor: Optional[concurrent.futures.Executor] = None
+
+    def submit(
+        self, fn: Callable[P, T], /, *args: P.args, **kwargs: P.kwargs
+    ) -> "concurrent.futures.Future[T]":
+        with self._lock:
+            if self._executor is None:
+                self._executor = self.factory()
+            return self._executor.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+def shutdown_on_exit(app: Starlette, executor: concurrent.futures.Executor) -> None:
+    """Shuts down `executor` after the lifespan of `app` has ended.
+
+    Wraps the lifespan context of the router, so requests are not affected.
+    The lifespan of apps mounted into other apps is not run by Starlette, so
+    their executors stay alive until the interpreter exits.
+    """
+
+    lifespan_context = app.router.lifespan_context
+
+    @contextlib.asynccontextmanager
+    async def lifespan_with_shutdown(app: Any) -> AsyncIterator[Any]:
+        try:
+            async with lifespan_context(app) as state:
+                yield state
+        finally:
+            executor.shutdown(wait=False)
+
+    app.router.lifespan_context = lifespan_with_shutdown
+
+
+class MetricsEndpoint:
+    def __init__(
+        self,
+        render: Callable[[], bytes],
+        should_gzip: bool = False,
+        cache_ttl: Optional[float] = None,
+        should_coalesce_scrapes: bool = False,
+        executor: Optional[concurrent.futures.Executor] = None,
+        prepare: Optional[Callable[[], None]] = None,
+        registry: CollectorRegistry = REGISTRY,
+        stream: Optional[Callable[[], Iterator[bytes]]] = None,
+    ) -> None:
+        """Creates the endpoint that serves rendered metrics.
+
+        See `Instrumentator.expose()` for the arguments.
+
+        Args:
+            render: Function without arguments that renders all metrics.
+
+            prepare: Function without arguments that is called in this process
+                before rendering in a process executor. Defaults to `None`.
+
+            stream: Function without arguments that returns an iterator of
+                rendered chunks. If given, responses are streamed. Defaults to
+                `None`.
+
+        Raises:
+            ValueError: If `stream` is combined with caching, coalescing or an
+                executor, which all need the complete rendered bytes.
+        """
+
+        if stream is not None and (cache_ttl or should_coalesce_scrapes or executor):
+            raise ValueError(
+                "Streaming cannot be combined with cache_ttl, "
+                "should_coalesce_scrapes or rendering in an executor."
+            )
+
+        self.should_gzip = should_gzip
+        self.render = render
+        self.stream = stream
+
+        self.render_async: Optional[Callable[[], Awaitable[bytes]]] = None
+        if executor is not None:
+            self.render_async = ExecutorRender(executor, render, prepare, registry)
+
+        if should_coalesce_scrapes:
+            single_flight = SingleFlight(render, self.render_async)
+            self.render = single_flight
+            if self.render_async is not None:
+                self.render_async = single_flight.call_async
+
+        self.cache = ExpositionCache(self.render, cache_ttl) if cache_ttl else None
+
+    @property
+    def endpoint(self) -> Callable[[Request], Any]:
+        """Sync endpoint, or async endpoint if rendering in an executor."""
+
+        if self.stream is not None:
+            return self.metrics_stream
+        return self.metrics if self.render_async is None else self.metrics_async
+
+    def metrics(self, request: Request) -> Response:
+        """Endpoint that serves Prometheus metrics."""
+
+        if self.cache is None:
+            return self.respond(request, Snapshot(self.render(), 0.0))
+        return self.respond(request, self.cache.get())
+
+    async def metrics_async(self, request: Request) -> Response:
+        """Endpoint that serves Prometheus metrics rendered in an executor."""
+
+        assert self.render_async is not None
+
+        if self.cache is None:
+            return self.respond(request, Snapshot(await self.render_async(), 0.0))
+        snapshot = self.cache.fresh()
+        if snapshot is None:
+            snapshot = self.cache.store(await self.render_async())
+        return self.respond(request, snapshot)
+
+    def metrics_stream(self, request: Request) -> Response:
+        """Endpoint that streams Prometheus metrics family by family."""
+
+        assert self.stream is not None
+
+        chunks = self.stream()
+        if self._accepts_gzip(request):
+            return StreamingResponse(
+                iter_gzip(chunks),
+                media_type=CONTENT_TYPE_LATEST,
+                headers={"Content-Encoding": "gzip"},
+            )
+        return StreamingResponse(chunks, media_type=CONTENT_TYPE_LATEST)
+
+    def respond(self, request: Request, snapshot: Snapshot) -> Response:
+        """Builds response, compressed if enabled and accepted by the client."""
+
+        if self._accepts_gzip(request):
+            response = Response(content=snapshot.gzipped)
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = Response(content=snapshot.data)
+        response.headers["Content-Type"] = CONTENT_TYPE_LATEST
+        if self.cache is not None:
+            response.headers["Age"] = str(int(self.cache.age(snapshot)))
+        return response
+
+    def _accepts_gzip(self, request: Request) -> bool:
+        return self.should_gzip and "gzip" in request.headers.get("Accept-Encoding", "")
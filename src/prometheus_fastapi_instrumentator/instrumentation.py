@@ -1,14 +1,17 @@
-import gzip
 import importlib.util
 import inspect
 import os
 import re
+import time
 import warnings
+from concurrent.futures import Executor, ThreadPoolExecutor
 from enum import Enum
 from typing import (
     Any,
     Awaitable,
     Callable,
+    Dict,
+    Iterator,
     List,
     Optional,
     Sequence,
@@ -16,18 +19,20 @@ from typing import (
     cast,
 )
 
-from prometheus_client import (
-    CONTENT_TYPE_LATEST,
-    REGISTRY,
-    CollectorRegistry,
-    generate_latest,
-    multiprocess,
-)
+from prometheus_client import REGISTRY, CollectorRegistry, generate_latest
 from starlette.applications import Starlette
-from starlette.requests import Request
-from starlette.responses import Response
 
-from prometheus_fastapi_instrumentator import metrics
+from prometheus_fastapi_instrumentator import metrics, route_resolution
+from prometheus_fastapi_instrumentator.background import InstrumentationQueue
+from prometheus_fastapi_instrumentator.batching import MetricBatcher
+from prometheus_fastapi_instrumentator.exposition import (
+    LazyExecutor,
+    MetricsEndpoint,
+    SeriesRenderer,
+    iter_latest,
+    multiprocess_registry,
+    shutdown_on_exit,
+)
 from prometheus_fastapi_instrumentator.middleware import (
     PrometheusInstrumentatorMiddleware,
 )
@@ -50,6 +55,33 @@ class PrometheusFastApiInstrumentator:
         inprogress_name: str = "http_requests_inprogress",
         inprogress_labels: bool = False,
         registry: Union[CollectorRegistry, None] = None,
+        should_cache_route_names: bool = False,
+        should_index_routes: bool = False,
+        should_use_lean_info: bool = False,
+        should_track_request_body: bool = False,
+        should_track_send_blocked_time: bool = False,
+        should_warm_up_series: bool = False,
+        should_batch_metrics: bool = False,
+        should_queue_async_instrumentations: bool = False,
+        max_body_size: Optional[int] = None,
+        body_observers: List[Callable[[], Any]] = [],
+        excluded_paths: List[str] = [],
+        excluded_path_prefixes: List[str] = [],
+        route_name_cache_size: int = 1024,
+        metrics_flush_interval: float = 1.0,
+        async_instrumentation_queue_size: int = 1000,
+        async_instrumentation_workers: int = 1,
+        async_instrumentation_overflow: str = "drop_oldest",
+        async_instrumentation_timeout: Optional[float] = None,
+        async_instrumentation_shutdown_timeout: Optional[float] = 5.0,
+        sampling_rate: float = 1.0,
+        handler_sampling_rates: Dict[str, float] = {},
+        overhead_budget_percent: Optional[float] = None,
+        overhead_budget_seconds: Optional[float] = None,
+        min_sampling_scale: float = 0.01,
+        clock: Callable[[], int] = time.perf_counter_ns,
+        warm_up_status_codes: Sequence[int] = (200, 400, 500),
+        max_label_combinations: Optional[int] = metrics.DEFAULT_MAX_LABEL_COMBINATIONS,
     ) -> None:
         """Create a Prometheus FastAPI (and Starlette) Instrumentator.
 
@@ -66,7 +98,9 @@ class PrometheusFastApiInstrumentator:
                 template be grouped to handler `none`? Defaults to `True`.
 
             should_round_latency_decimals: Should recorded latencies be
-                rounded to a certain number of decimals?
+                rounded to a certain number of decimals? Rounding is done on
+                the integer nanoseconds of the clock when they are converted
+                to seconds.
 
             should_respect_env_var (bool): Should the instrumentator only work - for
                 example the methods `instrument()` and `expose()` - if a
@@ -115,6 +149,175 @@ class PrometheusFastApiInstrumentator:
                 you need to run multiple apps at the same time, with their own
                 registries, for example during testing.
 
+            should_cache_route_names (bool): Should resolved route templates be
+                kept in a bounded LRU cache? Skips walking the route tree for
+                repeated requests. Only templated paths are cached. The cache
+                is available as `route_name_cache`, and its `info()` method
+                returns hit, miss, eviction and rejection counters. See also
+                `route_name_cache_size`. Defaults to `False`.
+
+            should_index_routes (bool): Should route templates be resolved with
+                a path segment trie built from the route tree of the app? The
+                trie is built on the first request. Call
+                `rebuild_route_index()` after adding routes at run-time.
+                Defaults to `False`.
+
+            should_use_lean_info (bool): Should the request and response
+                objects passed to instrumentations only be built if they are
+                actually accessed? The `Info` object then carries the raw ASGI
+                data that the instrumentation functions in `metrics` read
+                directly. Defaults to `False`.
+
+            should_track_request_body (bool): Should the middleware wrap
+                `receive` to count the request body bytes and to time the
+                upload? The body is not buffered. Request size metrics then use
+                the counted bytes if the `Content-Length` header is missing, as
+                with chunked uploads. Use `metrics.upload_duration()` to record
+                upload durations. Defaults to `False`.
+
+            should_track_send_blocked_time (bool): Should the middleware
+                measure the time spent awaiting `send` of the server while
+                sending the response? Long waits mean that clients are reading
+                slowly. Use `metrics.send_blocked_time()` to record it. Adds
+                two clock reads per response message. Defaults to `False`.
+
+            should_warm_up_series (bool): Should labeled series be created
+                for all routes before the first request? The middleware then
+                walks the route tree of the app, including mounts and included
+                routers, on lifespan startup (or the first request if the
+                server does not run the lifespan) and creates the series of
+                instrumentation functions from `metrics` for every route
+                template, declared method and status of `warm_up_status_codes`.
+                Keeps series continuous across deploys. Defaults to `False`.
+
+            should_batch_metrics (bool): Should observations of the default
+                metrics be recorded into plain per event loop buffers instead of
+                taking the lock of the Prometheus client for every update? The
+                buffers are merged into the metrics every
+                `metrics_flush_interval` seconds (started with the lifespan of
+                the app), on shutdown and right before the endpoint added with
+                `expose()` renders the metrics. Scrapes served by `expose()` are
+                therefore exact. Other exposition paths and, in multiprocess
+                mode, other processes may lag behind by up to one interval.
+                Pass `batcher=instrumentator.batcher` to functions from
+                `metrics` added with `add()` to batch them too. Defaults to
+                `False`.
+
+            should_queue_async_instrumentations (bool): Should async
+                instrumentations run in background worker tasks instead of
+                being awaited before the request is finished? Requests are
+                handed to a bounded queue per event loop. Queue depth, dropped
+                requests and timeouts are exported as metrics. Remaining
+                requests are processed on shutdown of the app. See also the
+                related args starting with `async_instrumentation`. Defaults to
+                `False`.
+
+            max_body_size (int, optional): Maximum number of response body
+                bytes collected for `body_handlers`. Larger bodies are cut off
+                and `info.response_body_truncated` is set. Chunks are kept as
+                references and only joined once `info.response_body` is read.
+                Defaults to `None`.
+
+            body_observers (List[Callable[[], Any]]): Enables incremental mode
+                for `body_handlers`. Each factory is called once per request
+                and must return an object with an `update(chunk)` method, for
+                example `hashlib.sha256`. Response body chunks are fed to these
+                objects instead of being collected, so the body is never held
+                in memory. The objects are available to instrumentations as
+                `info.response_body_observers`. Defaults to `[]`.
+
+            excluded_paths (List[str]): List of literal request paths that
+                will be skipped and not instrumented. Unlike
+                `excluded_handlers`, these are compared against the raw request
+                path before any route resolution takes place, making them the
+                cheapest way to ignore frequent probes like `/health`.
+                Defaults to `[]`.
+
+            excluded_path_prefixes (List[str]): Like `excluded_paths` but every
+                request path starting with one of the given strings is skipped.
+                Defaults to `[]`.
+
+            route_name_cache_size (int): Maximum number of entries in the route
+                name cache. Ignored unless `should_cache_route_names` is `True`.
+                Defaults to `1024`.
+
+            metrics_flush_interval (float): Seconds between periodic merges of
+                batched observations. Ignored unless `should_batch_metrics` is
+                `True`. Defaults to `1.0`.
+
+            async_instrumentation_queue_size (int): Maximum number of queued
+                requests per event loop. Ignored unless
+                `should_queue_async_instrumentations` is `True`. Defaults to
+                `1000`.
+
+            async_instrumentation_workers (int): Number of worker tasks per
+                event loop. Ignored unless `should_queue_async_instrumentations`
+                is `True`. Defaults to `1`.
+
+            async_instrumentation_overflow (str): Either `"drop_oldest"` or
+                `"drop_newest"`. Decides which request is dropped if the queue
+                is full. Ignored unless `should_queue_async_instrumentations`
+                is `True`. Defaults to `"drop_oldest"`.
+
+            async_instrumentation_timeout (float, optional): Seconds after which
+                a single async instrumentation call is cancelled. Ignored unless
+                `should_queue_async_instrumentations` is `True`. Defaults to
+                `None`.
+
+            async_instrumentation_shutdown_timeout (float, optional): Seconds
+                to process remaining queued requests on shutdown at most.
+                Requests still queued afterwards are dropped and logged.
+                Ignored unless `should_queue_async_instrumentations` is
+                `True`. Defaults to `5.0`.
+
+            sampling_rate (float): Share of requests that are instrumented.
+                Must be greater than `0` and at most `1`. Sampled requests are
+                weighted by `1 / sampling_rate`, so counters and size sums of
+                the instrumentation functions in `metrics` stay unbiased.
+                Histograms only record the sampled observations. The effective
+                rates are exported as gauge `http_request_sampling_rate`.
+                Defaults to `1.0`.
+
+            handler_sampling_rates (Dict[str, float]): Sampling rates for
+                specific handlers, keyed by route template. Overrides
+                `sampling_rate` for these handlers. Defaults to `{}`.
+
+            overhead_budget_percent (float, optional): Enables adaptive
+                sampling. The middleware measures its own overhead, meaning the
+                time spent on route resolution and instrumentations outside of
+                the app. Once per second all sampling rates are scaled down if
+                the overhead exceeds the given percentage of the total request
+                duration and scaled up again once it is well below. Overhead
+                and scale are exported as metrics. Defaults to `None`.
+
+            overhead_budget_seconds (float, optional): Like
+                `overhead_budget_percent` but the budget is given as average
+                overhead per request in seconds. Only one of both can be set.
+                Defaults to `None`.
+
+            min_sampling_scale (float): Lower bound for the factor adaptive
+                sampling applies to the sampling rates. Defaults to `0.01`.
+
+            clock (callable): Function without arguments that returns the
+                current time in integer nanoseconds. Must be monotonic. Useful
+                to plug in a deterministic clock in tests or benchmarks.
+                Defaults to `time.perf_counter_ns`.
+
+            warm_up_status_codes (Sequence[int]): Status codes to create series
+                for. Grouped into classes if `should_group_status_codes` is
+                enabled. Ignored unless `should_warm_up_series` is `True`.
+                Defaults to `(200, 400, 500)`.
+
+            max_label_combinations (int, optional): Maximum number of distinct
+                label combinations per metric of the default instrumentation.
+                Further combinations are recorded in a series with all label
+                values set to `"__overflow__"` and counted in
+                `http_metric_label_overflow_total`. Guards against unbounded
+                growth from misbehaving clients, for example with
+                `should_group_untemplated=False`. Functions from `metrics`
+                passed to `add()` take the same argument. `None` disables the
+                limit. Defaults to `10_000`.
+
         Raises:
             ValueError: If `PROMETHEUS_MULTIPROC_DIR` env var is found but
                 doesn't point to a valid directory.
@@ -127,17 +330,59 @@ class PrometheusFastApiInstrumentator:
         self.should_respect_env_var = should_respect_env_var
         self.should_instrument_requests_inprogress = should_instrument_requests_inprogress
         self.should_exclude_streaming_duration = should_exclude_streaming_duration
+        self.should_cache_route_names = should_cache_route_names
+        self.should_index_routes = should_index_routes
+        self.should_use_lean_info = should_use_lean_info
+        self.should_track_request_body = should_track_request_body
+        self.should_track_send_blocked_time = should_track_send_blocked_time
+        self.should_warm_up_series = should_warm_up_series
+        self.should_batch_metrics = should_batch_metrics
+        self.should_queue_async_instrumentations = should_queue_async_instrumentations
 
         self.round_latency_decimals = round_latency_decimals
+        self.route_name_cache_size = route_name_cache_size
+        self.async_instrumentation_queue_size = async_instrumentation_queue_size
+        self.async_instrumentation_workers = async_instrumentation_workers
+        self.async_instrumentation_overflow = async_instrumentation_overflow
+        self.async_instrumentation_timeout = async_instrumentation_timeout
+        self.async_instrumentation_shutdown_timeout = (
+            async_instrumentation_shutdown_timeout
+        )
+        self.sampling_rate = sampling_rate
+        self.handler_sampling_rates = handler_sampling_rates
+        self.overhead_budget_percent = overhead_budget_percent
+        self.overhead_budget_seconds = overhead_budget_seconds
+        self.min_sampling_scale = min_sampling_scale
+        self.clock = clock
+        self.warm_up_status_codes = warm_up_status_codes
+        self.max_label_combinations = max_label_combinations
         self.env_var_name = env_var_name
         self.inprogress_name = inprogress_name
         self.inprogress_labels = inprogress_labels
 
         self.excluded_handlers = [re.compile(path) for path in excluded_handlers]
         self.body_handlers = [re.compile(path) for path in body_handlers]
+        self.max_body_size = max_body_size
+        self.body_observers = body_observers
+
+        self.excluded_paths = excluded_paths
+        self.excluded_path_prefixes = excluded_path_prefixes
+
+        self.route_name_cache: Optional[route_resolution.RouteNameCache] = None
+        if self.should_cache_route_names:
+            self.route_name_cache = route_resolution.RouteNameCache(route_name_cache_size)
+
+        self.route_index: Optional[route_resolution.RouteIndex] = None
+        if self.should_index_routes:
+            self.route_index = route_resolution.RouteIndex()
+
+        self.batcher: Optional[MetricBatcher] = None
+        if self.should_batch_metrics:
+            self.batcher = MetricBatcher(metrics_flush_interval)
 
         self.instrumentations: List[Callable[[metrics.Info], None]] = []
         self.async_instrumentations: List[Callable[[metrics.Info], Awaitable[None]]] = []
+        self.instrumentation_queue: Optional[InstrumentationQueue] = None
 
         if (
             "prometheus_multiproc_dir" in os.environ
@@ -212,6 +457,19 @@ class PrometheusFastApiInstrumentator:
         if self.should_respect_env_var and not self._should_instrumentate():
             return self
 
+        if self.should_queue_async_instrumentations:
+            self.instrumentation_queue = InstrumentationQueue(
+                self.async_instrumentations,
+                maxsize=self.async_instrumentation_queue_size,
+                workers=self.async_instrumentation_workers,
+                overflow=self.async_instrumentation_overflow,
+                timeout=self.async_instrumentation_timeout,
+                shutdown_timeout=self.async_instrumentation_shutdown_timeout,
+                metric_namespace=metric_namespace,
+                metric_subsystem=metric_subsystem,
+                registry=self.registry,
+            )
+
         app.add_middleware(
             PrometheusInstrumentatorMiddleware,
             should_group_status_codes=self.should_group_status_codes,
@@ -221,6 +479,10 @@ class PrometheusFastApiInstrumentator:
             should_respect_env_var=self.should_respect_env_var,
             should_instrument_requests_inprogress=self.should_instrument_requests_inprogress,
             should_exclude_streaming_duration=self.should_exclude_streaming_duration,
+            should_use_lean_info=self.should_use_lean_info,
+            should_track_request_body=self.should_track_request_body,
+            should_track_send_blocked_time=self.should_track_send_blocked_time,
+            should_warm_up_series=self.should_warm_up_series,
             round_latency_decimals=self.round_latency_decimals,
             env_var_name=self.env_var_name,
             inprogress_name=self.inprogress_name,
@@ -229,15 +491,48 @@ class PrometheusFastApiInstrumentator:
             async_instrumentations=self.async_instrumentations,
             excluded_handlers=self.excluded_handlers,  # type: ignore
             body_handlers=self.body_handlers,  # type: ignore
+            max_body_size=self.max_body_size,
+            body_observers=self.body_observers,
+            excluded_paths=self.excluded_paths,
+            excluded_path_prefixes=self.excluded_path_prefixes,
             metric_namespace=metric_namespace,
             metric_subsystem=metric_subsystem,
             should_only_respect_2xx_for_highr=should_only_respect_2xx_for_highr,
             latency_highr_buckets=latency_highr_buckets,
             latency_lowr_buckets=latency_lowr_buckets,
             registry=self.registry,
+            route_name_cache=self.route_name_cache,
+            route_index=self.route_index,
+            batcher=self.batcher,
+            instrumentation_queue=self.instrumentation_queue,
+            sampling_rate=self.sampling_rate,
+            handler_sampling_rates=self.handler_sampling_rates,
+            overhead_budget_percent=self.overhead_budget_percent,
+            overhead_budget_seconds=self.overhead_budget_seconds,
+            min_sampling_scale=self.min_sampling_scale,
+            clock=self.clock,
+            warm_up_status_codes=self.warm_up_status_codes,
+            max_label_combinations=self.max_label_combinations,
         )
         return self
 
+    def rebuild_route_index(self, app: Optional[Starlette] = None) -> None:
+        """Rebuilds the route index after routes have been added at run-time.
+
+        Also clears the route name cache, so templates resolved before the
+        routes changed are not reused. Does nothing unless
+        `should_index_routes` or `should_cache_route_names` is `True`.
+
+        Args:
+            app: App to index right away. If `None`, the index is rebuilt on
+                the next request.
+        """
+
+        if self.route_index is not None:
+            self.route_index.rebuild(app)
+        if self.route_name_cache is not None:
+            self.route_name_cache.clear()
+
     def expose(
         self,
         app: Starlette,
@@ -245,6 +540,12 @@ class PrometheusFastApiInstrumentator:
         endpoint: str = "/metrics",
         include_in_schema: bool = True,
         tags: Optional[List[Union[str, Enum]]] = None,
+        cache_ttl: Optional[float] = None,
+        should_coalesce_scrapes: bool = False,
+        should_render_in_executor: bool = False,
+        render_executor: Optional[Executor] = None,
+        should_stream: bool = False,
+        should_cache_series: bool = False,
         **kwargs: Any,
     ) -> "PrometheusFastApiInstrumentator":
         """Exposes endpoint for metrics.
@@ -267,6 +568,48 @@ class PrometheusFastApiInstrumentator:
             tags (List[str], optional): If you manage your routes with tags.
                 Defaults to None. Only passed to FastAPI app.
 
+            cache_ttl (float, optional): Seconds to serve rendered metrics (and
+                their compressed form if `should_gzip` is enabled) before they
+                are rendered again. Reduces the CPU cost of frequent scrapes,
+                for example by several Prometheus replicas, at the expense of
+                freshness. Responses then carry an `Age` header with the age
+                of the snapshot in whole seconds. Defaults to `None`.
+
+            should_coalesce_scrapes (bool): Should scrapes that arrive while
+                metrics are being rendered wait for that render and share its
+                result instead of rendering on their own? Useful with several
+                scrapers hitting the endpoint at the same moment, especially
+                in multiprocess mode where every render reads all files.
+                Defaults to `False`.
+
+            should_render_in_executor (bool): Should the endpoint be async and
+                render in a dedicated single thread executor? By default the
+                endpoint runs in the threadpool shared with sync request
+                handlers, so slow scrapes can starve them. The executor is
+                shut down when the lifespan of `app` ends and created again
+                on the next scrape. Registers the histogram
+                `http_instrumentation_render_queue_wait_seconds`. Defaults to
+                `False`.
+
+            render_executor (Executor, optional): Executor to render in
+                instead of the dedicated one. Implies
+                `should_render_in_executor`. A `ProcessPoolExecutor` is only
+                supported in multiprocess mode. The caller owns the executor
+                and has to shut it down. Defaults to `None`.
+
+            should_stream (bool): Should the metrics be streamed family by
+                family instead of being rendered into memory at once? With
+                `should_gzip` the stream is compressed incrementally. Keeps
+                peak memory bounded for large registries. Cannot be combined
+                with `cache_ttl`, `should_coalesce_scrapes` or rendering in an
+                executor. Defaults to `False`.
+
+            should_cache_series (bool): Should the rendered names and labels
+                of series be kept across scrapes, so only values have to be
+                formatted? Output is identical to `generate_latest()`. Costs
+                memory in the order of the rendered metrics. Defaults to
+                `False`.
+
             kwargs: Will be passed to app. Only passed to FastAPI app.
 
         Returns:
@@ -276,25 +619,45 @@ class PrometheusFastApiInstrumentator:
         if self.should_respect_env_var and not self._should_instrumentate():
             return self
 
-        def metrics(request: Request) -> Response:
-            """Endpoint that serves Prometheus metrics."""
+        def flush() -> None:
+            if self.batcher is not None:
+                self.batcher.flush()
+
+        renderer = SeriesRenderer() if should_cache_series else None
+        render_registry = renderer.render if renderer else generate_latest
+        stream_registry = renderer.iter_render if renderer else iter_latest
 
-            ephemeral_registry = self.registry
+        def registry() -> CollectorRegistry:
             if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
-                ephemeral_registry = CollectorRegistry()
-                multiprocess.MultiProcessCollector(ephemeral_registry)
+                return multiprocess_registry()
+            return self.registry
 
-            if should_gzip and "gzip" in request.headers.get("Accept-Encoding", ""):
-                resp = Response(
-                    content=gzip.compress(generate_latest(ephemeral_registry))
-                )
-                resp.headers["Content-Type"] = CONTENT_TYPE_LATEST
-                resp.headers["Content-Encoding"] = "gzip"
-            else:
-                resp = Response(content=generate_latest(ephemeral_registry))
-                resp.headers["Content-Type"] = CONTENT_TYPE_LATEST
+        def render() -> bytes:
+            flush()
+            return render_registry(registry())
+
+        def stream() -> Iterator[bytes]:
+            flush()
+            return stream_registry(registry())
 
-            return resp
+        if should_render_in_executor and render_executor is None:
+            render_executor = LazyExecutor(
+                lambda: ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="metrics-render"
+                )
+            )
+            shutdown_on_exit(app, render_executor)
+
+        endpoint_function = MetricsEndpoint(
+            render,
+            should_gzip=should_gzip,
+            cache_ttl=cache_ttl,
+            should_coalesce_scrapes=should_coalesce_scrapes,
+            executor=render_executor,
+            prepare=flush,
+            registry=self.registry,
+            stream=stream if should_stream else None,
+        ).endpoint
 
         route_configured = False
         if importlib.util.find_spec("fastapi"):
@@ -304,11 +667,13 @@ class PrometheusFastApiInstrumentator:
                 fastapi_app: FastAPI = app
                 fastapi_app.get(
                     endpoint, include_in_schema=include_in_schema, tags=tags, **kwargs
-                )(metrics)
+                )(endpoint_function)
                 route_configured = True
         if not route_configured:
             app.add_route(
-                path=endpoint, route=metrics, include_in_schema=include_in_schema
+                path=endpoint,
+                route=endpoint_function,
+                include_in_schema=include_in_schema,
             )
 
         return self
@@ -10,31 +10,132 @@ create your own instrumentation function instead of combining several functions
 from this module.
 """
 
-from typing import Callable, List, Optional, Sequence, Tuple, Union
+import weakref
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+    cast,
+)
 
 from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram, Summary
+from prometheus_client.metrics import MetricWrapperBase
+from starlette.datastructures import Headers
 from starlette.requests import Request
 from starlette.responses import Response
+from starlette.types import Scope
+
+from prometheus_fastapi_instrumentator.batching import MetricBatcher
+from prometheus_fastapi_instrumentator.status import is_2xx
+
+# Label value of the series that label combinations beyond the limit of a
+# metric are routed to.
+OVERFLOW_LABEL_VALUE = "__overflow__"
+
+# Default limit of distinct label combinations per metric.
+DEFAULT_MAX_LABEL_COMBINATIONS = 10_000
+
+MetricT = TypeVar("MetricT", bound=MetricWrapperBase)
+
+# Metrics created with `register_or_reuse()` by registry and full name.
+_reusable_metrics: "weakref.WeakKeyDictionary[CollectorRegistry, Dict[str, Any]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _content_length_from_raw(raw_headers: Sequence[Tuple[bytes, bytes]]) -> Optional[int]:
+    """Returns value of first `Content-Length` header or `None` if missing."""
+
+    for key, value in raw_headers:
+        if key.lower() == b"content-length":
+            return int(value)
+    return None
 
 
 # ------------------------------------------------------------------------------
 class Info:
+    # Slots keep the per request allocation small. `__dict__` stays in the
+    # slots because `Info` used to be a plain class and instrumentations attach
+    # their own attributes to it. Dropping it would make these fail with an
+    # AttributeError. It only costs one pointer per object: the dictionary is
+    # not created until an attribute outside the slots is set.
+    __slots__ = (
+        "_request",
+        "_response",
+        "method",
+        "modified_handler",
+        "modified_status",
+        "modified_duration",
+        "modified_duration_without_streaming",
+        "scope",
+        "status_code",
+        "response_headers",
+        "_response_body",
+        "_response_body_chunks",
+        "response_body_truncated",
+        "response_body_observers",
+        "response_body_size",
+        "time_to_first_byte",
+        "time_to_last_byte",
+        "response_chunk_count",
+        "send_blocked_time",
+        "request_body_size",
+        "upload_duration",
+        "_request_content_length",
+        "_response_content_length",
+        "_status_class",
+        "_label_values",
+        "sample_weight",
+        "__dict__",
+    )
+
     def __init__(
         self,
-        request: Request,
+        request: Optional[Request],
         response: Optional[Response],
         method: str,
         modified_handler: str,
         modified_status: str,
         modified_duration: float,
         modified_duration_without_streaming: float = 0.0,
+        scope: Optional[Scope] = None,
+        status_code: int = 500,
+        response_headers: Optional[List[Tuple[bytes, bytes]]] = None,
+        response_body: bytes = b"",
+        sample_weight: float = 1.0,
+        response_body_size: Optional[int] = None,
+        request_body_size: Optional[int] = None,
+        upload_duration: Optional[float] = None,
+        response_body_chunks: Optional[List[bytes]] = None,
+        response_body_truncated: bool = False,
+        response_body_observers: Optional[List[Any]] = None,
+        time_to_first_byte: Optional[float] = None,
+        time_to_last_byte: Optional[float] = None,
+        response_chunk_count: int = 0,
+        send_blocked_time: Optional[float] = None,
     ):
         """Creates Info object that is used for instrumentation functions.
 
         This is the only argument that is passed to the instrumentation functions.
 
+        The request and response objects can be left out if the raw ASGI data
+        is given instead. In that case they are built on first access of
+        `request` or `response`. The instrumentation functions in this module
+        only ever read the raw data if available.
+
+        Derived values like content lengths, the status class and label values
+        are computed on first access and cached on the object.
+
         Args:
-            request (Request): Python Requests request object.
+            request (Request or None): Python Requests request object.
             response (Response or None): Python Requests response object.
             method (str): Unmodified method of the request.
             modified_handler (str): Handler representation after processing by
@@ -45,15 +146,218 @@ class Info:
                 by instrumentator. For example rounding of decimals. Seconds.
             modified_duration_without_streaming (float): Latency between request arrival and response starts (i.e. first chunk duration).
                 Excluding the streaming duration. Defaults to 0.
+            scope (Scope or None): Raw ASGI scope of the request. Used to
+                build `request` lazily. Defaults to `None`.
+            status_code (int): Unmodified status code of the response.
+                Defaults to 500.
+            response_headers (list or None): Raw ASGI headers of the response.
+                Used to build `response` lazily. Defaults to `None`.
+            response_body (bytes): Response body if collected by the
+                middleware. Defaults to empty bytes.
+            sample_weight (float): Number of requests this request stands for
+                if requests are sampled. Counters and size sums are scaled by
+                it. Defaults to 1.
+            response_body_size (int or None): Number of response body bytes
+                actually sent, counted by the middleware without collecting
+                the body. Defaults to `None`.
+            request_body_size (int or None): Number of request body bytes
+                received by the app. Only counted by the middleware if
+                `should_track_request_body` is enabled. Defaults to `None`.
+            upload_duration (float or None): Seconds between the first and the
+                last request body chunk received by the app. Only measured by
+                the middleware if `should_track_request_body` is enabled.
+                Defaults to `None`.
+            response_body_chunks (list or None): Response body chunks as
+                collected by the middleware. Joined into `response_body` on
+                first access. Defaults to `None`.
+            response_body_truncated (bool): Tells you if the collected body
+                has been cut off at the configured maximum size. Defaults to
+                `False`.
+            response_body_observers (list or None): Per request body
+                observers that have been fed the response body incrementally
+                instead of collecting it. Defaults to `None`.
+            time_to_first_byte (float or None): Seconds between request arrival
+                and the first non-empty response body chunk. Defaults to `None`.
+            time_to_last_byte (float or None): Seconds between request arrival
+                and the last response body chunk. Defaults to `None`.
+            response_chunk_count (int): Number of non-empty response body
+                chunks. Defaults to 0.
+            send_blocked_time (float or None): Seconds spent awaiting the ASGI
+                `send` of the server, for example because the client reads
+                slowly. Only measured by the middleware if
+                `should_track_send_blocked_time` is enabled. Defaults to `None`.
         """
 
-        self.request = request
-        self.response = response
+        self._request = request
+        self._response = response
         self.method = method
         self.modified_handler = modified_handler
         self.modified_status = modified_status
         self.modified_duration = modified_duration
         self.modified_duration_without_streaming = modified_duration_without_streaming
+        self.scope = scope
+        self.status_code = status_code
+        self.response_headers = response_headers
+        self._response_body: Optional[bytes] = (
+            None if response_body_chunks is not None else response_body
+        )
+        self._response_body_chunks = response_body_chunks
+        self.response_body_truncated = response_body_truncated
+        self.response_body_observers = response_body_observers
+        self.time_to_first_byte = time_to_first_byte
+        self.time_to_last_byte = time_to_last_byte
+        self.response_chunk_count = response_chunk_count
+        self.send_blocked_time = send_blocked_time
+        self.sample_weight = sample_weight
+        self.response_body_size = response_body_size
+        self.request_body_size = request_body_size
+        self.upload_duration = upload_duration
+        self._request_content_length: Optional[int] = None
+        self._response_content_length: Optional[int] = None
+        self._status_class: Optional[str] = None
+        self._label_values: Optional[Dict[Tuple[str, ...], Tuple[str, ...]]] = None
+
+    @property
+    def request(self) -> Optional[Request]:
+        if self._request is None and self.scope is not None:
+            self._request = Request(self.scope)
+        return self._request
+
+    @request.setter
+    def request(self, request: Optional[Request]) -> None:
+        self._request = request
+
+    @property
+    def response(self) -> Optional[Response]:
+        if self._response is None and self.response_headers is not None:
+            self._response = Response(
+                content=self.response_body,
+                headers=Headers(raw=self.response_headers),
+                status_code=self.status_code,
+            )
+        return self._response
+
+    @response.setter
+    def response(self, response: Optional[Response]) -> None:
+        self._response = response
+
+    @property
+    def response_body(self) -> bytes:
+        """Collected response body. Chunks are joined on first access."""
+
+        if self._response_body is None:
+            chunks = self._response_body_chunks or []
+            self._response_body = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+            self._response_body_chunks = None
+        return self._response_body
+
+    @response_body.setter
+    def response_body(self, response_body: bytes) -> None:
+        self._response_body = response_body
+        self._response_body_chunks = None
+
+    @property
+    def request_content_length(self) -> int:
+        """Value of the `Content-Length` request header.
+
+        If the header is missing, as with chunked uploads, the number of body
+        bytes counted by the middleware is used instead. Otherwise 0.
+        """
+
+        if self._request_content_length is None:
+            self._request_content_length = self._compute_request_content_length()
+        return self._request_content_length
+
+    def _compute_request_content_length(self) -> int:
+        if self.scope is not None:
+            content_length = _content_length_from_raw(self.scope["headers"])
+            if content_length is not None:
+                return content_length
+        elif self.request:
+            content_length = self.request.headers.get("Content-Length")
+            if content_length is not None:
+                return int(content_length)
+        return self.request_body_size or 0
+
+    @property
+    def response_content_length(self) -> int:
+        """Value of the `Content-Length` response header.
+
+        If the header is missing, as with streaming responses, the number of
+        body bytes counted by the middleware is used instead. Without that
+        falls back to the length of the collected body, like the header of
+        the response object built by `response`.
+        """
+
+        if self._response_content_length is None:
+            self._response_content_length = self._compute_response_content_length()
+        return self._response_content_length
+
+    def _compute_response_content_length(self) -> int:
+        if self.response_headers is not None:
+            content_length = _content_length_from_raw(self.response_headers)
+            if content_length is not None:
+                return content_length
+            if self.response_body_size is not None:
+                return self.response_body_size
+            if self.status_code < 200 or self.status_code in (204, 304):
+                return 0
+            return len(self.response_body)
+        if self.response and hasattr(self.response, "headers"):
+            return int(self.response.headers.get("Content-Length", 0))
+        return 0
+
+    @property
+    def response_bytes_per_second(self) -> Optional[float]:
+        """Response body bytes divided by the time between first and last chunk.
+
+        `None` if the body has not been streamed, meaning there is no time
+        between first and last chunk.
+        """
+
+        if (
+            self.response_body_size is None
+            or self.time_to_first_byte is None
+            or self.time_to_last_byte is None
+            or self.time_to_last_byte <= self.time_to_first_byte
+        ):
+            return None
+        return self.response_body_size / (
+            self.time_to_last_byte - self.time_to_first_byte
+        )
+
+    @property
+    def status_class(self) -> str:
+        """Status code grouped into `2xx`, `3xx` and so on.
+
+        Independent of whether the instrumentator groups status codes.
+        """
+
+        if self._status_class is None:
+            self._status_class = str(self.modified_status)[0] + "xx"
+        return self._status_class
+
+    def label_values(self, attribute_names: Tuple[str, ...]) -> Tuple[str, ...]:
+        """Returns the values of the given attributes as a tuple.
+
+        Cached per tuple of attribute names, so instrumentation functions
+        sharing the same label set only build it once per request.
+
+        Args:
+            attribute_names (Tuple[str, ...]): Names of attributes of this
+                object. For example `("modified_handler", "method")`.
+
+        Returns:
+            Tuple[str, ...]: Values in the same order.
+        """
+
+        if self._label_values is None:
+            self._label_values = {}
+        values = self._label_values.get(attribute_names)
+        if values is None:
+            values = tuple(getattr(self, name) for name in attribute_names)
+            self._label_values[attribute_names] = values
+        return values
 
 
 def _build_label_attribute_names(
@@ -94,6 +398,213 @@ def _build_label_attribute_names(
     return label_names, info_attribute_names
 
 
+def _cached_labels(
+    metric: Any,
+    suffix: Tuple[str, ...] = (),
+    batcher: Optional[MetricBatcher] = None,
+    max_label_combinations: Optional[int] = None,
+    registry: CollectorRegistry = REGISTRY,
+) -> Callable[[Tuple[str, ...]], Any]:
+    """Returns function that looks up labeled children of `metric`.
+
+    Children are kept in a dict keyed by the tuple of label values. Repeated
+    lookups for the same label values skip the lock and the label validation
+    of the Prometheus client. Children removed from the metric (for example
+    with `clear()`) are not picked up by the cache.
+
+    Args:
+        metric: Labeled Prometheus metric, for example a `Counter`.
+        suffix: Label values appended to every lookup, for example the values
+            of static custom labels. Not part of the cache key.
+        batcher: If given, children are wrapped to record into its buffers.
+        max_label_combinations: If given, at most this many distinct tuples of
+            label values get their own child. Further tuples are routed to a
+            single child with all values set to `OVERFLOW_LABEL_VALUE`. Each
+            distinct rejected tuple is counted once in
+            `http_metric_label_overflow_total` of `registry`, labeled with
+            the exported name of `metric`.
+
+    Returns:
+        Function that takes a tuple of label values and returns the child. Its
+        `warm_up` attribute creates the child for a tuple only if the limit
+        allows it and returns whether the child exists, so warming up never
+        writes to the overflow series.
+    """
+
+    children: Dict[Tuple[str, ...], Any] = {}
+    rejected: Set[Tuple[str, ...]] = set()
+    overflow: List[Any] = []
+
+    def wrap(child: Any) -> Any:
+        return batcher.wrap(child) if batcher is not None else child
+
+    def labels(label_values: Tuple[str, ...]) -> Any:
+        child = children.get(label_values)
+        if child is None:
+            if (
+                max_label_combinations is not None
+                and len(children) >= max_label_combinations
+            ):
+                return overflow_child(label_values)
+            child = wrap(metric.labels(*label_values, *suffix))
+            children[label_values] = child
+        return child
+
+    def overflow_child(label_values: Tuple[str, ...]) -> Any:
+        if not overflow:
+            counter = _get_overflow_counter(registry).labels(_exported_name(metric))
+            child = metric.labels(*(OVERFLOW_LABEL_VALUE,) * len(label_values), *suffix)
+            overflow.extend((counter, wrap(child)))
+        if label_values not in rejected:
+            # Bounded like the children, rejected tuples may be counted again
+            # after a reset.
+            if len(rejected) >= cast(int, max_label_combinations):
+                rejected.clear()
+            rejected.add(label_values)
+            overflow[0].inc()
+        return overflow[1]
+
+    def warm_up(label_values: Tuple[str, ...]) -> bool:
+        if label_values in children:
+            return True
+        if max_label_combinations is not None and len(children) >= max_label_combinations:
+            return False
+        labels(label_values)
+        return True
+
+    setattr(labels, "warm_up", warm_up)
+    return labels
+
+
+def _exported_name(metric: Any) -> str:
+    """Returns the name of `metric` as exported, for example with `_total`."""
+
+    family = metric.describe()[0]
+    if family.type == "counter":
+        return family.name + "_total"
+    return family.name
+
+
+def _get_overflow_counter(registry: CollectorRegistry) -> Counter:
+    """Returns counter of tuples rejected by the label limit of `registry`.
+
+    Shared by all metrics of the registry, created on first use.
+    """
+
+    return register_or_reuse(
+        Counter,
+        name="http_metric_label_overflow_total",
+        documentation=(
+            "Distinct label combinations routed to the overflow series because "
+            "the metric reached its limit of label combinations."
+        ),
+        labelnames=("metric",),
+        registry=registry,
+    )
+
+
+def register_or_reuse(
+    metric_type: Type[MetricT],
+    name: str,
+    documentation: str,
+    registry: CollectorRegistry = REGISTRY,
+    namespace: str = "",
+    subsystem: str = "",
+    **kwargs: Any,
+) -> MetricT:
+    """Creates metric in `registry` or returns the one created before.
+
+    Several apps or instrumentators can share a registry. The first one to ask
+    for a metric creates it, later ones get the same metric instead of failing
+    because of a duplicated time series.
+
+    Args:
+        metric_type: Metric class like `Counter` or `Gauge`.
+        name (str): Name of the metric.
+        documentation (str): Documentation of the metric.
+        registry (CollectorRegistry): Registry to register the metric in.
+        namespace (str): Namespace of the metric. Defaults to `""`.
+        subsystem (str): Subsystem of the metric. Defaults to `""`.
+        kwargs: Passed to `metric_type`, for example `labelnames`.
+
+    Returns:
+        MetricT: New or reused metric.
+
+    Raises:
+        ValueError: If the name is taken by a collector that has not been
+            created with this function, or for any other invalid argument.
+    """
+
+    full_name = "_".join(part for part in (namespace, subsystem, name) if part)
+    created = _reusable_metrics.setdefault(registry, {})
+    try:
+        metric = metric_type(
+            name=name,
+            documentation=documentation,
+            namespace=namespace,
+            subsystem=subsystem,
+            registry=registry,
+            **kwargs,
+        )
+    except ValueError as e:
+        if not _is_duplicated_time_series(e) or full_name not in created:
+            raise e
+        return cast(MetricT, created[full_name])
+    created[full_name] = metric
+    return metric
+
+
+def _with_warm_up(
+    instrumentation: Callable[[Info], None],
+    *lookups: Tuple[Optional[Callable[[Tuple[str, ...]], Any]], Tuple[str, ...]],
+) -> Callable[[Info], None]:
+    """Attaches `warm_up` to `instrumentation`.
+
+    `warm_up` takes an `Info` and creates the labeled children for its label
+    values without observing anything, so series exist before first traffic.
+    It returns `False` once a metric has reached its limit of label
+    combinations. No children are created for such a metric then.
+
+    Args:
+        instrumentation: Instrumentation function to attach to.
+        lookups: Tuples of a function returned by `_cached_labels()` and the
+            attribute names of `Info` used as its label values. Lookups that
+            are `None` (unlabeled metrics) are skipped.
+
+    Returns:
+        The given instrumentation function.
+    """
+
+    labeled = [(labels, names) for labels, names in lookups if labels is not None]
+
+    def warm_up(info: Info) -> bool:
+        return all(
+            [
+                getattr(labels, "warm_up")(info.label_values(attribute_names))
+                for labels, attribute_names in labeled
+            ]
+        )
+
+    setattr(instrumentation, "warm_up", warm_up)
+    return instrumentation
+
+
+def _observe_summary(summary: Any, amount: float, weight: float) -> None:
+    """Observes `amount` on `summary` as if it had been observed `weight` times.
+
+    Used to scale sampled requests back up. Both count and sum are scaled, so
+    the average stays the same.
+    """
+
+    if weight == 1.0:
+        summary.observe(amount)
+    elif isinstance(summary, Summary):
+        summary._count.inc(weight)
+        summary._sum.inc(amount * weight)
+    else:
+        summary.observe_weighted(amount, weight)
+
+
 def _is_duplicated_time_series(error: ValueError) -> bool:
     return any(
         map(
@@ -122,6 +633,8 @@ def latency(
     buckets: Sequence[Union[float, str]] = Histogram.DEFAULT_BUCKETS,
     registry: CollectorRegistry = REGISTRY,
     custom_labels: dict = {},
+    batcher: Optional[MetricBatcher] = None,
+    max_label_combinations: Optional[int] = DEFAULT_MAX_LABEL_COMBINATIONS,
 ) -> Optional[Callable[[Info], None]]:
     """Default metric for the Prometheus Starlette Instrumentator.
 
@@ -153,6 +666,17 @@ def latency(
         buckets: Buckets for the histogram. Defaults to Prometheus default.
             Defaults to default buckets from Prometheus client library.
 
+        batcher (MetricBatcher, optional): If given, observations are recorded
+            into its buffers and merged into the metrics on flush. Defaults
+            to `None`.
+
+        max_label_combinations (int, optional): Maximum number of distinct
+            label combinations per metric. Further combinations are recorded
+            in a single series with all label values set to `"__overflow__"`
+            and counted in `http_metric_label_overflow_total`. Protects against
+            unbounded growth, for example from untemplated paths. `None`
+            disables the limit. Defaults to `10_000`.
+
     Returns:
         Function that takes a single parameter `Info`.
     """
@@ -163,9 +687,8 @@ def latency(
     label_names, info_attribute_names = _build_label_attribute_names(
         should_include_handler, should_include_method, should_include_status
     )
-    for key in custom_labels:
-        label_names.append(key)
-        info_attribute_names.append(key)
+    label_names.extend(custom_labels)
+    label_attributes = tuple(info_attribute_names)
 
     # Starlette will call app.build_middleware_stack() with every new middleware
     # added, which will call all this again, which will make the registry
@@ -195,6 +718,19 @@ def latency(
                 registry=registry,
             )
 
+        labels = (
+            _cached_labels(
+                METRIC,
+                tuple(custom_labels.values()),
+                batcher,
+                max_label_combinations,
+                registry,
+            )
+            if label_names
+            else None
+        )
+        unlabeled = batcher.wrap(METRIC) if batcher else METRIC
+
         def instrumentation(info: Info) -> None:
             duration = info.modified_duration
             if should_exclude_streaming_duration:
@@ -202,17 +738,12 @@ def latency(
             else:
                 duration = info.modified_duration
 
-            if label_names:
-                label_values = [
-                    getattr(info, attribute_name)
-                    for attribute_name in info_attribute_names
-                ]
-
-                METRIC.labels(*label_values).observe(duration)
+            if labels:
+                labels(info.label_values(label_attributes)).observe(duration)
             else:
-                METRIC.observe(duration)
+                unlabeled.observe(duration)
 
-        return instrumentation
+        return _with_warm_up(instrumentation, (labels, label_attributes))
     except ValueError as e:
         if not _is_duplicated_time_series(e):
             raise e
@@ -230,10 +761,15 @@ def request_size(
     should_include_status: bool = True,
     registry: CollectorRegistry = REGISTRY,
     custom_labels: dict = {},
+    batcher: Optional[MetricBatcher] = None,
+    max_label_combinations: Optional[int] = DEFAULT_MAX_LABEL_COMBINATIONS,
 ) -> Optional[Callable[[Info], None]]:
     """Record the content length of incoming requests.
 
-    If content length is missing 0 will be assumed.
+    Reads `Info.request_content_length`, which is derived once per request and
+    shared with the other instrumentation functions. It is the value of the
+    `Content-Length` header or, if the header is missing, the number of body
+    bytes counted with `should_track_request_body`. Otherwise 0 is assumed.
 
     Args:
         metric_name (str, optional): Name of the metric to be created. Must be
@@ -251,6 +787,17 @@ def request_size(
         should_include_status: Should the `status` label be part of the metric?
             Defaults to `True`.
 
+        batcher (MetricBatcher, optional): If given, observations are recorded
+            into its buffers and merged into the metrics on flush. Defaults
+            to `None`.
+
+        max_label_combinations (int, optional): Maximum number of distinct
+            label combinations per metric. Further combinations are recorded
+            in a single series with all label values set to `"__overflow__"`
+            and counted in `http_metric_label_overflow_total`. Protects against
+            unbounded growth, for example from untemplated paths. `None`
+            disables the limit. Defaults to `10_000`.
+
     Returns:
         Function that takes a single parameter `Info`.
     """
@@ -258,9 +805,8 @@ def request_size(
     label_names, info_attribute_names = _build_label_attribute_names(
         should_include_handler, should_include_method, should_include_status
     )
-    for key in custom_labels:
-        label_names.append(key)
-        info_attribute_names.append(key)
+    label_names.extend(custom_labels)
+    label_attributes = tuple(info_attribute_names)
 
     # Starlette will call app.build_middleware_stack() with every new middleware
     # added, which will call all this again, which will make the registry
@@ -288,19 +834,31 @@ def request_size(
                 registry=registry,
             )
 
+        labels = (
+            _cached_labels(
+                METRIC,
+                tuple(custom_labels.values()),
+                batcher,
+                max_label_combinations,
+                registry,
+            )
+            if label_names
+            else None
+        )
+        unlabeled = batcher.wrap(METRIC) if batcher else METRIC
+
         def instrumentation(info: Info) -> None:
-            content_length = info.request.headers.get("Content-Length", 0)
-            if label_names:
-                label_values = [
-                    getattr(info, attribute_name)
-                    for attribute_name in info_attribute_names
-                ]
-
-                METRIC.labels(*label_values).observe(int(content_length))
+            content_length = info.request_content_length
+            if labels:
+                _observe_summary(
+                    labels(info.label_values(label_attributes)),
+                    int(content_length),
+                    info.sample_weight,
+                )
             else:
-                METRIC.observe(int(content_length))
+                _observe_summary(unlabeled, int(content_length), info.sample_weight)
 
-        return instrumentation
+        return _with_warm_up(instrumentation, (labels, label_attributes))
     except ValueError as e:
         if not _is_duplicated_time_series(e):
             raise e
@@ -318,10 +876,15 @@ def response_size(
     should_include_status: bool = True,
     registry: CollectorRegistry = REGISTRY,
     custom_labels: dict = {},
+    batcher: Optional[MetricBatcher] = None,
+    max_label_combinations: Optional[int] = DEFAULT_MAX_LABEL_COMBINATIONS,
 ) -> Optional[Callable[[Info], None]]:
     """Record the content length of outgoing responses.
 
-    If content length is missing 0 will be assumed.
+    Reads `Info.response_content_length`, which is derived once per request
+    and shared with the other instrumentation functions. It is the value of
+    the `Content-Length` header or, if the header is missing, the number of
+    body bytes counted while streaming. Otherwise 0 is assumed.
 
     Args:
         metric_name (str, optional): Name of the metric to be created. Must be
@@ -345,6 +908,17 @@ def response_size(
         should_include_status: Should the `status` label be part of the metric?
             Defaults to `True`.
 
+        batcher (MetricBatcher, optional): If given, observations are recorded
+            into its buffers and merged into the metrics on flush. Defaults
+            to `None`.
+
+        max_label_combinations (int, optional): Maximum number of distinct
+            label combinations per metric. Further combinations are recorded
+            in a single series with all label values set to `"__overflow__"`
+            and counted in `http_metric_label_overflow_total`. Protects against
+            unbounded growth, for example from untemplated paths. `None`
+            disables the limit. Defaults to `10_000`.
+
     Returns:
         Function that takes a single parameter `Info`.
     """
@@ -352,9 +926,8 @@ def response_size(
     label_names, info_attribute_names = _build_label_attribute_names(
         should_include_handler, should_include_method, should_include_status
     )
-    for key in custom_labels:
-        label_names.append(key)
-        info_attribute_names.append(key)
+    label_names.extend(custom_labels)
+    label_attributes = tuple(info_attribute_names)
 
     # Starlette will call app.build_middleware_stack() with every new middleware
     # added, which will call all this again, which will make the registry
@@ -382,23 +955,32 @@ def response_size(
                 registry=registry,
             )
 
-        def instrumentation(info: Info) -> None:
-            if info.response and hasattr(info.response, "headers"):
-                content_length = info.response.headers.get("Content-Length", 0)
-            else:
-                content_length = 0
+        labels = (
+            _cached_labels(
+                METRIC,
+                tuple(custom_labels.values()),
+                batcher,
+                max_label_combinations,
+                registry,
+            )
+            if label_names
+            else None
+        )
+        unlabeled = batcher.wrap(METRIC) if batcher else METRIC
 
-            if label_names:
-                label_values = [
-                    getattr(info, attribute_name)
-                    for attribute_name in info_attribute_names
-                ]
+        def instrumentation(info: Info) -> None:
+            content_length = info.response_content_length
 
-                METRIC.labels(*label_values).observe(int(content_length))
+            if labels:
+                _observe_summary(
+                    labels(info.label_values(label_attributes)),
+                    int(content_length),
+                    info.sample_weight,
+                )
             else:
-                METRIC.observe(int(content_length))
+                _observe_summary(unlabeled, int(content_length), info.sample_weight)
 
-        return instrumentation
+        return _with_warm_up(instrumentation, (labels, label_attributes))
     except ValueError as e:
         if not _is_duplicated_time_series(e):
             raise e
@@ -416,10 +998,13 @@ def combined_size(
     should_include_status: bool = True,
     registry: CollectorRegistry = REGISTRY,
     custom_labels: dict = {},
+    batcher: Optional[MetricBatcher] = None,
+    max_label_combinations: Optional[int] = DEFAULT_MAX_LABEL_COMBINATIONS,
 ) -> Optional[Callable[[Info], None]]:
     """Record the combined content length of requests and responses.
 
-    If content length is missing 0 will be assumed.
+    Sums `Info.request_content_length` and `Info.response_content_length`. See
+    `request_size()` and `response_size()` for how they are derived.
 
     Args:
         metric_name (str, optional): Name of the metric to be created. Must be
@@ -443,6 +1028,17 @@ def combined_size(
         should_include_status: Should the `status` label be part of the metric?
             Defaults to `True`.
 
+        batcher (MetricBatcher, optional): If given, observations are recorded
+            into its buffers and merged into the metrics on flush. Defaults
+            to `None`.
+
+        max_label_combinations (int, optional): Maximum number of distinct
+            label combinations per metric. Further combinations are recorded
+            in a single series with all label values set to `"__overflow__"`
+            and counted in `http_metric_label_overflow_total`. Protects against
+            unbounded growth, for example from untemplated paths. `None`
+            disables the limit. Defaults to `10_000`.
+
     Returns:
         Function that takes a single parameter `Info`.
     """
@@ -450,9 +1046,8 @@ def combined_size(
     label_names, info_attribute_names = _build_label_attribute_names(
         should_include_handler, should_include_method, should_include_status
     )
-    for key in custom_labels:
-        label_names.append(key)
-        info_attribute_names.append(key)
+    label_names.extend(custom_labels)
+    label_attributes = tuple(info_attribute_names)
     # Starlette will call app.build_middleware_stack() with every new middleware
     # added, which will call all this again, which will make the registry
     # complain about duplicated metrics.
@@ -479,27 +1074,32 @@ def combined_size(
                 registry=registry,
             )
 
-        def instrumentation(info: Info) -> None:
-            request_cl = info.request.headers.get("Content-Length", 0)
-
-            if info.response and hasattr(info.response, "headers"):
-                response_cl = info.response.headers.get("Content-Length", 0)
-            else:
-                response_cl = 0
-
-            content_length = int(request_cl) + int(response_cl)
+        labels = (
+            _cached_labels(
+                METRIC,
+                tuple(custom_labels.values()),
+                batcher,
+                max_label_combinations,
+                registry,
+            )
+            if label_names
+            else None
+        )
+        unlabeled = batcher.wrap(METRIC) if batcher else METRIC
 
-            if label_names:
-                label_values = [
-                    getattr(info, attribute_name)
-                    for attribute_name in info_attribute_names
-                ]
+        def instrumentation(info: Info) -> None:
+            content_length = info.request_content_length + info.response_content_length
 
-                METRIC.labels(*label_values).observe(int(content_length))
+            if labels:
+                _observe_summary(
+                    labels(info.label_values(label_attributes)),
+                    int(content_length),
+                    info.sample_weight,
+                )
             else:
-                METRIC.observe(int(content_length))
+                _observe_summary(unlabeled, int(content_length), info.sample_weight)
 
-        return instrumentation
+        return _with_warm_up(instrumentation, (labels, label_attributes))
     except ValueError as e:
         if not _is_duplicated_time_series(e):
             raise e
@@ -517,6 +1117,8 @@ def requests(
     should_include_status: bool = True,
     registry: CollectorRegistry = REGISTRY,
     custom_labels: dict = {},
+    batcher: Optional[MetricBatcher] = None,
+    max_label_combinations: Optional[int] = DEFAULT_MAX_LABEL_COMBINATIONS,
 ) -> Optional[Callable[[Info], None]]:
     """Record the number of requests.
 
@@ -542,6 +1144,17 @@ def requests(
         should_include_status (bool, optional): Should the `status` label be
             part of the metric? Defaults to `True`.
 
+        batcher (MetricBatcher, optional): If given, observations are recorded
+            into its buffers and merged into the metrics on flush. Defaults
+            to `None`.
+
+        max_label_combinations (int, optional): Maximum number of distinct
+            label combinations per metric. Further combinations are recorded
+            in a single series with all label values set to `"__overflow__"`
+            and counted in `http_metric_label_overflow_total`. Protects against
+            unbounded growth, for example from untemplated paths. `None`
+            disables the limit. Defaults to `10_000`.
+
     Returns:
         Function that takes a single parameter `Info`.
     """
@@ -549,9 +1162,8 @@ def requests(
     label_names, info_attribute_names = _build_label_attribute_names(
         should_include_handler, should_include_method, should_include_status
     )
-    for key in custom_labels:
-        label_names.append(key)
-        info_attribute_names.append(key)
+    label_names.extend(custom_labels)
+    label_attributes = tuple(info_attribute_names)
 
     # Starlette will call app.build_middleware_stack() with every new middleware
     # added, which will call all this again, which will make the registry
@@ -579,16 +1191,145 @@ def requests(
                 registry=registry,
             )
 
+        labels = (
+            _cached_labels(
+                METRIC,
+                tuple(custom_labels.values()),
+                batcher,
+                max_label_combinations,
+                registry,
+            )
+            if label_names
+            else None
+        )
+        unlabeled = batcher.wrap(METRIC) if batcher else METRIC
+
         def instrumentation(info: Info) -> None:
-            if label_names:
-                label_values = [
-                    getattr(info, attribute_name)
-                    for attribute_name in info_attribute_names
-                ]
+            if labels:
+                labels(info.label_values(label_attributes)).inc(info.sample_weight)
+            else:
+                unlabeled.inc(info.sample_weight)
+
+        return _with_warm_up(instrumentation, (labels, label_attributes))
+    except ValueError as e:
+        if not _is_duplicated_time_series(e):
+            raise e
+
+    return None
+
+
+def upload_duration(
+    metric_name: str = "http_request_upload_duration_seconds",
+    metric_doc: str = "Duration of receiving HTTP request bodies in seconds",
+    metric_namespace: str = "",
+    metric_subsystem: str = "",
+    should_include_handler: bool = True,
+    should_include_method: bool = True,
+    should_include_status: bool = True,
+    buckets: Sequence[Union[float, str]] = Histogram.DEFAULT_BUCKETS,
+    registry: CollectorRegistry = REGISTRY,
+    custom_labels: dict = {},
+    batcher: Optional[MetricBatcher] = None,
+    max_label_combinations: Optional[int] = DEFAULT_MAX_LABEL_COMBINATIONS,
+) -> Optional[Callable[[Info], None]]:
+    """Records the time between the first and the last request body chunk.
+
+    Helps to tell slow clients apart from slow handlers. Requires the
+    middleware to track request bodies with `should_track_request_body`.
+    Requests without a completely received body are ignored.
+
+    Args:
+        metric_name (str, optional): Name of the metric to be created. Must be
+            unique. Defaults to "http_request_upload_duration_seconds".
+
+        metric_doc (str, optional): Documentation of the metric. Defaults to
+            "Duration of receiving HTTP request bodies in seconds".
+
+        metric_namespace (str, optional): Namespace of all  metrics in this
+            metric function. Defaults to "".
+
+        metric_subsystem (str, optional): Subsystem of all  metrics in this
+            metric function. Defaults to "".
+
+        should_include_handler: Should the `handler` label be part of the
+            metric? Defaults to `True`.
+
+        should_include_method: Should the `method` label be part of the
+            metric? Defaults to `True`.
 
-                METRIC.labels(*label_values).inc()
+        should_include_status: Should the `status` label be part of the
+            metric? Defaults to `True`.
+
+        buckets: Buckets for the histogram. Defaults to default buckets from
+            Prometheus client library.
+
+        batcher (MetricBatcher, optional): If given, observations are recorded
+            into its buffers and merged into the metrics on flush. Defaults
+            to `None`.
+
+        max_label_combinations (int, optional): Maximum number of distinct
+            label combinations per metric. Further combinations are recorded
+            in a single series with all label values set to `"__overflow__"`
+            and counted in `http_metric_label_overflow_total`. Protects against
+            unbounded growth, for example from untemplated paths. `None`
+            disables the limit. Defaults to `10_000`.
+
+    Returns:
+        Function that takes a single parameter `Info`.
+    """
+
+    if buckets[-1] != float("inf"):
+        buckets = [*buckets, float("inf")]
+
+    label_names, info_attribute_names = _build_label_attribute_names(
+        should_include_handler, should_include_method, should_include_status
+    )
+    label_names.extend(custom_labels)
+    label_attributes = tuple(info_attribute_names)
+
+    try:
+        if label_names:
+            METRIC = Histogram(
+                metric_name,
+                metric_doc,
+                labelnames=label_names,
+                buckets=buckets,
+                namespace=metric_namespace,
+                subsystem=metric_subsystem,
+                registry=registry,
+            )
+        else:
+            METRIC = Histogram(
+                metric_name,
+                metric_doc,
+                buckets=buckets,
+                namespace=metric_namespace,
+                subsystem=metric_subsystem,
+                registry=registry,
+            )
+
+        labels = (
+            _cached_labels(
+                METRIC,
+                tuple(custom_labels.values()),
+                batcher,
+                max_label_combinations,
+                registry,
+            )
+            if label_names
+            else None
+        )
+        unlabeled = batcher.wrap(METRIC) if batcher else METRIC
+
+        def instrumentation(info: Info) -> None:
+            duration = info.upload_duration
+            if duration is None:
+                return
+
+            if labels:
+                labels(info.label_values(label_attributes)).observe(duration)
             else:
-                METRIC.inc()
+                unlabeled.observe(duration)
 
         return instrumentation
     except ValueError as e:
@@ -598,6 +1339,284 @@ def requests(
     return None
 
 
+def send_blocked_time(
+    metric_name: str = "http_response_send_blocked_seconds",
+    metric_doc: str = "Time spent waiting on clients to accept response data in seconds",
+    metric_namespace: str = "",
+    metric_subsystem: str = "",
+    should_include_handler: bool = True,
+    should_include_method: bool = True,
+    should_include_status: bool = True,
+    buckets: Sequence[Union[float, str]] = Histogram.DEFAULT_BUCKETS,
+    registry: CollectorRegistry = REGISTRY,
+    custom_labels: dict = {},
+    batcher: Optional[MetricBatcher] = None,
+    max_label_combinations: Optional[int] = DEFAULT_MAX_LABEL_COMBINATIONS,
+) -> Optional[Callable[[Info], None]]:
+    """Records the time spent awaiting `send` while sending the response.
+
+    Tells network bound slowness (clients reading slowly) apart from compute
+    bound slowness. Requires the middleware to measure it with
+    `should_track_send_blocked_time`. Otherwise nothing is recorded.
+
+    Args:
+        metric_name (str, optional): Name of the metric to be created. Must be
+            unique. Defaults to "http_response_send_blocked_seconds".
+
+        metric_doc (str, optional): Documentation of the metric. Defaults to
+            "Time spent waiting on clients to accept response data in seconds".
+
+        metric_namespace (str, optional): Namespace of all  metrics in this
+            metric function. Defaults to "".
+
+        metric_subsystem (str, optional): Subsystem of all  metrics in this
+            metric function. Defaults to "".
+
+        should_include_handler: Should the `handler` label be part of the
+            metric? Defaults to `True`.
+
+        should_include_method: Should the `method` label be part of the
+            metric? Defaults to `True`.
+
+        should_include_status: Should the `status` label be part of the
+            metric? Defaults to `True`.
+
+        buckets: Buckets for the histogram. Defaults to default buckets from
+            Prometheus client library.
+
+        batcher (MetricBatcher, optional): If given, observations are recorded
+            into its buffers and merged into the metrics on flush. Defaults
+            to `None`.
+
+        max_label_combinations (int, optional): Maximum number of distinct
+            label combinations per metric. Further combinations are recorded
+            in a single series with all label values set to `"__overflow__"`
+            and counted in `http_metric_label_overflow_total`. Protects against
+            unbounded growth, for example from untemplated paths. `None`
+            disables the limit. Defaults to `10_000`.
+
+    Returns:
+        Function that takes a single parameter `Info`.
+    """
+
+    if buckets[-1] != float("inf"):
+        buckets = [*buckets, float("inf")]
+
+    label_names, info_attribute_names = _build_label_attribute_names(
+        should_include_handler, should_include_method, should_include_status
+    )
+    label_names.extend(custom_labels)
+    label_attributes = tuple(info_attribute_names)
+
+    try:
+        if label_names:
+            METRIC = Histogram(
+                metric_name,
+                metric_doc,
+                labelnames=label_names,
+                buckets=buckets,
+                namespace=metric_namespace,
+                subsystem=metric_subsystem,
+                registry=registry,
+            )
+        else:
+            METRIC = Histogram(
+                metric_name,
+                metric_doc,
+                buckets=buckets,
+                namespace=metric_namespace,
+                subsystem=metric_subsystem,
+                registry=registry,
+            )
+
+        labels = (
+            _cached_labels(
+                METRIC,
+                tuple(custom_labels.values()),
+                batcher,
+                max_label_combinations,
+                registry,
+            )
+            if label_names
+            else None
+        )
+        unlabeled = batcher.wrap(METRIC) if batcher else METRIC
+
+        def instrumentation(info: Info) -> None:
+            duration = info.send_blocked_time
+            if duration is None:
+                return
+
+            if labels:
+                labels(info.label_values(label_attributes)).observe(duration)
+            else:
+                unlabeled.observe(duration)
+
+        return instrumentation
+    except ValueError as e:
+        if not _is_duplicated_time_series(e):
+            raise e
+
+    return None
+
+
+def streaming(
+    metric_namespace: str = "",
+    metric_subsystem: str = "",
+    latency_buckets: Sequence[Union[float, str]] = Histogram.DEFAULT_BUCKETS,
+    chunk_buckets: Sequence[Union[float, str]] = (1, 2, 5, 10, 50, 100, 500, 1000),
+    throughput_buckets: Sequence[Union[float, str]] = (
+        1_000,
+        10_000,
+        100_000,
+        1_000_000,
+        10_000_000,
+        100_000_000,
+    ),
+    registry: CollectorRegistry = REGISTRY,
+    custom_labels: dict = {},
+    batcher: Optional[MetricBatcher] = None,
+    max_label_combinations: Optional[int] = DEFAULT_MAX_LABEL_COMBINATIONS,
+) -> Optional[Callable[[Info], None]]:
+    """Contains metrics for streaming responses.
+
+    You get the following histograms, all with the `handler` label:
+
+    * `http_response_time_to_first_byte_seconds`: Time between request
+        arrival and the first non-empty response body chunk.
+    * `http_response_time_to_last_byte_seconds`: Time between request arrival
+        and the last response body chunk.
+    * `http_response_chunks`: Number of non-empty response body chunks.
+    * `http_response_throughput_bytes_per_second`: Response body bytes divided
+        by the time between first and last chunk. Only recorded for responses
+        with time between first and last chunk.
+
+    Args:
+        metric_namespace (str, optional): Namespace of all  metrics in this
+            metric function. Defaults to "".
+
+        metric_subsystem (str, optional): Subsystem of all  metrics in this
+            metric function. Defaults to "".
+
+        latency_buckets (tuple[float], optional): Buckets for time to first and
+            last byte. Defaults to default buckets from Prometheus client
+            library.
+
+        chunk_buckets (tuple[float], optional): Buckets for the number of
+            chunks. Defaults to `(1, 2, 5, 10, 50, 100, 500, 1000)`.
+
+        throughput_buckets (tuple[float], optional): Buckets for bytes per
+            second. Defaults to powers of ten from `1_000` to `100_000_000`.
+
+        batcher (MetricBatcher, optional): If given, observations are recorded
+            into its buffers and merged into the metrics on flush. Defaults
+            to `None`.
+
+        max_label_combinations (int, optional): Maximum number of distinct
+            label combinations per metric. Further combinations are recorded
+            in a single series with all label values set to `"__overflow__"`
+            and counted in `http_metric_label_overflow_total`. Protects against
+            unbounded growth, for example from untemplated paths. `None`
+            disables the limit. Defaults to `10_000`.
+
+    Returns:
+        Function that takes a single parameter `Info`.
+    """
+
+    if latency_buckets[-1] != float("inf"):
+        latency_buckets = [*latency_buckets, float("inf")]
+
+    if chunk_buckets[-1] != float("inf"):
+        chunk_buckets = [*chunk_buckets, float("inf")]
+
+    if throughput_buckets[-1] != float("inf"):
+        throughput_buckets = [*throughput_buckets, float("inf")]
+
+    label_names = ("handler", *custom_labels)
+    label_attributes = ("modified_handler",)
+    custom_label_values = tuple(custom_labels.values())
+
+    try:
+        TTFB = Histogram(
+            name="http_response_time_to_first_byte_seconds",
+            documentation="Time to first response body chunk by handler.",
+            labelnames=label_names,
+            buckets=latency_buckets,
+            namespace=metric_namespace,
+            subsystem=metric_subsystem,
+            registry=registry,
+        )
+
+        TTLB = Histogram(
+            name="http_response_time_to_last_byte_seconds",
+            documentation="Time to last response body chunk by handler.",
+            labelnames=label_names,
+            buckets=latency_buckets,
+            namespace=metric_namespace,
+            subsystem=metric_subsystem,
+            registry=registry,
+        )
+
+        CHUNKS = Histogram(
+            name="http_response_chunks",
+            documentation="Number of non-empty response body chunks by handler.",
+            labelnames=label_names,
+            buckets=chunk_buckets,
+            namespace=metric_namespace,
+            subsystem=metric_subsystem,
+            registry=registry,
+        )
+
+        THROUGHPUT = Histogram(
+            name="http_response_throughput_bytes_per_second",
+            documentation=(
+                "Response body bytes per second between first and last chunk "
+                "by handler."
+            ),
+            labelnames=label_names,
+            buckets=throughput_buckets,
+            namespace=metric_namespace,
+            subsystem=metric_subsystem,
+            registry=registry,
+        )
+
+        ttfb_labels = _cached_labels(
+            TTFB, custom_label_values, batcher, max_label_combinations, registry
+        )
+        ttlb_labels = _cached_labels(
+            TTLB, custom_label_values, batcher, max_label_combinations, registry
+        )
+        chunks_labels = _cached_labels(
+            CHUNKS, custom_label_values, batcher, max_label_combinations, registry
+        )
+        throughput_labels = _cached_labels(
+            THROUGHPUT, custom_label_values, batcher, max_label_combinations, registry
+        )
+
+        def instrumentation(info: Info) -> None:
+            if info.time_to_first_byte is None:
+                return
+
+            label_values = info.label_values(label_attributes)
+
+            ttfb_labels(label_values).observe(info.time_to_first_byte)
+            if info.time_to_last_byte is not None:
+                ttlb_labels(label_values).observe(info.time_to_last_byte)
+            chunks_labels(label_values).observe(info.response_chunk_count)
+
+            bytes_per_second = info.response_bytes_per_second
+            if bytes_per_second is not None:
+                throughput_labels(label_values).observe(bytes_per_second)
+
+        return instrumentation
+
+    except ValueError as e:
+        if not _is_duplicated_time_series(e):
+            raise e
+
+    return None
+
+
 def _map_label_name_value(label_name: tuple) -> list[str]:
     attribute_names = []
     mapping = {
@@ -644,6 +1663,8 @@ def default(
     latency_lowr_buckets: Sequence[Union[float, str]] = (0.1, 0.5, 1),
     registry: CollectorRegistry = REGISTRY,
     custom_labels: dict = {},
+    batcher: Optional[MetricBatcher] = None,
+    max_label_combinations: Optional[int] = DEFAULT_MAX_LABEL_COMBINATIONS,
 ) -> Optional[Callable[[Info], None]]:
     """Contains multiple metrics to cover multiple things.
 
@@ -687,6 +1708,17 @@ def default(
             res histogram. Should be very small as all possible labels are
             included. Defaults to `(0.1, 0.5, 1)`.
 
+        batcher (MetricBatcher, optional): If given, observations are recorded
+            into its buffers and merged into the metrics on flush. Defaults
+            to `None`.
+
+        max_label_combinations (int, optional): Maximum number of distinct
+            label combinations per metric. Further combinations are recorded
+            in a single series with all label values set to `"__overflow__"`
+            and counted in `http_metric_label_overflow_total`. Protects against
+            unbounded growth, for example from untemplated paths. `None`
+            disables the limit. Defaults to `10_000`.
+
     Returns:
         Function that takes a single parameter `Info`.
     """
@@ -724,7 +1756,8 @@ def default(
             name="http_request_size_bytes",
             documentation=(
                 "Content length of incoming requests by handler. "
-                "Only value of header is respected. Otherwise ignored. "
+                "Counted body bytes are used if the header is missing "
+                "and request bodies are tracked. "
                 "No percentile calculated. "
             ),
             labelnames=in_size_names + additional_label_names,
@@ -738,7 +1771,7 @@ def default(
             name="http_response_size_bytes",
             documentation=(
                 "Content length of outgoing responses by handler. "
-                "Only value of header is respected. Otherwise ignored. "
+                "Counted body bytes are used if the header is missing. "
                 "No percentile calculated. "
             ),
             labelnames=out_size_names + additional_label_names,
@@ -776,6 +1809,26 @@ def default(
             registry=registry,
         )
 
+        total_attributes = tuple(_map_label_name_value(total_label_names))
+        in_size_attributes = tuple(_map_label_name_value(in_size_names))
+        out_size_attributes = tuple(_map_label_name_value(out_size_names))
+        latency_lower_attributes = tuple(_map_label_name_value(latency_lower_names))
+        custom_label_values = tuple(custom_labels.values())
+
+        total_labels = _cached_labels(
+            TOTAL, custom_label_values, batcher, max_label_combinations, registry
+        )
+        in_size_labels = _cached_labels(
+            IN_SIZE, custom_label_values, batcher, max_label_combinations, registry
+        )
+        out_size_labels = _cached_labels(
+            OUT_SIZE, custom_label_values, batcher, max_label_combinations, registry
+        )
+        latency_lower_labels = _cached_labels(
+            LATENCY_LOWR, custom_label_values, batcher, max_label_combinations, registry
+        )
+        latency_highr = batcher.wrap(LATENCY_HIGHR) if batcher else LATENCY_HIGHR
+
         def instrumentation(info: Info) -> None:
             duration = info.modified_duration
             if should_exclude_streaming_duration:
@@ -783,43 +1836,34 @@ def default(
             else:
                 duration = info.modified_duration
 
-            label_values = [
-                getattr(info, attribute_name)
-                for attribute_name in _map_label_name_value(total_label_names)
-            ] + list(custom_labels.values())
-            TOTAL.labels(*label_values).inc()
-
-            label_values = [
-                getattr(info, attribute_name)
-                for attribute_name in _map_label_name_value(in_size_names)
-            ] + list(custom_labels.values())
-            IN_SIZE.labels(*label_values).observe(
-                int(info.request.headers.get("Content-Length", 0))
+            total_labels(info.label_values(total_attributes)).inc(info.sample_weight)
+
+            _observe_summary(
+                in_size_labels(info.label_values(in_size_attributes)),
+                info.request_content_length,
+                info.sample_weight,
             )
 
-            label_values = [
-                getattr(info, attribute_name)
-                for attribute_name in _map_label_name_value(out_size_names)
-            ] + list(custom_labels.values())
-            if info.response and hasattr(info.response, "headers"):
-                OUT_SIZE.labels(*label_values).observe(
-                    int(info.response.headers.get("Content-Length", 0))
-                )
-            else:
-                OUT_SIZE.labels(*label_values).observe(0)
+            _observe_summary(
+                out_size_labels(info.label_values(out_size_attributes)),
+                info.response_content_length,
+                info.sample_weight,
+            )
 
-            if not should_only_respect_2xx_for_highr or info.modified_status.startswith(
-                "2"
-            ):
-                LATENCY_HIGHR.observe(duration)
+            if not should_only_respect_2xx_for_highr or is_2xx(info.modified_status):
+                latency_highr.observe(duration)
 
-            label_values = [
-                getattr(info, attribute_name)
-                for attribute_name in _map_label_name_value(latency_lower_names)
-            ] + list(custom_labels.values())
-            LATENCY_LOWR.labels(*label_values).observe(duration)
+            latency_lower_labels(info.label_values(latency_lower_attributes)).observe(
+                duration
+            )
 
-        return instrumentation
+        return _with_warm_up(
+            instrumentation,
+            (total_labels, total_attributes),
+            (in_size_labels, in_size_attributes),
+            (out_size_labels, out_size_attributes),
+            (latency_lower_labels, latency_lower_attributes),
+        )
 
     except ValueError as e:
         if not _is_duplicated_time_series(e):
@@ -1,21 +1,192 @@
 from __future__ import annotations
 
 import asyncio
+import functools
+import random
 import re
-from http import HTTPStatus
-from timeit import default_timer
-from typing import Awaitable, Callable, Optional, Sequence, Tuple, Union
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 from prometheus_client import REGISTRY, CollectorRegistry, Gauge
-from starlette.datastructures import Headers
 from starlette.requests import Request
-from starlette.responses import Response
 from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from prometheus_fastapi_instrumentator import metrics, routing
+from prometheus_fastapi_instrumentator import metrics, route_resolution
+from prometheus_fastapi_instrumentator.background import InstrumentationQueue
+from prometheus_fastapi_instrumentator.batching import MetricBatcher
+from prometheus_fastapi_instrumentator.sampling import AdaptiveSampler
+from prometheus_fastapi_instrumentator.status import status_label
+
+
+class _ResponseTracker:
+    """Wraps `send` to collect data about the response of a single request.
+
+    The size of the response body, the number of non-empty body chunks and the
+    times of the first and the last chunk are always tracked. If requested,
+    the body is either collected as list of chunk references up to
+    `max_body_size` bytes or fed chunk by chunk to body observers without
+    holding it.
+    """
+
+    __slots__ = (
+        "_send",
+        "_clock",
+        "collect_body",
+        "max_body_size",
+        "status_code",
+        "headers",
+        "start_time",
+        "first_chunk_time",
+        "last_chunk_time",
+        "chunk_count",
+        "body_size",
+        "chunks",
+        "captured_size",
+        "body_truncated",
+        "observers",
+        "send_blocked_time",
+    )
+
+    def __init__(
+        self,
+        send: Send,
+        clock: Callable[[], int] = time.perf_counter_ns,
+        collect_body: bool = False,
+        max_body_size: Optional[int] = None,
+        observer_factories: Sequence[Callable[[], Any]] = (),
+    ) -> None:
+        self._send = send
+        self._clock = clock
+        self.collect_body = collect_body
+        self.max_body_size = max_body_size
+        self.status_code = 500
+        self.headers: List[Tuple[bytes, bytes]] = []
+        self.start_time: Optional[int] = None
+        self.first_chunk_time: Optional[int] = None
+        self.last_chunk_time: Optional[int] = None
+        self.chunk_count = 0
+        self.body_size = 0
+        self.chunks: List[bytes] = []
+        self.captured_size = 0
+        self.body_truncated = False
+        self.observers: Optional[List[Any]] = None
+        if collect_body and observer_factories:
+            self.observers = [factory() for factory in observer_factories]
+        self.send_blocked_time = 0
+
+    async def send(self, message: Message) -> None:
+        self._track(message)
+        await self._send(message)
+
+    async def send_timed(self, message: Message) -> None:
+        """Like `send` but also measures the time spent awaiting `send`.
+
+        Long waits usually mean the client is reading slowly (backpressure).
+        """
+
+        self._track(message)
+        start_time = self._clock()
+        await self._send(message)
+        self.send_blocked_time += self._clock() - start_time
+
+    def _track(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.headers = message["headers"]
+            self.status_code = message["status"]
+            self.start_time = self._clock()
+        elif message["type"] == "http.response.body":
+            chunk = message.get("body", b"")
+            now = None
+            if chunk:
+                # Only first and last chunk are timestamped to keep per chunk
+                # costs low for responses streaming many small chunks.
+                if self.first_chunk_time is None:
+                    now = self.first_chunk_time = self._clock()
+                self.chunk_count += 1
+                self.body_size += len(chunk)
+                if self.collect_body:
+                    self._collect(chunk)
+            if not message.get("more_body", False):
+                # Bodies sent in a single message have no streaming time.
+                self.last_chunk_time = now if now is not None else self._clock()
+
+    def _collect(self, chunk: bytes) -> None:
+        if self.observers is not None:
+            for observer in self.observers:
+                observer.update(chunk)
+            return
+
+        if self.body_truncated:
+            return
+        if self.max_body_size is not None:
+            remaining = self.max_body_size - self.captured_size
+            if len(chunk) > remaining:
+                chunk = chunk[:remaining]
+                self.body_truncated = True
+        # Bytes are immutable, so keeping references is safe.
+        self.chunks.append(chunk)
+        self.captured_size += len(chunk)
+
+
+class _RequestTracker:
+    """Wraps `receive` to count request body bytes and time the upload.
+
+    Chunks are timestamped when the app receives them, so the upload duration
+    is the time between the first and the last chunk as seen by the app.
+    """
+
+    __slots__ = (
+        "_receive",
+        "_clock",
+        "body_size",
+        "first_chunk_time",
+        "last_chunk_time",
+    )
+
+    def __init__(
+        self, receive: Receive, clock: Callable[[], int] = time.perf_counter_ns
+    ) -> None:
+        self._receive = receive
+        self._clock = clock
+        self.body_size = 0
+        self.first_chunk_time: Optional[int] = None
+        self.last_chunk_time: Optional[int] = None
+
+    async def receive(self) -> Message:
+        message = await self._receive()
+        if message["type"] == "http.request":
+            now = self._clock()
+            if self.first_chunk_time is None:
+                self.first_chunk_time = now
+            self.body_size += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                self.last_chunk_time = now
+        return message
+
+    @property
+    def upload_duration(self) -> Optional[int]:
+        """Nanoseconds between first and last chunk or `None` if incomplete."""
+
+        if self.first_chunk_time is None or self.last_chunk_time is None:
+            return None
+        return self.last_chunk_time - self.first_chunk_time
 
 
 class PrometheusInstrumentatorMiddleware:
+    # Upper bound for cached decisions of untemplated handlers. These are raw
+    # request paths, so the number of distinct values is not bounded.
+    max_untemplated_decisions = 1024
+
     def __init__(
         self,
         app: ASGIApp,
@@ -27,8 +198,16 @@ class PrometheusInstrumentatorMiddleware:
         should_respect_env_var: bool = False,
         should_instrument_requests_inprogress: bool = False,
         should_exclude_streaming_duration: bool = False,
+        should_use_lean_info: bool = False,
+        should_track_request_body: bool = False,
+        should_track_send_blocked_time: bool = False,
+        should_warm_up_series: bool = False,
         excluded_handlers: Sequence[str] = (),
         body_handlers: Sequence[str] = (),
+        max_body_size: Optional[int] = None,
+        body_observers: Sequence[Callable[[], Any]] = (),
+        excluded_paths: Sequence[str] = (),
+        excluded_path_prefixes: Sequence[str] = (),
         round_latency_decimals: int = 4,
         env_var_name: str = "ENABLE_METRICS",
         inprogress_name: str = "http_requests_inprogress",
@@ -64,6 +243,18 @@ class PrometheusInstrumentatorMiddleware:
         latency_lowr_buckets: Sequence[Union[float, str]] = (0.1, 0.5, 1),
         registry: CollectorRegistry = REGISTRY,
         custom_labels: dict = {},
+        route_name_cache: Optional[route_resolution.RouteNameCache] = None,
+        route_index: Optional[route_resolution.RouteIndex] = None,
+        batcher: Optional[MetricBatcher] = None,
+        instrumentation_queue: Optional[InstrumentationQueue] = None,
+        sampling_rate: float = 1.0,
+        handler_sampling_rates: Dict[str, float] = {},
+        overhead_budget_percent: Optional[float] = None,
+        overhead_budget_seconds: Optional[float] = None,
+        min_sampling_scale: float = 0.01,
+        clock: Callable[[], int] = time.perf_counter_ns,
+        warm_up_status_codes: Sequence[int] = (200, 400, 500),
+        max_label_combinations: Optional[int] = metrics.DEFAULT_MAX_LABEL_COMBINATIONS,
     ) -> None:
         self.app = app
 
@@ -73,16 +264,50 @@ class PrometheusInstrumentatorMiddleware:
         self.should_round_latency_decimals = should_round_latency_decimals
         self.should_respect_env_var = should_respect_env_var
         self.should_instrument_requests_inprogress = should_instrument_requests_inprogress
+        self.should_use_lean_info = should_use_lean_info
+        self.should_track_request_body = should_track_request_body
+        self.should_track_send_blocked_time = should_track_send_blocked_time
+        self.warm_up_status_codes = warm_up_status_codes
+
+        # Series are warmed up once the app and its routes are known, meaning
+        # on lifespan startup or on the first request.
+        self._pending_warm_up = should_warm_up_series
 
         self.round_latency_decimals = round_latency_decimals
+        self.clock = clock
+
+        # Timestamps are integer nanoseconds. Rounding to decimals of seconds
+        # is done on these integers with a negative number of digits.
+        self._round_ndigits: Optional[int] = (
+            round_latency_decimals - 9 if should_round_latency_decimals else None
+        )
         self.env_var_name = env_var_name
         self.inprogress_name = inprogress_name
         self.inprogress_labels = inprogress_labels
         self.registry = registry
         self.custom_labels = custom_labels
 
+        self.route_name_cache = route_name_cache
+        self.route_index = route_index
+        self.batcher = batcher
+
         self.excluded_handlers = [re.compile(path) for path in excluded_handlers]
         self.body_handlers = [re.compile(path) for path in body_handlers]
+        self.max_body_size = max_body_size
+        self.body_observers = body_observers
+
+        # Maps handler to tuple of `is_excluded` and `is_body_handler`.
+        self._templated_decisions: Dict[str, Tuple[bool, bool]] = {}
+        self._untemplated_decisions: Dict[str, Tuple[bool, bool]] = {}
+
+        for rate in (sampling_rate, *handler_sampling_rates.values()):
+            if not 0.0 < rate <= 1.0:
+                raise ValueError(f"Sampling rate must be in (0, 1], got {rate}.")
+        self.sampling_rate = sampling_rate
+        self.handler_sampling_rates = dict(handler_sampling_rates)
+
+        self.excluded_paths = frozenset(excluded_paths)
+        self.excluded_path_prefixes = tuple(excluded_path_prefixes)
 
         if instrumentations:
             self.instrumentations = instrumentations
@@ -96,6 +321,8 @@ class PrometheusInstrumentatorMiddleware:
                 latency_lowr_buckets=latency_lowr_buckets,
                 registry=self.registry,
                 custom_labels=custom_labels,
+                batcher=batcher,
+                max_label_combinations=max_label_combinations,
             )
             if default_instrumentation:
                 self.instrumentations = [default_instrumentation]
@@ -103,6 +330,16 @@ class PrometheusInstrumentatorMiddleware:
                 self.instrumentations = []
 
         self.async_instrumentations = async_instrumentations
+        self.instrumentation_queue = instrumentation_queue
+
+        # Components that hook into the lifespan of the app. On shutdown the
+        # queue is processed before batched observations are flushed.
+        self.lifespan_app = self.app
+        for component in (instrumentation_queue, batcher):
+            if component is not None:
+                self.lifespan_app = functools.partial(
+                    component.lifespan, self.lifespan_app
+                )
 
         self.inprogress: Optional[Gauge] = None
         if self.should_instrument_requests_inprogress:
@@ -121,124 +358,290 @@ class PrometheusInstrumentatorMiddleware:
                 multiprocess_mode="livesum",
             )
 
-    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
-        if scope["type"] != "http":
-            return await self.app(scope, receive, send)
+        self.adaptive_sampler: Optional[AdaptiveSampler] = None
+        if overhead_budget_percent is not None or overhead_budget_seconds is not None:
+            self.adaptive_sampler = AdaptiveSampler(
+                budget_percent=overhead_budget_percent,
+                budget_seconds=overhead_budget_seconds,
+                min_scale=min_sampling_scale,
+                metric_namespace=metric_namespace,
+                metric_subsystem=metric_subsystem,
+                registry=self.registry,
+            )
 
-        request = Request(scope)
-        start_time = default_timer()
+        self.sampling_rate_gauge: Optional[Gauge] = None
+        if (
+            sampling_rate < 1.0
+            or self.handler_sampling_rates
+            or self.adaptive_sampler is not None
+        ):
+            self.sampling_rate_gauge = metrics.register_or_reuse(
+                Gauge,
+                name="http_request_sampling_rate",
+                documentation=(
+                    "Share of requests that are instrumented by handler. "
+                    "Handler `__default__` is used for all other handlers."
+                ),
+                labelnames=("handler",),
+                namespace=metric_namespace,
+                subsystem=metric_subsystem,
+                registry=self.registry,
+                multiprocess_mode="liveall",
+            )
+            self._export_sampling_rates()
 
-        handler, is_templated = self._get_handler(request)
-        is_excluded = self._is_handler_excluded(handler, is_templated)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self._pending_warm_up:
+            self._warm_up(scope.get("app"))
+
+        # Excluded paths are checked before any routing work. Such requests are
+        # passed through without creating a request object, starting a timer
+        # or wrapping send.
+        if scope["type"] != "http" or self._is_path_excluded(scope["path"]):
+            return await self._call_uninstrumented(scope, receive, send)
+
+        # In lean mode the request object is only built if an instrumentation
+        # accesses it.
+        request = None if self.should_use_lean_info else Request(scope)
+        start_time = self.clock()
+
+        handler, is_templated = self._get_handler(scope, request)
+        is_excluded, is_body_handler = self._get_handler_decisions(handler, is_templated)
         handler = (
             "none" if not is_templated and self.should_group_untemplated else handler
         )
 
-        if not is_excluded and self.inprogress:
-            if self.inprogress_labels:
-                inprogress = self.inprogress.labels(request.method, handler)
-            else:
-                inprogress = self.inprogress
+        if is_excluded:
+            return await self.app(scope, receive, send)
+
+        inprogress = self._get_inprogress(scope["method"], handler)
+        if inprogress is not None:
             inprogress.inc()
 
-        status_code = 500
-        headers = []
-        body = b""
-        response_start_time = None
+        sample_weight = self._get_sample_weight(handler)
 
         # Message body collected for handlers matching body_handlers patterns.
-        if any(pattern.search(handler) for pattern in self.body_handlers):
-
-            async def send_wrapper(message: Message) -> None:
-                if message["type"] == "http.response.start":
-                    nonlocal status_code, headers, response_start_time
-                    headers = message["headers"]
-                    status_code = message["status"]
-                    response_start_time = default_timer()
-                elif message["type"] == "http.response.body" and message["body"]:
-                    nonlocal body
-                    body += message["body"]
-                await send(message)
-
-        else:
-
-            async def send_wrapper(message: Message) -> None:
-                if message["type"] == "http.response.start":
-                    nonlocal status_code, headers, response_start_time
-                    headers = message["headers"]
-                    status_code = message["status"]
-                    response_start_time = default_timer()
-                await send(message)
+        tracker = _ResponseTracker(
+            send,
+            clock=self.clock,
+            collect_body=is_body_handler,
+            max_body_size=self.max_body_size,
+            observer_factories=self.body_observers,
+        )
+        request_tracker = (
+            _RequestTracker(receive, self.clock)
+            if self.should_track_request_body
+            else None
+        )
+        if request_tracker is not None:
+            receive = request_tracker.receive
 
+        app_start_time = self.clock()
         try:
-            await self.app(scope, receive, send_wrapper)
-        except Exception as exc:
-            raise exc
-        finally:
-            status = (
-                str(status_code.value)
-                if isinstance(status_code, HTTPStatus)
-                else str(status_code)
+            await self.app(
+                scope,
+                receive,
+                (
+                    tracker.send_timed
+                    if self.should_track_send_blocked_time
+                    else tracker.send
+                ),
             )
+        finally:
+            end_time = self.clock()
+
+            if inprogress is not None:
+                inprogress.dec()
+
+            # Requests that have not been sampled are not instrumented.
+            if sample_weight:
+                await self._instrument(
+                    scope,
+                    request,
+                    handler,
+                    tracker,
+                    request_tracker,
+                    start_time,
+                    end_time,
+                    sample_weight,
+                )
 
-            if not is_excluded:
-                duration = max(default_timer() - start_time, 0.0)
-                duration_without_streaming = 0.0
+            if self.adaptive_sampler is not None:
+                self._record_overhead(start_time, app_start_time, end_time)
 
-                if response_start_time:
-                    duration_without_streaming = max(
-                        response_start_time - start_time, 0.0
-                    )
+    async def _instrument(
+        self,
+        scope: Scope,
+        request: Optional[Request],
+        handler: str,
+        tracker: _ResponseTracker,
+        request_tracker: Optional[_RequestTracker],
+        start_time: int,
+        end_time: int,
+        sample_weight: float,
+    ) -> None:
+        """Builds `Info` for a finished request and runs all instrumentations."""
+
+        status_code = tracker.status_code
+        headers = tracker.headers
+        response_start_time = tracker.start_time
+
+        status = status_label(status_code, self.should_group_status_codes)
+
+        duration = self._seconds(end_time - start_time)
+        duration_without_streaming = 0.0
+
+        if response_start_time is not None:
+            duration_without_streaming = self._seconds(response_start_time - start_time)
+
+        info = metrics.Info(
+            request=request,
+            response=None,
+            method=scope["method"],
+            modified_handler=handler,
+            modified_status=status,
+            modified_duration=duration,
+            modified_duration_without_streaming=duration_without_streaming,
+            scope=scope,
+            status_code=status_code,
+            response_headers=headers,
+            response_body_size=tracker.body_size,
+            sample_weight=sample_weight,
+            request_body_size=request_tracker.body_size if request_tracker else None,
+            upload_duration=self._elapsed(
+                0, request_tracker.upload_duration if request_tracker else None
+            ),
+            response_body_chunks=tracker.chunks,
+            response_body_truncated=tracker.body_truncated,
+            response_body_observers=tracker.observers,
+            time_to_first_byte=self._elapsed(start_time, tracker.first_chunk_time),
+            time_to_last_byte=self._elapsed(start_time, tracker.last_chunk_time),
+            response_chunk_count=tracker.chunk_count,
+            send_blocked_time=(
+                self._seconds(tracker.send_blocked_time)
+                if self.should_track_send_blocked_time
+                else None
+            ),
+        )
 
-                if self.should_instrument_requests_inprogress:
-                    inprogress.dec()
+        # The response object is built by `Info` on first access only, so the
+        # collected body chunks are not joined unless needed.
+        for instrumentation in self.instrumentations:
+            instrumentation(info)
 
-                if self.should_round_latency_decimals:
-                    duration = round(duration, self.round_latency_decimals)
-                    duration_without_streaming = round(
-                        duration_without_streaming, self.round_latency_decimals
-                    )
+        if self.instrumentation_queue is not None:
+            self.instrumentation_queue.put(info)
+        elif self.async_instrumentations:
+            await asyncio.gather(
+                *[
+                    instrumentation(info)
+                    for instrumentation in self.async_instrumentations
+                ]
+            )
 
-                if self.should_group_status_codes:
-                    status = status[0] + "xx"
+    def _seconds(self, nanoseconds: int) -> float:
+        """Converts nanoseconds of the clock to seconds, rounded if enabled."""
 
-                response = Response(
-                    content=body, headers=Headers(raw=headers), status_code=status_code
-                )
+        if nanoseconds <= 0:
+            return 0.0
+        if self._round_ndigits is not None:
+            nanoseconds = round(nanoseconds, self._round_ndigits)
+        return nanoseconds / 1e9
 
-                info = metrics.Info(
-                    request=request,
-                    response=response,
-                    method=request.method,
-                    modified_handler=handler,
-                    modified_status=status,
-                    modified_duration=duration,
-                    modified_duration_without_streaming=duration_without_streaming,
-                )
+    def _elapsed(self, start_time: int, time: Optional[int]) -> Optional[float]:
+        """Returns seconds between `start_time` and `time` if `time` is given."""
 
-                for instrumentation in self.instrumentations:
-                    instrumentation(info)
+        if time is None:
+            return None
+        return self._seconds(time - start_time)
 
-                await asyncio.gather(
-                    *[
-                        instrumentation(info)
-                        for instrumentation in self.async_instrumentations
+    def _warm_up(self, app: Any) -> None:
+        """Creates labeled children for all routes of `app` ahead of traffic.
+
+        Instrumentation functions from `metrics` carry a `warm_up` function
+        for this. Children are created for every route template, declared
+        method and status of `warm_up_status_codes`. Excluded handlers and
+        templates matched by `excluded_paths` or `excluded_path_prefixes` are
+        skipped. An instrumentation function is no longer warmed up once one
+        of its metrics has reached the limit of label combinations.
+        """
+
+        self._pending_warm_up = False
+        if app is None or not hasattr(app, "routes"):
+            return
+
+        warm_ups = [
+            warm_up
+            for warm_up in (
+                getattr(instrumentation, "warm_up", None)
+                for instrumentation in self.instrumentations
+            )
+            if warm_up is not None
+        ]
+        if not warm_ups:
+            return
+
+        statuses = dict.fromkeys(
+            status_label(code, self.should_group_status_codes)
+            for code in self.warm_up_status_codes
+        )
+        for template, methods in route_resolution.get_route_templates(app):
+            if (
+                self._is_path_excluded(template)
+                or self._get_handler_decisions(template, True)[0]
+            ):
+                continue
+            for method in sorted(methods):
+                for status in statuses:
+                    info = metrics.Info(
+                        request=None,
+                        response=None,
+                        method=method,
+                        modified_handler=template,
+                        modified_status=status,
+                        modified_duration=0.0,
+                    )
+                    warm_ups = [
+                        warm_up for warm_up in warm_ups if warm_up(info) is not False
                     ]
-                )
+                    if not warm_ups:
+                        return
+
+    async def _call_uninstrumented(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        """Passes request through to the app without instrumenting it.
+
+        The lifespan of the app is used to run the periodic flush of batched
+        metrics and to process queued async instrumentations on shutdown.
+        """
+
+        if scope["type"] == "lifespan":
+            return await self.lifespan_app(scope, receive, send)
+        return await self.app(scope, receive, send)
 
-    def _get_handler(self, request: Request) -> Tuple[str, bool]:
+    def _get_handler(
+        self, scope: Scope, request: Optional[Request] = None
+    ) -> Tuple[str, bool]:
         """Extracts either template or (if no template) path.
 
         Args:
-            request (Request): Python Requests request object.
+            scope (Scope): ASGI scope of the request.
+            request (Request, optional): Python Requests request object. If
+                given, the untemplated path is taken from its URL. Otherwise
+                the raw path from the scope is used.
 
         Returns:
             Tuple[str, bool]: Tuple with two elements. First element is either
                 template or if no template the path. Second element tells you
                 if the path is templated or not.
         """
-        route_name = routing.get_route_name(request)
-        return route_name or request.url.path, True if route_name else False
+        route_name = route_resolution.get_route_name_from_scope(
+            scope, self.route_name_cache, self.route_index
+        )
+        if route_name:
+            return route_name, True
+        return request.url.path if request else scope["path"], False
 
     def _is_handler_excluded(self, handler: str, is_templated: bool) -> bool:
         """Determines if the handler should be ignored.
@@ -258,3 +661,124 @@ class PrometheusInstrumentatorMiddleware:
             return True
 
         return False
+
+    def _is_body_handler(self, handler: str) -> bool:
+        """Determines if the response body should be collected for the handler.
+
+        Args:
+            handler (str): Handler after grouping of untemplated paths.
+
+        Returns:
+            bool: `True` if the body should be collected, `False` if not.
+        """
+
+        return any(pattern.search(handler) for pattern in self.body_handlers)
+
+    def _get_handler_decisions(
+        self, handler: str, is_templated: bool
+    ) -> Tuple[bool, bool]:
+        """Returns cached exclusion and body collection decisions.
+
+        The set of templated handlers is small and fixed, so their decisions
+        are cached indefinitely. Decisions for untemplated handlers are cached
+        up to `max_untemplated_decisions` entries before the cache is reset.
+
+        Args:
+            handler (str): Handler that handles the request.
+            is_templated (bool): Shows if the request is templated.
+
+        Returns:
+            Tuple[bool, bool]: Tuple with two elements. First element tells you
+                if the handler is excluded. Second element tells you if the
+                response body should be collected.
+        """
+
+        decisions = (
+            self._templated_decisions if is_templated else self._untemplated_decisions
+        )
+        decision = decisions.get(handler)
+        if decision is None:
+            modified_handler = (
+                "none" if not is_templated and self.should_group_untemplated else handler
+            )
+            decision = (
+                self._is_handler_excluded(handler, is_templated),
+                self._is_body_handler(modified_handler),
+            )
+            if not is_templated and len(decisions) >= self.max_untemplated_decisions:
+                decisions.clear()
+            decisions[handler] = decision
+        return decision
+
+    def _get_inprogress(self, method: str, handler: str) -> Optional[Gauge]:
+        """Returns the inprogress gauge (child) for the request if enabled."""
+
+        if self.inprogress is None:
+            return None
+        if self.inprogress_labels:
+            return self.inprogress.labels(method, handler)
+        return self.inprogress
+
+    def _get_sample_weight(self, handler: str) -> float:
+        """Decides if the request should be instrumented.
+
+        Args:
+            handler (str): Handler after grouping of untemplated paths.
+
+        Returns:
+            float: `0` if the request has not been sampled. Otherwise the
+                number of requests the sampled request stands for.
+        """
+
+        rate = self.handler_sampling_rates.get(handler, self.sampling_rate)
+        if self.adaptive_sampler is not None:
+            rate *= self.adaptive_sampler.scale
+        if rate >= 1.0:
+            return 1.0
+        if random.random() < rate:
+            return 1.0 / rate
+        return 0.0
+
+    def _record_overhead(
+        self, start_time: int, app_start_time: int, end_time: int
+    ) -> None:
+        """Passes overhead of the request to the adaptive sampler.
+
+        Overhead is the time spent before calling the app (route resolution)
+        plus the time spent after the app returned (instrumentation).
+        """
+
+        assert self.adaptive_sampler is not None
+
+        now = self.clock()
+        overhead = (app_start_time - start_time) + (now - end_time)
+        if self.adaptive_sampler.record(
+            overhead / 1e9, (now - start_time) / 1e9, now / 1e9
+        ):
+            self._export_sampling_rates()
+
+    def _export_sampling_rates(self) -> None:
+        """Sets the sampling rate gauge to the effective rates."""
+
+        if self.sampling_rate_gauge is None:
+            return
+
+        scale = self.adaptive_sampler.scale if self.adaptive_sampler else 1.0
+        self.sampling_rate_gauge.labels("__default__").set(self.sampling_rate * scale)
+        for handler, rate in self.handler_sampling_rates.items():
+            self.sampling_rate_gauge.labels(handler).set(rate * scale)
+
+    def _is_path_excluded(self, path: str) -> bool:
+        """Determines if the raw request path should be ignored.
+
+        Args:
+            path (str): Path of the request as found in the ASGI scope.
+
+        Returns:
+            bool: `True` if excluded, `False` if not.
+        """
+
+        return path in self.excluded_paths or (
+            bool(self.excluded_path_prefixes)
+            and path.startswith(self.excluded_path_prefixes)
+        )
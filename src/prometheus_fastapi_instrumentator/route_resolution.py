@@ -0,0 +1,405 @@
+"""
+This module contains helpers that speed up the resolution of route templates.
+
+`RouteNameCache` remembers resolved templates by request method and path.
+`RouteIndex` resolves templates with a path segment trie built from the routes
+of the app instead of trying every route one after another. Both fall back to
+the recursive matcher in `routing` where they cannot decide.
+"""
+
+from collections import OrderedDict
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    Hashable,
+    List,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Tuple,
+)
+
+from starlette.requests import HTTPConnection
+from starlette.routing import Mount, Route, WebSocketRoute, compile_path
+from starlette.types import Scope
+
+from prometheus_fastapi_instrumentator.routing import (
+    _child_routes,
+    _get_route_name,
+    _get_route_name_for_app,
+    _resolve_path,
+)
+
+
+class RouteNameCache:
+    """Bounded LRU cache for resolved route names.
+
+    Keys are built by `get_route_name` from the request method, path, root
+    path and the identity of the app. Only templated results are stored.
+    Untemplated paths (for example 404 scans with random paths) are rejected
+    so that they cannot flood the cache and evict the actual routes.
+
+    Host based routing is not part of the key. Apps that resolve the same
+    path to different templates depending on the `Host` header should not
+    use the cache.
+    """
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be at least 1, got {maxsize}.")
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+        self._data: "OrderedDict[Hashable, str]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[str]:
+        """Returns cached route name or `None` on a miss."""
+
+        route_name = self._data.get(key)
+        if route_name is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._data.move_to_end(key)
+        return route_name
+
+    def put(self, key: Hashable, route_name: Optional[str]) -> None:
+        """Stores route name. Untemplated results (`None`) are rejected."""
+
+        if route_name is None:
+            self.rejections += 1
+            return
+        self._data[key] = route_name
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """Removes all entries. Counters are kept."""
+
+        self._data.clear()
+
+    def info(self) -> Dict[str, int]:
+        """Returns hit, miss, eviction and rejection counters plus size."""
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "rejections": self.rejections,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
+
+
+class _RouteIndexEntry(NamedTuple):
+    """Route registered in a `RouteIndex` node.
+
+    `order` reproduces the position of the route in the (nested) route tree so
+    that the first matching route wins, like with the recursive matcher.
+    Claims are router-like routes (mounts, unindexable routes) that take over
+    every path below their prefix. A claim with `template` set to `None`
+    means that the recursive matcher must decide.
+    """
+
+    order: Tuple[float, ...]
+    template: Optional[str]
+    methods: Optional[FrozenSet[str]]
+    min_remaining: int = 0
+
+
+class _RouteIndexNode:
+    __slots__ = ("static", "dynamic", "tails", "leaves", "claims")
+
+    def __init__(self) -> None:
+        self.static: Dict[str, _RouteIndexNode] = {}
+        self.dynamic: Dict[str, Tuple[Pattern[str], _RouteIndexNode]] = {}
+        self.tails: List[Tuple[Pattern[str], _RouteIndexEntry]] = []
+        self.leaves: List[_RouteIndexEntry] = []
+        self.claims: List[_RouteIndexEntry] = []
+
+
+def _route_path(scope: Scope) -> str:
+    """Returns the request path relative to the `root_path` of the scope.
+
+    Same rules as the route matching of Starlette: the root path is only
+    removed if it is followed by a slash or is the whole path.
+    """
+
+    path: str = scope["path"]
+    root_path = scope.get("root_path", "")
+    if not root_path or not path.startswith(root_path):
+        return path
+    if path == root_path:
+        return ""
+    if path.startswith(root_path + "/"):
+        return path.removeprefix(root_path)
+    return path
+
+
+def _split_path(path: str) -> List[str]:
+    return path[1:].split("/") if path else []
+
+
+class RouteIndex:
+    """Path segment trie for resolving route templates.
+
+    Built once from the route tree of an app. Resolves templates in
+    O(path depth) instead of trying every route with its regex. Mounts,
+    FastAPI's `_IncludedRouter` prefixes and `{param}` / `{param:path}`
+    convertors are indexed. Everything else (for example `Host` routes) is
+    recorded as a claim on its prefix, and requests that reach such a claim
+    before any indexed route fall back to the recursive matcher. The same
+    happens for requests without a full match, so partial matches (wrong
+    method) and unknown paths are labelled exactly as before.
+
+    The index is built lazily on first use. Call `rebuild()` after adding
+    routes to the app at run-time.
+    """
+
+    def __init__(self) -> None:
+        self._app: Any = None
+        self._root: Optional[_RouteIndexNode] = None
+
+    def rebuild(self, app: Any = None) -> None:
+        """Rebuilds the index.
+
+        Args:
+            app: App to index. If `None`, the index is dropped and rebuilt
+                from the app of the next resolved request.
+        """
+
+        if app is None:
+            self._app = None
+            self._root = None
+            return
+
+        root = _RouteIndexNode()
+        self._index_routes(root, list(app.routes), "", ())
+        self._app = app
+        self._root = root
+
+    def resolve(self, scope: Scope, app: Any) -> Optional[str]:
+        """Resolves route template for `scope` against routes of `app`."""
+
+        if self._root is None or self._app is not app:
+            self.rebuild(app)
+
+        entry = self._lookup(_split_path(_route_path(scope)), scope.get("method", ""))
+        if entry is None or entry.template is None:
+            return _get_route_name(scope, app.routes)
+        return entry.template
+
+    def _index_routes(
+        self,
+        root: _RouteIndexNode,
+        routes: List[Any],
+        prefix: str,
+        order: Tuple[float, ...],
+    ) -> None:
+        for position, route in enumerate(routes):
+            key = order + (position,)
+            if isinstance(route, Mount):
+                path = prefix + route.path
+                if ":path}" in route.path:
+                    self._insert(root, prefix, _RouteIndexEntry(key, None, None))
+                    continue
+                children = route.routes
+                if children:
+                    self._index_routes(root, list(children), path, key)
+                    template = None
+                else:
+                    template = path
+                self._insert(
+                    root, path, _RouteIndexEntry(key + (float("inf"),), template, None, 1)
+                )
+            elif isinstance(route, Route):
+                methods = frozenset(route.methods) if route.methods else None
+                path = prefix + route.path
+                self._insert(
+                    root, path, _RouteIndexEntry(key, path, methods), is_leaf=True
+                )
+            elif isinstance(route, WebSocketRoute):
+                # Never matches HTTP requests.
+                continue
+            elif (
+                getattr(route, "include_context", None) is not None
+                and getattr(route, "original_router", None) is not None
+            ):
+                path = prefix + (getattr(route.include_context, "prefix", "") or "")
+                self._index_routes(root, list(route.original_router.routes), path, key)
+                if getattr(route.original_router, "_low_priority_routes", None):
+                    self._insert(
+                        root, path, _RouteIndexEntry(key + (float("inf"),), None, None)
+                    )
+            else:
+                self._insert(root, prefix, _RouteIndexEntry(key, None, None))
+
+    def _insert(
+        self,
+        root: _RouteIndexNode,
+        path: str,
+        entry: _RouteIndexEntry,
+        is_leaf: bool = False,
+    ) -> None:
+        node = root
+        segments = _split_path(path)
+        for i, segment in enumerate(segments):
+            if "{" not in segment:
+                node = node.static.setdefault(segment, _RouteIndexNode())
+            elif ":path}" in segment:
+                if is_leaf:
+                    tail = "/" + "/".join(segments[i:])
+                    node.tails.append((compile_path(tail)[0], entry))
+                else:
+                    # Cannot tell where the claimed prefix ends.
+                    node.claims.append(entry._replace(template=None, min_remaining=0))
+                return
+            else:
+                if segment not in node.dynamic:
+                    node.dynamic[segment] = (
+                        compile_path("/" + segment)[0],
+                        _RouteIndexNode(),
+                    )
+                node = node.dynamic[segment][1]
+
+        if is_leaf:
+            node.leaves.append(entry)
+        else:
+            node.claims.append(entry)
+
+    def _lookup(self, segments: List[str], method: str) -> Optional[_RouteIndexEntry]:
+        """Returns the first route in route tree order that matches."""
+
+        assert self._root is not None
+
+        best: Optional[_RouteIndexEntry] = None
+        stack = [(self._root, 0)]
+        while stack:
+            node, i = stack.pop()
+            best = self._best_in_node(node, segments, i, method, best)
+
+            if i == len(segments):
+                continue
+
+            segment = segments[i]
+            child = node.static.get(segment)
+            if child is not None:
+                stack.append((child, i + 1))
+            if node.dynamic:
+                slashed = "/" + segment
+                for regex, child in node.dynamic.values():
+                    if regex.match(slashed):
+                        stack.append((child, i + 1))
+
+        return best
+
+    @staticmethod
+    def _best_in_node(
+        node: _RouteIndexNode,
+        segments: List[str],
+        i: int,
+        method: str,
+        best: Optional[_RouteIndexEntry],
+    ) -> Optional[_RouteIndexEntry]:
+        """Returns the earliest of `best` and the entries of `node` matching."""
+
+        remaining = len(segments) - i
+
+        for claim in node.claims:
+            if remaining >= claim.min_remaining and (
+                best is None or claim.order < best.order
+            ):
+                best = claim
+
+        candidates: List[_RouteIndexEntry] = []
+        if node.tails:
+            rest = "/" + "/".join(segments[i:]) if remaining else ""
+            candidates.extend(leaf for regex, leaf in node.tails if regex.match(rest))
+        if remaining == 0:
+            candidates.extend(node.leaves)
+
+        for leaf in candidates:
+            if (best is None or leaf.order < best.order) and (
+                leaf.methods is None or method in leaf.methods
+            ):
+                best = leaf
+
+        return best
+
+
+def get_route_templates(app: Any) -> List[Tuple[str, FrozenSet[str]]]:
+    """Collects templates and methods of all HTTP routes of `app`.
+
+    Walks into mounts and routers registered with `include_router()`. Routes
+    without declared methods and mounted apps without routes are skipped
+    because the requests they handle are not known upfront.
+
+    Returns:
+        List of tuples with the template and the set of methods of each route.
+    """
+
+    templates: List[Tuple[str, FrozenSet[str]]] = []
+    _collect_route_templates(list(app.routes), "", templates)
+    return templates
+
+
+def _collect_route_templates(
+    routes: List[Any], prefix: str, templates: List[Tuple[str, FrozenSet[str]]]
+) -> None:
+    for route in routes:
+        if isinstance(route, WebSocketRoute):
+            continue
+        if isinstance(route, Route):
+            if route.methods:
+                templates.append((prefix + route.path, frozenset(route.methods)))
+            continue
+        children = _child_routes(route)
+        if children:
+            path = _resolve_path(route) or ""
+            _collect_route_templates(children, prefix + path, templates)
+
+
+def get_route_name(
+    request: HTTPConnection,
+    cache: Optional[RouteNameCache] = None,
+    index: Optional[RouteIndex] = None,
+) -> Optional[str]:
+    """Gets route name for given request taking mounts into account.
+
+    Like `routing.get_route_name()`. If `cache` is given, it is consulted
+    before walking the route tree and templated results are stored in it
+    afterwards. If `index` is given, it is used instead of trying every route
+    one after another.
+    """
+
+    return get_route_name_from_scope(request.scope, cache, index)
+
+
+def get_route_name_from_scope(
+    scope: Scope,
+    cache: Optional[RouteNameCache] = None,
+    index: Optional[RouteIndex] = None,
+) -> Optional[str]:
+    """Like `get_route_name` but works on the raw ASGI scope."""
+
+    app = scope["app"]
+    resolve = index.resolve if index is not None else None
+
+    if cache is None:
+        return _get_route_name_for_app(scope, app, resolve)
+
+    key = (scope.get("method"), scope["path"], scope.get("root_path", ""), id(app))
+    route_name = cache.get(key)
+    if route_name is None:
+        route_name = _get_route_name_for_app(scope, app, resolve)
+        cache.put(key, route_name)
+    return route_name
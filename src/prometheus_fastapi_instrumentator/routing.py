@@ -37,7 +37,7 @@ is contained in a dedicated module.
 Based on code from [elastic/apm-agent-python](https://github.com/elastic/apm-agent-python/blob/527f62c0c50842f94ef90fda079853372539319a/elasticapm/contrib/starlette/__init__.py).
 """
 
-from typing import List, Optional
+from typing import Any, Callable, List, Optional
 
 from starlette.requests import HTTPConnection
 from starlette.routing import Match, Mount, Route
@@ -154,10 +154,23 @@ def _get_route_name(
 def get_route_name(request: HTTPConnection) -> Optional[str]:
     """Gets route name for given request taking mounts into account."""
 
-    app = request.app
-    scope = request.scope
-    routes = app.routes
-    route_name = _get_route_name(scope, routes)
+    return _get_route_name_for_app(request.scope, request.app)
+
+
+def _get_route_name_for_app(
+    scope: Scope,
+    app: Any,
+    resolve: Optional[Callable[[Scope, Any], Optional[str]]] = None,
+) -> Optional[str]:
+    """Resolves route name against routes of `app` with slash redirection.
+
+    `resolve` takes the scope and the app and returns the route name without
+    slash redirection. Defaults to trying every route of the app.
+    """
+
+    if resolve is None:
+        resolve = _get_route_name_from_app
+    route_name = resolve(scope, app)
 
     # Starlette magically redirects requests if the path matches a route name
     # with a trailing slash appended or removed. To not spam the transaction
@@ -172,8 +185,12 @@ def get_route_name(request: HTTPConnection) -> Optional[str]:
             redirect_scope["path"] = scope["path"] + "/"
             trim = False
 
-        route_name = _get_route_name(redirect_scope, routes)
+        route_name = resolve(redirect_scope, app)
         if route_name is not None:
             route_name = route_name.rstrip("/")
             route_name = route_name + "/" if trim else route_name
     return route_name
+
+
+def _get_route_name_from_app(scope: Scope, app: Any) -> Optional[str]:
+    return _get_route_name(scope, app.routes)
@@ -0,0 +1,162 @@
+"""
+This module contains the adaptive sampling used by the middleware.
+
+The middleware measures its own overhead, meaning the time spent outside of
+the wrapped app for route resolution and instrumentation. The sampler keeps
+that overhead within a budget by scaling the configured sampling rates down if
+the budget is exceeded and up again once there is enough headroom.
+"""
+
+from typing import Optional
+
+from prometheus_client import REGISTRY, CollectorRegistry, Gauge
+
+from prometheus_fastapi_instrumentator import metrics
+
+
+class AdaptiveSampler:
+    # Seconds between adjustments.
+    interval = 1.0
+
+    # Factors applied to the scale once per interval.
+    decrease_factor = 0.5
+    increase_factor = 1.25
+
+    # Scale is only raised again if the overhead is below this share of the
+    # budget. Prevents flapping around the budget.
+    headroom = 0.5
+
+    def __init__(
+        self,
+        budget_percent: Optional[float] = None,
+        budget_seconds: Optional[float] = None,
+        min_scale: float = 0.01,
+        metric_namespace: str = "",
+        metric_subsystem: str = "",
+        registry: CollectorRegistry = REGISTRY,
+    ) -> None:
+        """Creates an adaptive sampler that enforces an overhead budget.
+
+        Registers the following metrics:
+
+        * `http_instrumentation_overhead_seconds`: Average overhead per request
+            during the last interval.
+        * `http_instrumentation_overhead_ratio`: Overhead as share of the total
+            request duration during the last interval.
+        * `http_instrumentation_sampling_scale`: Factor currently applied to
+            the configured sampling rates.
+
+        Args:
+            budget_percent (float, optional): Budget as percentage of the total
+                request duration. Defaults to `None`.
+
+            budget_seconds (float, optional): Budget as average seconds per
+                request. Defaults to `None`.
+
+            min_scale (float): Lower bound for the factor applied to the
+                configured sampling rates. Defaults to `0.01`.
+
+        Raises:
+            ValueError: If not exactly one budget is given or if `min_scale` is
+                not in (0, 1].
+        """
+
+        if (budget_percent is None) == (budget_seconds is None):
+            raise ValueError("Exactly one of budget_percent and budget_seconds needed.")
+        if not 0.0 < min_scale <= 1.0:
+            raise ValueError(f"min_scale must be in (0, 1], got {min_scale}.")
+
+        self.budget_percent = budget_percent
+        self.budget_seconds = budget_seconds
+        self.min_scale = min_scale
+
+        self.scale = 1.0
+
+        self._window_start: Optional[float] = None
+        self._window_overhead = 0.0
+        self._window_duration = 0.0
+        self._window_requests = 0
+
+        self.overhead_seconds = metrics.register_or_reuse(
+            Gauge,
+            name="http_instrumentation_overhead_seconds",
+            documentation="Average instrumentation overhead per request.",
+            namespace=metric_namespace,
+            subsystem=metric_subsystem,
+            registry=registry,
+            multiprocess_mode="liveall",
+        )
+        self.overhead_ratio = metrics.register_or_reuse(
+            Gauge,
+            name="http_instrumentation_overhead_ratio",
+            documentation="Instrumentation overhead as share of request duration.",
+            namespace=metric_namespace,
+            subsystem=metric_subsystem,
+            registry=registry,
+            multiprocess_mode="liveall",
+        )
+        self.scale_gauge = metrics.register_or_reuse(
+            Gauge,
+            name="http_instrumentation_sampling_scale",
+            documentation="Factor applied to the configured sampling rates.",
+            namespace=metric_namespace,
+            subsystem=metric_subsystem,
+            registry=registry,
+            multiprocess_mode="liveall",
+        )
+        self.scale_gauge.set(self.scale)
+
+    def record(self, overhead: float, duration: float, now: float) -> bool:
+        """Records overhead of a single request.
+
+        Args:
+            overhead (float): Seconds spent outside of the wrapped app.
+            duration (float): Total seconds spent in the middleware.
+            now (float): Current time as given by the clock of the middleware.
+
+        Returns:
+            bool: `True` if the scale has been changed, `False` if not.
+        """
+
+        self._window_overhead += overhead
+        self._window_duration += duration
+        self._window_requests += 1
+
+        if self._window_start is None:
+            self._window_start = now
+        elif now - self._window_start >= self.interval:
+            return self._adjust(now)
+        return False
+
+    def _adjust(self, now: float) -> bool:
+        overhead_per_request = self._window_overhead / self._window_requests
+        ratio = (
+            self._window_overhead / self._window_duration
+            if self._window_duration
+            else 0.0
+        )
+
+        self.overhead_seconds.set(overhead_per_request)
+        self.overhead_ratio.set(ratio)
+
+        self._window_start = now
+        self._window_overhead = 0.0
+        self._window_duration = 0.0
+        self._window_requests = 0
+
+        if self.budget_percent is not None:
+            measured, budget = ratio * 100, self.budget_percent
+        else:
+            measured, budget = overhead_per_request, self.budget_seconds or 0.0
+
+        scale = self.scale
+        if measured > budget:
+            scale = max(self.min_scale, scale * self.decrease_factor)
+        elif measured < budget * self.headroom:
+            scale = min(1.0, scale * self.increase_factor)
+
+        if scale == self.scale:
+            return False
+        self.scale = scale
+        self.scale_gauge.set(scale)
+        return True
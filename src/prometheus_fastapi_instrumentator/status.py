@@ -0,0 +1,71 @@
+"""
+This module contains precomputed status code labels.
+
+The status label is derived for every instrumented request. Instead of
+converting and slicing the status code each time, labels are looked up in
+tables indexed by the status code. The tables cover all codes below 600 and
+hold interned strings, so equal labels are the same objects. Other codes fall
+back to computing the label.
+"""
+
+import sys
+from typing import Dict, Tuple
+
+# Status codes below this value are covered by the tables.
+TABLE_SIZE = 600
+
+# Status code as string, for example "404".
+STATUS_LABELS: Tuple[str, ...] = tuple(
+    sys.intern(str(code)) for code in range(TABLE_SIZE)
+)
+
+# Status code grouped into its class, for example "4xx".
+GROUPED_STATUS_LABELS: Tuple[str, ...] = tuple(
+    sys.intern(label[0] + "xx") for label in STATUS_LABELS
+)
+
+# Whether a label starts with "2", keyed by all labels of both tables.
+IS_2XX: Dict[str, bool] = {
+    label: label.startswith("2") for label in STATUS_LABELS + GROUPED_STATUS_LABELS
+}
+
+
+def status_label(status_code: int, grouped: bool = False) -> str:
+    """Returns the label for a status code.
+
+    Args:
+        status_code (int): Status code. Can also be a `HTTPStatus`.
+
+        grouped (bool): Should the status code be grouped into its class, for
+            example `"4xx"`? Defaults to `False`.
+
+    Returns:
+        str: Label like `"404"` or `"4xx"`.
+    """
+
+    if 0 <= status_code < TABLE_SIZE:
+        if grouped:
+            return GROUPED_STATUS_LABELS[status_code]
+        return STATUS_LABELS[status_code]
+
+    label = str(int(status_code))
+    return label[0] + "xx" if grouped else label
+
+
+def is_2xx(status: str) -> bool:
+    """Returns whether a status label denotes a 2xx success.
+
+    Args:
+        status (str): Label like `"204"` or `"2xx"`, for example
+            `Info.modified_status`. Labels from the tables are looked up.
+            Anything else, like a status code set on a hand-built `Info`, is
+            converted to a string and checked for a leading `2`.
+
+    Returns:
+        bool: `True` if the label starts with `2`.
+    """
+
+    result = IS_2XX.get(status)
+    if result is None:
+        return str(status).startswith("2")
+    return result
@@ -0,0 +1,220 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import FastAPI
+from helpers import utils
+from prometheus_client import REGISTRY, CollectorRegistry
+from starlette.testclient import TestClient
+
+from prometheus_fastapi_instrumentator import Instrumentator, metrics
+from prometheus_fastapi_instrumentator.background import InstrumentationQueue
+
+# ------------------------------------------------------------------------------
+# Setup
+
+
+def create_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/")
+    def read_root():
+        return "Hello World!"
+
+    return app
+
+
+async def run_queue(queue: InstrumentationQueue, items: list) -> None:
+    for item in items:
+        queue.put(item)
+    await queue.close()
+
+
+# ------------------------------------------------------------------------------
+# Queue
+
+
+@pytest.mark.parametrize(
+    "overflow,expected", [("drop_oldest", [3, 4]), ("drop_newest", [0, 1])]
+)
+def test_overflow_policies(overflow: str, expected: list):
+    registry = CollectorRegistry()
+    processed = []
+
+    async def instrumentation(info):
+        processed.append(info)
+
+    queue = InstrumentationQueue(
+        [instrumentation], maxsize=2, overflow=overflow, registry=registry
+    )
+
+    asyncio.run(run_queue(queue, [0, 1, 2, 3, 4]))
+
+    assert processed == expected
+    assert registry.get_sample_value("http_instrumentation_dropped_total") == 3
+
+
+def test_timeout():
+    registry = CollectorRegistry()
+    processed = []
+
+    async def slow(info):
+        await asyncio.sleep(10)
+
+    async def fast(info):
+        processed.append(info)
+
+    queue = InstrumentationQueue([slow, fast], timeout=0.01, registry=registry)
+
+    asyncio.run(run_queue(queue, [0, 1]))
+
+    assert processed == [0, 1]
+    assert registry.get_sample_value("http_instrumentation_timeouts_total") == 2
+
+
+def test_exception_reported_to_loop():
+    errors = []
+    processed = []
+
+    async def failing(info):
+        raise RuntimeError(info)
+
+    async def working(info):
+        processed.append(info)
+
+    queue = InstrumentationQueue([failing, working], registry=CollectorRegistry())
+
+    async def main():
+        asyncio.get_running_loop().set_exception_handler(
+            lambda loop, context: errors.append(context["exception"])
+        )
+        await run_queue(queue, [0, 1])
+
+    asyncio.run(main())
+
+    assert processed == [0, 1]
+    assert [str(error) for error in errors] == ["0", "1"]
+
+
+def test_depth_metric():
+    registry = CollectorRegistry()
+
+    async def instrumentation(info):
+        pass
+
+    queue = InstrumentationQueue([instrumentation], workers=2, registry=registry)
+
+    async def main():
+        for i in range(3):
+            queue.put(i)
+        depth = registry.get_sample_value("http_instrumentation_queue_depth")
+        await queue.close()
+        return depth
+
+    assert asyncio.run(main()) == 3
+    assert registry.get_sample_value("http_instrumentation_queue_depth") == 0
+
+
+def test_metrics_shared_by_queues_of_registry():
+    registry = CollectorRegistry()
+
+    async def instrumentation(info):
+        pass
+
+    queues = [InstrumentationQueue([instrumentation], registry=registry) for _ in "ab"]
+
+    async def main():
+        for queue in queues:
+            queue.put(0)
+        depth = registry.get_sample_value("http_instrumentation_queue_depth")
+        for queue in queues:
+            await queue.close()
+        return depth
+
+    assert queues[1].dropped is queues[0].dropped
+    assert asyncio.run(main()) == 2
+
+
+def test_close_timeout_drops_and_logs(caplog):
+    processed = []
+
+    async def stuck(info):
+        processed.append(info)
+        await asyncio.sleep(60)
+
+    queue = InstrumentationQueue([stuck], registry=CollectorRegistry())
+
+    async def main():
+        for i in range(3):
+            queue.put(i)
+        await queue.close(timeout=0.05)
+
+    start = time.perf_counter()
+    asyncio.run(main())
+
+    assert time.perf_counter() - start < 5
+    assert processed == [0]
+    assert "Dropped 2 queued requests" in caplog.text
+
+
+def test_shutdown_timeout_bounds_lifespan():
+    utils.reset_collectors()
+    app = create_app()
+
+    async def stuck(info: metrics.Info):
+        await asyncio.sleep(60)
+
+    Instrumentator(
+        should_queue_async_instrumentations=True,
+        async_instrumentation_shutdown_timeout=0.05,
+    ).add(stuck).instrument(app)
+
+    start = time.perf_counter()
+    with TestClient(app) as client:
+        client.get("/")
+
+    assert time.perf_counter() - start < 5
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{"maxsize": 0}, {"workers": 0}, {"overflow": "block"}]
+)
+def test_invalid_arguments(kwargs: dict):
+    with pytest.raises(ValueError):
+        InstrumentationQueue([], registry=CollectorRegistry(), **kwargs)
+
+
+# ------------------------------------------------------------------------------
+# Instrumentator
+
+
+def test_queued_async_instrumentations_off_response_path():
+    utils.reset_collectors()
+    app = create_app()
+    processed = []
+    release = asyncio.Event()
+
+    async def blocked(info: metrics.Info):
+        await release.wait()
+        processed.append(info.modified_handler)
+
+    Instrumentator(should_queue_async_instrumentations=True).add(blocked).instrument(app)
+
+    with TestClient(app) as client:
+        # Responses return although the instrumentation cannot finish yet.
+        assert client.get("/").status_code == 200
+        assert client.get("/").status_code == 200
+        assert processed == []
+
+        assert client.portal is not None
+        client.portal.call(release.set)
+
+    # Remaining requests are processed on shutdown.
+    assert processed == ["/", "/"]
+    assert (
+        REGISTRY.get_sample_value(
+            "http_requests_total",
+            {"handler": "/", "method": "GET", "status": "2xx"},
+        )
+        == 2
+    )
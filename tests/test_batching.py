@@ -0,0 +1,183 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from helpers import utils
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram, Summary
+from starlette.testclient import TestClient
+
+from prometheus_fastapi_instrumentator import Instrumentator
+from prometheus_fastapi_instrumentator.batching import MetricBatcher
+
+# ------------------------------------------------------------------------------
+# Setup
+
+
+def create_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/")
+    def read_root():
+        return "Hello World!"
+
+    @app.get("/items/{item_id}")
+    def read_item(item_id: int):
+        return {"item_id": item_id}
+
+    return app
+
+
+def get_total(handler: str) -> float:
+    return REGISTRY.get_sample_value(
+        "http_requests_total",
+        {"handler": handler, "method": "GET", "status": "2xx"},
+    )
+
+
+# ------------------------------------------------------------------------------
+# Batcher
+
+
+def test_batched_histogram_matches_direct_observations():
+    registry = CollectorRegistry()
+    buckets = (0.1, 0.5, 1)
+    batched = Histogram("batched", "doc", buckets=buckets, registry=registry)
+    direct = Histogram("direct", "doc", buckets=buckets, registry=registry)
+    batcher = MetricBatcher()
+    proxy = batcher.wrap(batched)
+    values = [0.0, 0.05, 0.1, 0.3, 0.5, 0.7, 1, 2, 100]
+
+    async def record():
+        for value in values:
+            proxy.observe(value)
+
+    asyncio.run(record())
+    assert registry.get_sample_value("batched_count") == 0
+
+    batcher.flush()
+    for value in values:
+        direct.observe(value)
+
+    for le in ["0.1", "0.5", "1.0", "+Inf"]:
+        assert registry.get_sample_value(
+            "batched_bucket", {"le": le}
+        ) == registry.get_sample_value("direct_bucket", {"le": le})
+    assert registry.get_sample_value("batched_sum") == registry.get_sample_value(
+        "direct_sum"
+    )
+
+
+def test_batched_counter_and_summary():
+    registry = CollectorRegistry()
+    counter = Counter("c", "doc", labelnames=("a",), registry=registry)
+    summary = Summary("s", "doc", registry=registry)
+    batcher = MetricBatcher()
+    counter_proxy = batcher.wrap(counter.labels("x"))
+    summary_proxy = batcher.wrap(summary)
+
+    async def record():
+        for _ in range(3):
+            counter_proxy.inc()
+            summary_proxy.observe(2)
+        counter_proxy.inc(0.5)
+
+    asyncio.run(record())
+    batcher.flush()
+
+    assert registry.get_sample_value("c_total", {"a": "x"}) == 3.5
+    assert registry.get_sample_value("s_count") == 3
+    assert registry.get_sample_value("s_sum") == 6
+
+
+def test_batched_counter_rejects_negative_amount():
+    counter = Counter("c", "doc", registry=CollectorRegistry())
+    proxy = MetricBatcher().wrap(counter)
+
+    with pytest.raises(ValueError):
+        proxy.inc(-1)
+
+
+def test_batcher_records_directly_without_event_loop():
+    registry = CollectorRegistry()
+    counter = Counter("c", "doc", registry=registry)
+
+    MetricBatcher().wrap(counter).inc()
+
+    assert registry.get_sample_value("c_total") == 1
+
+
+def test_flush_forgets_closed_event_loops():
+    counter = Counter("c", "doc", registry=CollectorRegistry())
+    batcher = MetricBatcher()
+    proxy = batcher.wrap(counter)
+
+    async def record():
+        proxy.inc()
+
+    for _ in range(3):
+        asyncio.run(record())
+    assert len(batcher._buffers) == 3
+
+    batcher.flush()
+
+    assert len(batcher._buffers) == 0
+
+
+# ------------------------------------------------------------------------------
+# Instrumentator
+
+
+def test_batched_metrics_flushed_on_expose():
+    utils.reset_collectors()
+    app = create_app()
+    Instrumentator(should_batch_metrics=True).instrument(app).expose(app)
+    client = TestClient(app)
+
+    for i in range(5):
+        client.get(f"/items/{i}")
+    client.get("/")
+
+    response = client.get("/metrics")
+
+    assert (
+        'http_requests_total{handler="/items/{item_id}",method="GET",status="2xx"} 5.0'
+        in response.text
+    )
+    assert get_total("/items/{item_id}") == 5
+    assert get_total("/") == 1
+    assert (
+        REGISTRY.get_sample_value(
+            "http_request_duration_seconds_count",
+            {"handler": "/", "method": "GET"},
+        )
+        == 1
+    )
+
+
+def test_batched_metrics_flushed_on_shutdown():
+    utils.reset_collectors()
+    app = create_app()
+    Instrumentator(should_batch_metrics=True, metrics_flush_interval=60).instrument(app)
+
+    with TestClient(app) as client:
+        client.get("/")
+        client.get("/")
+        assert get_total("/") == 0
+
+    assert get_total("/") == 2
+
+
+def test_batched_metrics_flushed_periodically():
+    utils.reset_collectors()
+    app = create_app()
+    Instrumentator(should_batch_metrics=True, metrics_flush_interval=0.01).instrument(app)
+
+    @app.get("/wait")
+    async def wait():
+        await asyncio.sleep(0.1)
+        return None
+
+    with TestClient(app) as client:
+        client.get("/")
+        client.get("/wait")
+        assert get_total("/") == 1
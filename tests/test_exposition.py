@@ -0,0 +1,526 @@
+import asyncio
+import contextlib
+import gzip
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+from fastapi import FastAPI
+from helpers import utils
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Enum,
+    Gauge,
+    Histogram,
+    Info,
+    Summary,
+    generate_latest,
+)
+from prometheus_client.core import (
+    GaugeHistogramMetricFamily,
+    GaugeMetricFamily,
+    UnknownMetricFamily,
+)
+from starlette.testclient import TestClient
+
+from prometheus_fastapi_instrumentator import Instrumentator
+from prometheus_fastapi_instrumentator.exposition import (
+    ExecutorRender,
+    ExpositionCache,
+    SeriesRenderer,
+    SingleFlight,
+    iter_gzip,
+    iter_latest,
+    shutdown_on_exit,
+)
+
+# ------------------------------------------------------------------------------
+# Setup
+
+
+def create_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/")
+    def read_root():
+        return "Hello World!"
+
+    return app
+
+
+class CustomCollector:
+    def collect(self):
+        yield GaugeHistogramMetricFamily(
+            "queue", "Queue.", buckets=[("1.0", 1), ("+Inf", 3)], gsum_value=2
+        )
+        family = GaugeMetricFamily("stamped", "Stamped.", labels=["k"])
+        family.add_metric(["v"], 1.5, timestamp=12.345)
+        yield family
+        yield UnknownMetricFamily("unknown", "Unknown.", value=float("nan"))
+
+
+def create_registry() -> CollectorRegistry:
+    registry = CollectorRegistry()
+    counter = Counter("c", 'Escaped \\ and\n"', ["a", "b"], registry=registry)
+    counter.labels('x"y\n', "z\\").inc(2)
+    Histogram("h", "Histogram.", ["m"], registry=registry).labels("GET").observe(1)
+    Gauge("g", "Gauge.", registry=registry).set(float("inf"))
+    Info("i", "Info.", registry=registry).info({"version": "1"})
+    Enum("e", "Enum.", states=["a", "b"], registry=registry)
+    Summary("s", "Summary.", registry=registry).observe(0.5)
+    registry.register(CustomCollector())
+    return registry
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def create_cache(ttl: float = 10.0):
+    renders = []
+
+    def render() -> bytes:
+        renders.append(None)
+        return f"render {len(renders)}".encode()
+
+    clock = FakeClock()
+    return ExpositionCache(render, ttl, clock), clock
+
+
+# ------------------------------------------------------------------------------
+# Cache
+
+
+def test_cache_serves_snapshot_until_expired():
+    cache, clock = create_cache(ttl=10.0)
+
+    snapshot = cache.get()
+    assert snapshot.data == b"render 1"
+
+    clock.now = 9.5
+    assert cache.get() is snapshot
+    assert cache.age(snapshot) == 9.5
+
+    clock.now = 10.0
+    assert cache.get().data == b"render 2"
+
+
+def test_cache_compresses_once():
+    cache, _ = create_cache()
+
+    snapshot = cache.get()
+    gzipped = snapshot.gzipped
+
+    assert gzip.decompress(gzipped) == b"render 1"
+    assert cache.get().gzipped is gzipped
+
+
+def test_cache_invalid_ttl():
+    with pytest.raises(ValueError):
+        ExpositionCache(lambda: b"", 0)
+
+
+# ------------------------------------------------------------------------------
+# Single flight
+
+
+def create_blocking_render():
+    started = threading.Event()
+    release = threading.Event()
+    renders = []
+
+    def render() -> bytes:
+        renders.append(None)
+        started.set()
+        assert release.wait(5)
+        if len(renders) > 1:
+            raise RuntimeError("render failed")
+        return b"rendered"
+
+    return render, started, release, renders
+
+
+def test_single_flight_threads():
+    render, started, release, renders = create_blocking_render()
+    single_flight = SingleFlight(render)
+
+    with ThreadPoolExecutor(4) as executor:
+        leader = executor.submit(single_flight)
+        assert started.wait(5)
+        waiters = [executor.submit(single_flight) for _ in range(3)]
+        release.set()
+        results = [leader.result(5)] + [waiter.result(5) for waiter in waiters]
+
+    assert results == [b"rendered"] * 4
+    assert len(renders) == 1
+
+    # Later calls render again. Exceptions are raised to all callers.
+    with pytest.raises(RuntimeError):
+        single_flight()
+    assert len(renders) == 2
+
+
+def test_single_flight_async():
+    render, started, release, renders = create_blocking_render()
+    single_flight = SingleFlight(render)
+
+    async def scrape_concurrently():
+        leader = asyncio.ensure_future(single_flight.call_async())
+        while not started.is_set():
+            await asyncio.sleep(0.001)
+        waiters = [asyncio.ensure_future(single_flight.call_async()) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        release.set()
+        return await asyncio.gather(leader, *waiters)
+
+    assert asyncio.run(scrape_concurrently()) == [b"rendered"] * 4
+    assert len(renders) == 1
+
+
+def test_single_flight_async_leader_cancelled():
+    render, started, release, renders = create_blocking_render()
+    single_flight = SingleFlight(render)
+
+    async def scrape_concurrently():
+        leader = asyncio.ensure_future(single_flight.call_async())
+        while not started.is_set():
+            await asyncio.sleep(0.001)
+        waiters = [asyncio.ensure_future(single_flight.call_async()) for _ in range(3)]
+        await asyncio.sleep(0.01)
+
+        # For example the client of the leading scrape disconnected.
+        leader.cancel()
+        waiters[0].cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        with pytest.raises(asyncio.CancelledError):
+            await waiters[0]
+        return await asyncio.gather(*waiters[1:])
+
+    assert asyncio.run(scrape_concurrently()) == [b"rendered"] * 2
+    assert len(renders) == 1
+
+
+# ------------------------------------------------------------------------------
+# Streaming
+
+
+def test_iter_latest_identical_to_generate_latest():
+    registry = create_registry()
+
+    chunks = list(iter_latest(registry))
+
+    assert len(chunks) > 1
+    assert b"".join(chunks) == generate_latest(registry)
+
+
+def test_iter_gzip():
+    chunks = [b"a" * 100_000, b"", b"b" * 10]
+
+    compressed = list(iter_gzip(iter(chunks)))
+
+    assert gzip.decompress(b"".join(compressed)) == b"".join(chunks)
+
+
+# ------------------------------------------------------------------------------
+# Endpoint
+
+
+def test_expose_cache_ttl():
+    utils.reset_collectors()
+    app = create_app()
+    Instrumentator(excluded_handlers=["/metrics"]).instrument(app).expose(
+        app, cache_ttl=60
+    )
+    client = TestClient(app)
+
+    client.get("/")
+    first = client.get("/metrics")
+    client.get("/")
+    second = client.get("/metrics")
+
+    assert second.content == first.content
+    assert second.headers["Age"] == "0"
+
+
+def test_expose_cache_ttl_gzip():
+    utils.reset_collectors()
+    app = create_app()
+    Instrumentator().instrument(app).expose(app, should_gzip=True, cache_ttl=60)
+    client = TestClient(app)
+
+    compressed = client.get("/metrics", headers={"Accept-Encoding": "gzip"})
+    plain = client.get("/metrics", headers={"Accept-Encoding": "identity"})
+
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.content == plain.content
+    assert "Content-Encoding" not in plain.headers
+
+
+def test_expose_without_cache_ttl():
+    utils.reset_collectors()
+    app = create_app()
+    Instrumentator().instrument(app).expose(app)
+    client = TestClient(app)
+
+    client.get("/")
+    first = client.get("/metrics")
+    second = client.get("/metrics")
+
+    assert "Age" not in second.headers
+    assert second.content != first.content
+
+
+def test_expose_coalesce_scrapes():
+    utils.reset_collectors()
+    app = create_app()
+    Instrumentator().instrument(app).expose(
+        app, should_coalesce_scrapes=True, cache_ttl=60
+    )
+    client = TestClient(app)
+
+    client.get("/")
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert b"http_requests_total" in response.content
+
+
+def test_expose_render_in_executor():
+    utils.reset_collectors()
+    app = create_app()
+    Instrumentator().instrument(app).expose(app, should_render_in_executor=True)
+    client = TestClient(app)
+
+    client.get("/")
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert b"http_requests_total" in response.content
+    assert (
+        REGISTRY.get_sample_value("http_instrumentation_render_queue_wait_seconds_count")
+        == 1
+    )
+
+
+def test_expose_render_in_executor_twice_on_same_registry():
+    utils.reset_collectors()
+    apps = [create_app(), create_app()]
+    for app in apps:
+        Instrumentator().instrument(app).expose(app, should_render_in_executor=True)
+
+    for app in apps:
+        assert TestClient(app).get("/metrics").status_code == 200
+
+    assert (
+        REGISTRY.get_sample_value("http_instrumentation_render_queue_wait_seconds_count")
+        == 2
+    )
+
+
+def test_shutdown_on_exit():
+    events = []
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        events.append("startup")
+        yield
+        events.append("shutdown")
+
+    app = FastAPI(lifespan=lifespan)
+    executor = ThreadPoolExecutor(1)
+    shutdown_on_exit(app, executor)
+
+    with TestClient(app):
+        assert executor.submit(lambda: 1).result() == 1
+
+    assert events == ["startup", "shutdown"]
+    with pytest.raises(RuntimeError):
+        executor.submit(lambda: 1)
+
+
+def test_expose_render_in_executor_shut_down_with_app():
+    utils.reset_collectors()
+    app = create_app()
+    Instrumentator().instrument(app).expose(app, should_render_in_executor=True)
+    before = set(threading.enumerate())
+
+    with TestClient(app) as client:
+        assert client.get("/metrics").status_code == 200
+        threads = [
+            thread
+            for thread in set(threading.enumerate()) - before
+            if thread.name.startswith("metrics-render")
+        ]
+        assert len(threads) == 1
+
+    for thread in threads:
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+
+
+def test_expose_render_in_executor_across_lifespans():
+    utils.reset_collectors()
+    app = create_app()
+    Instrumentator().instrument(app).expose(app, should_render_in_executor=True)
+
+    for _ in range(2):
+        before = set(threading.enumerate())
+        with TestClient(app) as client:
+            assert client.get("/metrics").status_code == 200
+            threads = [
+                thread
+                for thread in set(threading.enumerate()) - before
+                if thread.name.startswith("metrics-render")
+            ]
+            assert len(threads) == 1
+
+        threads[0].join(timeout=5)
+        assert not threads[0].is_alive()
+
+    # Requests without a running lifespan create the executor again, too.
+    assert TestClient(app).get("/metrics").status_code == 200
+
+
+def test_expose_custom_render_executor_with_cache_and_coalescing():
+    utils.reset_collectors()
+    app = create_app()
+    threads = []
+    executor = ThreadPoolExecutor(1, initializer=lambda: threads.append(None))
+    Instrumentator().instrument(app).expose(
+        app,
+        should_gzip=True,
+        cache_ttl=60,
+        should_coalesce_scrapes=True,
+        render_executor=executor,
+    )
+    client = TestClient(app)
+
+    first = client.get("/metrics", headers={"Accept-Encoding": "gzip"})
+    second = client.get("/metrics", headers={"Accept-Encoding": "gzip"})
+
+    assert first.headers["Content-Encoding"] == "gzip"
+    assert second.content == first.content
+    assert second.headers["Age"] == "0"
+    assert len(threads) == 1
+    assert (
+        REGISTRY.get_sample_value("http_instrumentation_render_queue_wait_seconds_count")
+        == 1
+    )
+    executor.shutdown()
+
+
+@pytest.mark.skipif(
+    utils.is_prometheus_multiproc_valid(),
+    reason="Environment variable must be not set in parent process.",
+)
+def test_executor_render_process_executor_requires_multiprocess_mode():
+    with ProcessPoolExecutor(1) as executor:
+        with pytest.raises(ValueError, match="PROMETHEUS_MULTIPROC_DIR"):
+            ExecutorRender(executor, lambda: b"", registry=CollectorRegistry())
+
+
+@pytest.mark.parametrize("should_gzip", [False, True])
+def test_expose_stream(should_gzip: bool):
+    utils.reset_collectors()
+    app = create_app()
+    Instrumentator(excluded_handlers=["/metrics"]).instrument(app).expose(
+        app, should_gzip=should_gzip, should_stream=True
+    )
+    client = TestClient(app)
+    client.get("/")
+
+    response = client.get("/metrics", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Type"] == CONTENT_TYPE_LATEST
+    assert "Content-Length" not in response.headers
+    assert response.headers.get("Content-Encoding") == ("gzip" if should_gzip else None)
+    assert (
+        b'http_requests_total{handler="/",method="GET",status="2xx"} 1.0\n'
+        in response.content
+    )
+    assert response.content.startswith(b"# HELP")
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"cache_ttl": 10},
+        {"should_coalesce_scrapes": True},
+        {"should_render_in_executor": True},
+    ],
+)
+def test_expose_stream_invalid_combinations(kwargs: dict):
+    utils.reset_collectors()
+    app = create_app()
+
+    with pytest.raises(ValueError, match="Streaming"):
+        Instrumentator().expose(app, should_stream=True, **kwargs)
+
+
+# ------------------------------------------------------------------------------
+# Series renderer
+
+
+def test_series_renderer_identical_to_generate_latest():
+    registry = create_registry()
+    counter = registry._names_to_collectors["c_total"]
+    renderer = SeriesRenderer()
+
+    for i in range(3):
+        assert renderer.render(registry) == generate_latest(registry)
+        counter.labels(str(i), "new").inc(i)  # type: ignore
+
+
+def test_series_renderer_drops_removed_series():
+    registry = CollectorRegistry()
+    gauge = Gauge("g", "Gauge.", ["a"], registry=registry)
+    gauge.labels("1").set(1)
+    gauge.labels("2").set(2)
+    renderer = SeriesRenderer()
+    renderer.render(registry)
+
+    gauge.remove("1")
+
+    assert renderer.render(registry) == generate_latest(registry)
+    assert renderer.render(registry) == generate_latest(registry)
+    assert len(renderer._families[("g", "gauge", "Gauge.")].series) == 1
+
+
+def test_series_renderer_iter_render():
+    registry = create_registry()
+
+    chunks = list(SeriesRenderer().iter_render(registry))
+
+    assert len(chunks) > 1
+    assert b"".join(chunks) == generate_latest(registry)
+
+
+@pytest.mark.parametrize("should_stream", [False, True])
+def test_expose_cache_series(should_stream: bool):
+    utils.reset_collectors()
+    app = create_app()
+    Instrumentator(excluded_handlers=["/metrics"]).instrument(app).expose(
+        app, should_cache_series=True, should_stream=should_stream
+    )
+    client = TestClient(app)
+
+    for expected in (1.0, 2.0):
+        client.get("/")
+        response = client.get("/metrics")
+
+        assert response.status_code == 200
+        assert (
+            f'http_requests_total{{handler="/",method="GET",status="2xx"}} '
+            f"{expected}\n".encode()
+        ) in response.content
@@ -4,13 +4,21 @@ import warnings
 from http import HTTPStatus
 from typing import Any, Dict, Optional
 
-from fastapi import FastAPI, HTTPException
-from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Info, generate_latest
+import pytest
+from fastapi import APIRouter, FastAPI, HTTPException
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Info,
+    generate_latest,
+)
 from requests import Response as TestClientResponse
-from starlette.responses import Response
+from starlette.responses import PlainTextResponse, Response
+from starlette.routing import Mount, Route
 from starlette.testclient import TestClient
 
-from prometheus_fastapi_instrumentator import Instrumentator, metrics
+from prometheus_fastapi_instrumentator import Instrumentator, metrics, route_resolution
 
 setattr(TestClientResponse, "__test__", False)
 
@@ -408,6 +416,47 @@ def test_excluding_handlers_regex():
     assert b'handler="/ignore"' in response.content
 
 
+def test_excluded_paths():
+    app = create_app()
+    Instrumentator(excluded_paths=["/ignore"], excluded_path_prefixes=["/items/"]).add(
+        metrics.latency()
+    ).instrument(app)
+    expose_metrics(app)
+    client = TestClient(app)
+
+    get_response(client, "/ignore")
+    get_response(client, "/items/1")
+    get_response(client, "/")
+
+    response = get_response(client, "/metrics")
+
+    assert b'handler="/ignore"' not in response.content
+    assert b'handler="/items/{item_id}"' not in response.content
+    assert_request_count(1)
+
+
+def test_excluded_paths_skip_route_resolution(monkeypatch):
+    app = create_app()
+    Instrumentator(excluded_paths=["/"]).add(metrics.latency()).instrument(app)
+    client = TestClient(app)
+
+    resolved = []
+    get_route_name_from_scope = route_resolution.get_route_name_from_scope
+
+    def spy(scope, *args, **kwargs):
+        resolved.append(scope["path"])
+        return get_route_name_from_scope(scope, *args, **kwargs)
+
+    monkeypatch.setattr(route_resolution, "get_route_name_from_scope", spy)
+
+    assert get_response(client, "/").status_code == 200
+    assert resolved == []
+
+    # Other paths are resolved through the patched function.
+    assert get_response(client, "/ignore").status_code == 200
+    assert resolved == ["/ignore"]
+
+
 def test_excluded_handlers_none():
     app = create_app()
     exporter = Instrumentator(excluded_handlers=[]).add(metrics.latency()).instrument(app)
@@ -418,6 +467,36 @@ def test_excluded_handlers_none():
     assert exporter.excluded_handlers is not None
 
 
+def test_positional_arguments_keep_their_order():
+    registry = CollectorRegistry()
+    instrumentator = Instrumentator(
+        True,
+        False,
+        True,
+        False,
+        False,
+        False,
+        False,
+        ["/ignore"],
+        ["/body"],
+        2,
+        "CUSTOM_ENV",
+        "custom_inprogress",
+        True,
+        registry,
+    )
+
+    assert [pattern.pattern for pattern in instrumentator.excluded_handlers] == [
+        "/ignore"
+    ]
+    assert [pattern.pattern for pattern in instrumentator.body_handlers] == ["/body"]
+    assert instrumentator.round_latency_decimals == 2
+    assert instrumentator.env_var_name == "CUSTOM_ENV"
+    assert instrumentator.inprogress_name == "custom_inprogress"
+    assert instrumentator.inprogress_labels is True
+    assert instrumentator.registry is registry
+
+
 # ------------------------------------------------------------------------------
 # Test bucket without infinity.
 
@@ -488,32 +567,25 @@ def test_entropy():
 
 
 def test_default_no_rounding():
-    app = create_app()
-    Instrumentator(excluded_handlers=["/metrics"]).add(
-        metrics.latency(
-            buckets=(
-                1,
-                2,
-                3,
-            )
-        )
-    ).instrument(app).expose(app)
+    clock = {"now": 0}
+    app = create_fake_clock_app(clock)
+    registry = CollectorRegistry()
+    Instrumentator(clock=lambda: clock["now"], registry=registry).add(
+        metrics.latency(buckets=(1, 2, 3), registry=registry)
+    ).instrument(app)
     client = TestClient(app)
 
     get_response(client, "/")
     get_response(client, "/")
     get_response(client, "/")
 
-    _ = get_response(client, "/metrics")
-
-    result = REGISTRY.get_sample_value(
+    result = registry.get_sample_value(
         "http_request_duration_seconds_sum",
         {"handler": "/", "method": "GET", "status": "2xx"},
     )
 
-    entropy = calc_entropy(str(result).split(".")[1][4:])
-
-    assert entropy > 15
+    # Each request takes 1.234567891 seconds on the fake clock.
+    assert result == pytest.approx(3.703703673, abs=1e-12)
 
 
 def test_rounding():
@@ -545,6 +617,42 @@ def test_rounding():
     assert entropy < 10
 
 
+def create_fake_clock_app(clock: Dict[str, int]) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/")
+    def read_root():
+        clock["now"] += 1_234_567_891
+        return "Hello World!"
+
+    return app
+
+
+def test_fake_clock():
+    clock = {"now": 0}
+    app = create_fake_clock_app(clock)
+    infos = []
+    Instrumentator(clock=lambda: clock["now"]).add(infos.append).instrument(app)
+
+    TestClient(app).get("/")
+
+    assert infos[0].modified_duration == 1.234567891
+    assert infos[0].modified_duration_without_streaming == 1.234567891
+
+
+def test_fake_clock_rounding():
+    clock = {"now": 0}
+    app = create_fake_clock_app(clock)
+    infos = []
+    Instrumentator(should_round_latency_decimals=True, clock=lambda: clock["now"]).add(
+        infos.append
+    ).instrument(app)
+
+    TestClient(app).get("/")
+
+    assert infos[0].modified_duration == 1.2346
+
+
 def test_custom_async_instrumentation():
     app = create_app()
     client = TestClient(app)
@@ -599,3 +707,171 @@ def test_add_sync_instrumentation_does_not_warn_deprecated_coroutine_check():
         "asyncio.iscoroutinefunction" not in str(item.message)
         for item in captured_warnings
     )
+
+
+# ------------------------------------------------------------------------------
+# Test warm-up of series.
+
+
+def read_ping(request):
+    return PlainTextResponse("pong")
+
+
+def create_warm_up_app() -> FastAPI:
+    app = create_app()
+
+    router = APIRouter()
+
+    @router.post("/{item_id}")
+    def update_item(item_id: int):
+        return item_id
+
+    app.include_router(router, prefix="/items")
+
+    sub_app = FastAPI()
+
+    @sub_app.get("/status")
+    def read_status():
+        return "ok"
+
+    app.mount("/sub", sub_app)
+    app.router.routes.append(Mount("/api", routes=[Route("/ping", read_ping)]))
+    return app
+
+
+def test_warm_up_series():
+    app = create_warm_up_app()
+    Instrumentator(should_warm_up_series=True, excluded_handlers=["/metrics"]).instrument(
+        app
+    ).expose(app)
+
+    # Starting the client runs the lifespan. No requests are made.
+    with TestClient(app):
+        pass
+
+    for handler, method in [
+        ("/", "GET"),
+        ("/items/{item_id}", "POST"),
+        ("/api/ping", "GET"),
+        ("/api/ping", "HEAD"),
+        ("/sub/status", "GET"),
+    ]:
+        for status in ("2xx", "4xx", "5xx"):
+            assert (
+                REGISTRY.get_sample_value(
+                    "http_requests_total",
+                    {"handler": handler, "method": method, "status": status},
+                )
+                == 0
+            )
+        assert (
+            REGISTRY.get_sample_value(
+                "http_request_duration_seconds_count",
+                {"handler": handler, "method": method},
+            )
+            == 0
+        )
+        assert (
+            REGISTRY.get_sample_value(
+                "http_response_size_bytes_count", {"handler": handler}
+            )
+            == 0
+        )
+
+    # Excluded handlers are not warmed up.
+    assert (
+        REGISTRY.get_sample_value(
+            "http_requests_total",
+            {"handler": "/metrics", "method": "GET", "status": "2xx"},
+        )
+        is None
+    )
+
+
+def test_warm_up_skips_excluded_paths():
+    app = create_warm_up_app()
+    Instrumentator(
+        should_warm_up_series=True,
+        excluded_paths=["/metrics"],
+        excluded_path_prefixes=["/api/"],
+    ).instrument(app).expose(app)
+
+    with TestClient(app):
+        pass
+
+    for handler in ["/metrics", "/api/ping"]:
+        assert (
+            REGISTRY.get_sample_value(
+                "http_requests_total",
+                {"handler": handler, "method": "GET", "status": "2xx"},
+            )
+            is None
+        )
+    assert (
+        REGISTRY.get_sample_value(
+            "http_requests_total",
+            {"handler": "/", "method": "GET", "status": "2xx"},
+        )
+        == 0
+    )
+
+
+def test_warm_up_stops_at_label_limit():
+    app = create_warm_up_app()
+    Instrumentator(should_warm_up_series=True, max_label_combinations=4).instrument(
+        app
+    ).expose(app)
+
+    with TestClient(app):
+        pass
+
+    samples = [
+        sample
+        for metric in REGISTRY.collect()
+        if metric.name == "http_requests"
+        for sample in metric.samples
+        if sample.name == "http_requests_total"
+    ]
+    assert len(samples) == 4
+    assert all(
+        sample.labels["handler"] != metrics.OVERFLOW_LABEL_VALUE for sample in samples
+    )
+    assert REGISTRY.get_sample_value(
+        "http_metric_label_overflow_total", {"metric": "http_requests_total"}
+    ) in (None, 0)
+
+
+def test_warm_up_series_custom_instrumentation_and_status_codes():
+    app = create_app()
+    Instrumentator(
+        should_group_status_codes=False,
+        should_warm_up_series=True,
+        warm_up_status_codes=[200, 404],
+    ).add(metrics.requests()).instrument(app)
+
+    # Without lifespan the series are created on the first request.
+    TestClient(app).get("/ignore")
+
+    labels = {"handler": "/", "method": "GET"}
+    assert (
+        REGISTRY.get_sample_value("http_requests_total", {**labels, "status": "200"}) == 0
+    )
+    assert (
+        REGISTRY.get_sample_value("http_requests_total", {**labels, "status": "404"}) == 0
+    )
+
+
+def test_no_warm_up_by_default():
+    app = create_app()
+    Instrumentator().instrument(app)
+
+    with TestClient(app):
+        pass
+
+    assert (
+        REGISTRY.get_sample_value(
+            "http_requests_total",
+            {"handler": "/", "method": "GET", "status": "2xx"},
+        )
+        is None
+    )
@@ -1,12 +1,17 @@
+import asyncio
+import tracemalloc
 from typing import Any, Dict, Optional
 
 import pytest
-from fastapi import FastAPI, HTTPException, responses
-from prometheus_client import REGISTRY, Histogram
+from fastapi import FastAPI, HTTPException, Request, responses
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram
 from requests import Response as TestClientResponse
 from starlette.testclient import TestClient
 
 from prometheus_fastapi_instrumentator import Instrumentator, metrics
+from prometheus_fastapi_instrumentator.middleware import (
+    PrometheusInstrumentatorMiddleware,
+)
 
 # ------------------------------------------------------------------------------
 # Setup
@@ -80,6 +85,42 @@ def get_response(client: TestClient, path: str) -> TestClientResponse:
     return response
 
 
+async def post_chunks(
+    app: FastAPI, path: str, chunks: list, delay: float, send_delay: float = 0
+) -> None:
+    """Posts chunked request body directly through the ASGI interface."""
+
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)
+    ]
+
+    async def receive():
+        if messages:
+            await asyncio.sleep(delay)
+            return messages.pop(0)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        await asyncio.sleep(send_delay)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"testserver"), (b"transfer-encoding", b"chunked")],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+    }
+    await app(scope, receive, send)
+
+
 # ------------------------------------------------------------------------------
 # Test helpers / misc
 
@@ -113,6 +154,121 @@ def test_existence_of_attributes():
     assert info.modified_duration_without_streaming == 0.0
 
 
+def test_info_derived_values():
+    info = metrics.Info(
+        request=None,
+        response=None,
+        method="GET",
+        modified_duration=0.1,
+        modified_status="200",
+        modified_handler="/",
+        scope={"type": "http", "headers": [(b"content-length", b"12")]},
+        status_code=200,
+        response_headers=[(b"content-type", b"text/plain")],
+        response_body=b"hello",
+    )
+
+    assert info.request_content_length == 12
+    assert info.response_content_length == 5
+    assert info.status_class == "2xx"
+    assert info.label_values(("modified_handler", "method")) == ("/", "GET")
+    assert info.label_values(("method",)) == ("GET",)
+
+    # Attributes not covered by slots can still be attached.
+    info.custom = "value"
+    assert info.custom == "value"
+
+
+def retained_bytes_per_request(should_use_lean_info: bool, requests: int) -> float:
+    app = create_app()
+    infos = []
+    middleware = PrometheusInstrumentatorMiddleware(
+        app,
+        should_use_lean_info=should_use_lean_info,
+        instrumentations=[metrics.default(registry=CollectorRegistry()), infos.append],
+        registry=CollectorRegistry(),
+    )
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "root_path": "",
+        "headers": [(b"host", b"testserver"), (b"content-length", b"0")],
+        "query_string": b"",
+        "app": app,
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    async def run(count: int) -> None:
+        for _ in range(count):
+            await middleware(dict(scope), receive, send)
+
+    loop = asyncio.new_event_loop()
+    try:
+        # Creates series and fills caches before measuring.
+        loop.run_until_complete(run(10))
+        tracemalloc.start()
+        try:
+            before, _ = tracemalloc.get_traced_memory()
+            loop.run_until_complete(run(requests))
+            after, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    finally:
+        loop.close()
+
+    assert len(infos) == 10 + requests
+    return (after - before) / requests
+
+
+def test_lean_info_allocates_less_per_request():
+    # Every Info is kept alive, so what is measured is the memory each request
+    # leaves behind: the Info itself and everything it references.
+    baseline = retained_bytes_per_request(should_use_lean_info=False, requests=200)
+    lean = retained_bytes_per_request(should_use_lean_info=True, requests=200)
+
+    assert lean < baseline
+
+
+def test_info_derived_values_computed_once_per_request(monkeypatch):
+    app = create_app()
+    infos = []
+    Instrumentator().add(
+        metrics.request_size(),
+        metrics.response_size(),
+        metrics.combined_size(),
+        metrics.default(),
+        infos.append,
+    ).instrument(app)
+    client = TestClient(app)
+
+    parsed = []
+    content_length_from_raw = metrics._content_length_from_raw
+
+    def spy(raw_headers):
+        parsed.append(raw_headers)
+        return content_length_from_raw(raw_headers)
+
+    monkeypatch.setattr(metrics, "_content_length_from_raw", spy)
+
+    client.get("/", headers={"Content-Length": "0"})
+
+    # Headers of the request and of the response are parsed once each, even
+    # though several instrumentation functions read the content lengths.
+    assert len(parsed) == 2
+
+    info = infos[0]
+    attribute_names = ("modified_handler", "method", "modified_status")
+    assert info.label_values(attribute_names) is info.label_values(attribute_names)
+    assert info.status_class is info.status_class
+    assert len(parsed) == 2
+
+
 def test_build_label_attribute_names_all_false():
     label_names, info_attribute_names = metrics._build_label_attribute_names(
         should_include_handler=False,
@@ -264,6 +420,27 @@ def test_response_size_no_labels():
     assert REGISTRY.get_sample_value("http_response_size_bytes_sum", {}) == 14
 
 
+@pytest.mark.parametrize("should_use_lean_info", [False, True])
+def test_response_size_streaming(should_use_lean_info: bool):
+    _ = create_app()
+    app = FastAPI()
+
+    @app.get("/")
+    def root():
+        return responses.StreamingResponse(("x" * 1_000 for _ in range(5)))
+
+    Instrumentator(should_use_lean_info=should_use_lean_info).add(
+        metrics.response_size(), metrics.combined_size()
+    ).instrument(app)
+    client = TestClient(app)
+
+    client.get("/")
+
+    labels = {"handler": "/", "method": "GET", "status": "2xx"}
+    assert REGISTRY.get_sample_value("http_response_size_bytes_sum", labels) == 5_000
+    assert REGISTRY.get_sample_value("http_combined_size_bytes_sum", labels) == 5_000
+
+
 def test_response_size_with_runtime_error():
     app = create_app()
     Instrumentator().add(metrics.response_size()).instrument(app).expose(app)
@@ -519,6 +696,36 @@ def test_default():
     )
 
 
+def test_default_lean_info():
+    app = create_app()
+    Instrumentator(should_use_lean_info=True).add(metrics.default()).instrument(
+        app
+    ).expose(app)
+    client = TestClient(app)
+
+    client.request(method="GET", url="/", content="fefeef")
+    client.request(method="GET", url="/")
+
+    assert (
+        REGISTRY.get_sample_value(
+            "http_requests_total",
+            {"handler": "/", "method": "GET", "status": "2xx"},
+        )
+        == 2
+    )
+    assert (
+        REGISTRY.get_sample_value(
+            "http_request_size_bytes_sum",
+            {"handler": "/"},
+        )
+        == 6
+    )
+    assert REGISTRY.get_sample_value(
+        "http_response_size_bytes_sum",
+        {"handler": "/"},
+    ) == 2 * len(b'"Hello World!"')
+
+
 def test_default_should_only_respect_2xx_for_highr():
     app = create_app()
     Instrumentator(excluded_handlers=["/metrics"]).add(
@@ -534,6 +741,25 @@ def test_default_should_only_respect_2xx_for_highr():
     assert b"http_request_duration_highr_seconds_count 0.0" in response.content
 
 
+def test_default_only_respect_2xx_for_highr_uses_modified_status():
+    registry = CollectorRegistry()
+    instrumentation = metrics.default(
+        should_only_respect_2xx_for_highr=True, registry=registry
+    )
+    info = metrics.Info(
+        request=None,
+        response=None,
+        method="GET",
+        modified_duration=0.1,
+        modified_status="2xx",
+        modified_handler="/",
+    )
+
+    instrumentation(info)
+
+    assert registry.get_sample_value("http_request_duration_highr_seconds_count") == 1
+
+
 def test_default_should_not_only_respect_2xx_for_highr():
     app = create_app()
     Instrumentator(excluded_handlers=["/metrics"]).add(
@@ -600,6 +826,273 @@ def test_default_duration_without_streaming():
     )
 
 
+def test_default_response_size_streaming():
+    _ = create_app()
+    app = FastAPI()
+
+    @app.get("/")
+    def root():
+        return responses.StreamingResponse(("x" * 1_000 for _ in range(5)))
+
+    Instrumentator().instrument(app)
+    client = TestClient(app)
+
+    client.get("/")
+
+    assert (
+        REGISTRY.get_sample_value("http_response_size_bytes_sum", {"handler": "/"})
+        == 5_000
+    )
+
+
+def create_upload_app() -> FastAPI:
+    _ = create_app()
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        return len(await request.body())
+
+    return app
+
+
+def test_upload_duration_and_chunked_request_size():
+    app = create_upload_app()
+    Instrumentator(should_track_request_body=True).add(
+        metrics.upload_duration(), metrics.request_size()
+    ).instrument(app)
+
+    asyncio.run(post_chunks(app, "/upload", [b"x" * 100] * 3, delay=0.01))
+
+    labels = {"handler": "/upload", "method": "POST", "status": "2xx"}
+    assert (
+        REGISTRY.get_sample_value("http_request_upload_duration_seconds_count", labels)
+        == 1
+    )
+    assert (
+        REGISTRY.get_sample_value("http_request_upload_duration_seconds_sum", labels)
+        >= 0.02
+    )
+    assert REGISTRY.get_sample_value("http_request_size_bytes_sum", labels) == 300
+
+
+def test_upload_duration_requires_tracking():
+    app = create_upload_app()
+    Instrumentator().add(metrics.upload_duration(), metrics.request_size()).instrument(
+        app
+    )
+
+    asyncio.run(post_chunks(app, "/upload", [b"x" * 100] * 3, delay=0))
+
+    labels = {"handler": "/upload", "method": "POST", "status": "2xx"}
+    assert (
+        REGISTRY.get_sample_value("http_request_upload_duration_seconds_count", labels)
+        is None
+    )
+    assert REGISTRY.get_sample_value("http_request_size_bytes_sum", labels) == 0
+
+
+def test_streaming():
+    _ = create_app()
+    app = FastAPI()
+
+    async def stream():
+        for _ in range(5):
+            await asyncio.sleep(0.01)
+            yield "x" * 1_000
+
+    @app.get("/stream")
+    def read_stream():
+        return responses.StreamingResponse(stream())
+
+    @app.get("/")
+    def read_root():
+        return "Hello World!"
+
+    infos = []
+
+    Instrumentator().add(metrics.streaming(), infos.append).instrument(app)
+    client = TestClient(app)
+
+    client.get("/stream")
+    client.get("/")
+
+    info = infos[0]
+    assert info.response_chunk_count == 5
+    assert 0 < info.time_to_first_byte < info.time_to_last_byte
+    assert info.time_to_last_byte - info.time_to_first_byte >= 0.04
+    assert 0 < info.response_bytes_per_second <= 5_000 / 0.04
+
+    stream_labels = {"handler": "/stream"}
+    assert REGISTRY.get_sample_value("http_response_chunks_sum", stream_labels) == 5
+    assert (
+        REGISTRY.get_sample_value(
+            "http_response_time_to_first_byte_seconds_count", stream_labels
+        )
+        == 1
+    )
+    assert (
+        REGISTRY.get_sample_value(
+            "http_response_throughput_bytes_per_second_count", stream_labels
+        )
+        == 1
+    )
+
+    root_labels = {"handler": "/"}
+    assert REGISTRY.get_sample_value("http_response_chunks_sum", root_labels) == 1
+    assert (
+        REGISTRY.get_sample_value(
+            "http_response_time_to_last_byte_seconds_count", root_labels
+        )
+        == 1
+    )
+    assert (
+        REGISTRY.get_sample_value(
+            "http_response_throughput_bytes_per_second_count", root_labels
+        )
+        is None
+    )
+
+
+def test_send_blocked_time():
+    app = create_upload_app()
+    infos = []
+    Instrumentator(should_track_send_blocked_time=True).add(
+        metrics.send_blocked_time(), infos.append
+    ).instrument(app)
+
+    asyncio.run(post_chunks(app, "/upload", [b"x"], delay=0, send_delay=0.01))
+
+    # Response start and body message.
+    assert infos[0].send_blocked_time >= 0.02
+    labels = {"handler": "/upload", "method": "POST", "status": "2xx"}
+    assert (
+        REGISTRY.get_sample_value("http_response_send_blocked_seconds_count", labels) == 1
+    )
+
+
+def test_send_blocked_time_requires_tracking():
+    app = create_upload_app()
+    infos = []
+    Instrumentator().add(metrics.send_blocked_time(), infos.append).instrument(app)
+
+    asyncio.run(post_chunks(app, "/upload", [b"x"], delay=0, send_delay=0.01))
+
+    assert infos[0].send_blocked_time is None
+    assert (
+        REGISTRY.get_sample_value(
+            "http_response_send_blocked_seconds_count",
+            {"handler": "/upload", "method": "POST", "status": "2xx"},
+        )
+        is None
+    )
+
+
+def test_label_combination_limit():
+    app = create_app()
+    Instrumentator(should_group_untemplated=False, max_label_combinations=2).instrument(
+        app
+    )
+    client = TestClient(app)
+
+    for path in ("/", "/unknown/1", "/unknown/2", "/unknown/3", "/unknown/2", "/"):
+        client.get(path)
+
+    def total(handler: str, method: str = "GET", status: str = "2xx"):
+        return REGISTRY.get_sample_value(
+            "http_requests_total",
+            {"handler": handler, "method": method, "status": status},
+        )
+
+    assert total("/") == 2
+    assert total("/unknown/1", status="4xx") == 1
+    assert total("/unknown/2", status="4xx") is None
+    assert total("__overflow__", "__overflow__", "__overflow__") == 3
+    # Rejected label combinations are counted once each.
+    assert (
+        REGISTRY.get_sample_value(
+            "http_metric_label_overflow_total", {"metric": "http_requests_total"}
+        )
+        == 2
+    )
+    assert (
+        REGISTRY.get_sample_value(
+            "http_request_duration_seconds_count",
+            {"handler": "__overflow__", "method": "__overflow__"},
+        )
+        == 3
+    )
+
+
+def test_label_combination_limit_disabled():
+    app = create_app()
+    Instrumentator(
+        should_group_untemplated=False, max_label_combinations=None
+    ).instrument(app)
+    client = TestClient(app)
+
+    for i in range(5):
+        client.get(f"/unknown/{i}")
+
+    assert (
+        REGISTRY.get_sample_value(
+            "http_requests_total",
+            {"handler": "/unknown/4", "method": "GET", "status": "4xx"},
+        )
+        == 1
+    )
+    assert REGISTRY.get_sample_value("http_metric_label_overflow_total") is None
+
+
+def test_label_combination_limit_custom_metric():
+    app = create_app()
+    Instrumentator(should_group_untemplated=False).add(
+        metrics.latency(max_label_combinations=1),
+        metrics.response_size(max_label_combinations=1),
+    ).instrument(app)
+    client = TestClient(app)
+
+    client.get("/")
+    client.get("/unknown")
+
+    overflow_labels = {
+        "handler": "__overflow__",
+        "method": "__overflow__",
+        "status": "__overflow__",
+    }
+    assert (
+        REGISTRY.get_sample_value("http_request_duration_seconds_count", overflow_labels)
+        == 1
+    )
+    assert (
+        REGISTRY.get_sample_value("http_response_size_bytes_count", overflow_labels) == 1
+    )
+    for metric in ("http_request_duration_seconds", "http_response_size_bytes"):
+        assert (
+            REGISTRY.get_sample_value(
+                "http_metric_label_overflow_total", {"metric": metric}
+            )
+            == 1
+        )
+
+
+def test_register_or_reuse():
+    registry = CollectorRegistry()
+
+    first = metrics.register_or_reuse(
+        Counter, "reused_total", "Reused.", registry=registry, namespace="ns"
+    )
+    second = metrics.register_or_reuse(
+        Counter, "reused_total", "Reused.", registry=registry, namespace="ns"
+    )
+
+    assert first is second
+
+    Counter("foreign", "Foreign.", registry=registry)
+    with pytest.raises(ValueError, match="Duplicated"):
+        metrics.register_or_reuse(Counter, "foreign", "Foreign.", registry=registry)
+
+
 def test_custom_labels():
     app = create_app()
     Instrumentator().add(
@@ -658,6 +1151,48 @@ def test_custom_labels():
     )
 
 
+def test_custom_labels_non_default():
+    app = create_app()
+    Instrumentator().add(
+        metrics.latency(custom_labels={"service": "example"}),
+        metrics.requests(
+            should_include_handler=False,
+            should_include_method=False,
+            should_include_status=False,
+            custom_labels={"service": "example"},
+        ),
+    ).instrument(app).expose(app)
+    client = TestClient(app)
+
+    client.get("/")
+
+    assert (
+        REGISTRY.get_sample_value(
+            "http_request_duration_seconds_count",
+            {"handler": "/", "method": "GET", "status": "2xx", "service": "example"},
+        )
+        == 1
+    )
+    assert REGISTRY.get_sample_value("http_requests_total", {"service": "example"}) == 1
+
+
+def test_cached_labels():
+    registry = CollectorRegistry()
+    metric = Counter("test_total", "Test.", ("a", "b", "c"), registry=registry)
+    labels = metrics._cached_labels(metric, ("static",))
+
+    child = labels(("x", "y"))
+    assert labels(("x", "y")) is child
+    assert labels(("x", "z")) is not child
+
+    labels(("x", "y")).inc()
+    labels(("x", "y")).inc()
+
+    assert (
+        registry.get_sample_value("test_total", {"a": "x", "b": "y", "c": "static"}) == 2
+    )
+
+
 # ------------------------------------------------------------------------------
 # requests
 
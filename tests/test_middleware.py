@@ -1,7 +1,13 @@
+import hashlib
+
 from fastapi import FastAPI, responses, status
 from fastapi.testclient import TestClient
+from prometheus_client import CollectorRegistry
 
 from prometheus_fastapi_instrumentator import Instrumentator, metrics
+from prometheus_fastapi_instrumentator.middleware import (
+    PrometheusInstrumentatorMiddleware,
+)
 
 
 def test_info_body_default():
@@ -184,3 +190,226 @@ def test_info_body_duration_without_streaming():
 
     client.get("/")
     assert instrumentation_executed
+
+
+def test_handler_decisions_patterns():
+    middleware = PrometheusInstrumentatorMiddleware(
+        FastAPI(),
+        registry=CollectorRegistry(),
+        excluded_handlers=["^/metrics$", "admin"],
+        body_handlers=["^/upload", "none"],
+    )
+
+    assert middleware._get_handler_decisions("/metrics", True) == (True, False)
+    assert middleware._get_handler_decisions("/x/admin/y", True) == (True, False)
+    assert middleware._get_handler_decisions("/upload/{id}", True) == (False, True)
+    assert middleware._get_handler_decisions("/items", True) == (False, False)
+
+    # Body handlers are matched against the grouped handler.
+    assert middleware._get_handler_decisions("/random", False) == (False, True)
+
+
+def test_handler_decisions_patterns_with_flags_and_same_groups():
+    middleware = PrometheusInstrumentatorMiddleware(
+        FastAPI(),
+        registry=CollectorRegistry(),
+        excluded_handlers=["/metrics", "(?i)/health", "^/(?P<v>a)$", "^/(?P<v>b)$"],
+        body_handlers=["^/x", "(?i)^/UPLOAD"],
+    )
+
+    assert middleware._get_handler_decisions("/HEALTH", True) == (True, False)
+    assert middleware._get_handler_decisions("/b", True) == (True, False)
+    assert middleware._get_handler_decisions("/upload", True) == (False, True)
+    assert middleware._get_handler_decisions("/items", True) == (False, False)
+
+
+def test_handler_decisions_untemplated_bounded():
+    middleware = PrometheusInstrumentatorMiddleware(
+        FastAPI(), registry=CollectorRegistry(), excluded_handlers=["^/scan/1$"]
+    )
+    middleware.max_untemplated_decisions = 10
+
+    for i in range(100):
+        decision = middleware._get_handler_decisions(f"/scan/{i}", False)
+        assert decision == (i == 1, False)
+
+    assert len(middleware._untemplated_decisions) <= 10
+    assert middleware._templated_decisions == {}
+
+
+def test_lean_info_builds_objects_lazily():
+    app = FastAPI()
+    client = TestClient(app)
+
+    @app.get("/", response_class=responses.PlainTextResponse)
+    def root():
+        return "123456789"
+
+    infos = []
+
+    def instrumentation(info: metrics.Info) -> None:
+        infos.append(info)
+
+    Instrumentator(should_use_lean_info=True).instrument(app).add(instrumentation)
+
+    client.get("/", headers={"Content-Length": "0"})
+
+    info = infos[0]
+    assert info._request is None
+    assert info._response is None
+    assert info.request_content_length == 0
+    assert info.response_content_length == 9
+
+    assert info.request.url.path == "/"
+    assert info.request is info.request
+    assert info.response.status_code == 200
+    assert info.response.headers["Content-Length"] == "9"
+
+
+def test_lean_info_body_handlers():
+    app = FastAPI()
+    client = TestClient(app)
+
+    @app.get("/")
+    def root():
+        return responses.StreamingResponse((str(num) + "xxx" for num in range(5)))
+
+    instrumentation_executed = False
+
+    def instrumentation(info: metrics.Info) -> None:
+        nonlocal instrumentation_executed
+        instrumentation_executed = True
+        assert info.response_content_length == 20
+        assert info.response.body == b"0xxx1xxx2xxx3xxx4xxx"
+
+    Instrumentator(body_handlers=[r".*"], should_use_lean_info=True).instrument(app).add(
+        instrumentation
+    )
+
+    client.get("/")
+    assert instrumentation_executed
+
+
+def test_response_built_lazily_without_lean_info():
+    app = FastAPI()
+    client = TestClient(app)
+
+    @app.get("/")
+    def root():
+        return responses.StreamingResponse((str(num) + "xxx" for num in range(5)))
+
+    infos = []
+
+    def instrumentation(info: metrics.Info) -> None:
+        infos.append(info)
+
+    Instrumentator(body_handlers=[r".*"]).instrument(app).add(instrumentation)
+
+    client.get("/")
+
+    info = infos[0]
+    assert info._response is None
+    assert info._response_body is None
+    assert info.response.body == b"0xxx1xxx2xxx3xxx4xxx"
+    assert info.response is info.response
+
+
+def test_info_body_joined_once_on_access():
+    app = FastAPI()
+    client = TestClient(app)
+
+    @app.get("/")
+    def root():
+        return responses.StreamingResponse((str(num) + "xxx" for num in range(5)))
+
+    bodies = []
+
+    def instrumentation(info: metrics.Info) -> None:
+        bodies.append(info.response_body)
+        bodies.append(info.response_body)
+
+    Instrumentator(body_handlers=[r".*"], should_use_lean_info=True).instrument(app).add(
+        instrumentation
+    )
+
+    client.get("/")
+    assert bodies[0] == b"0xxx1xxx2xxx3xxx4xxx"
+    assert bodies[0] is bodies[1]
+
+
+def test_info_body_truncated():
+    app = FastAPI()
+    client = TestClient(app)
+
+    @app.get("/")
+    def root():
+        return responses.StreamingResponse(("x" * 1_000 for _ in range(5)))
+
+    instrumentation_executed = False
+
+    def instrumentation(info: metrics.Info) -> None:
+        nonlocal instrumentation_executed
+        instrumentation_executed = True
+        assert len(info.response.body) == 2_500
+        assert info.response_body_truncated
+        assert info.response_body_size == 5_000
+
+    Instrumentator(body_handlers=[r".*"], max_body_size=2_500).instrument(app).add(
+        instrumentation
+    )
+
+    response = client.get("/")
+    assert instrumentation_executed
+    assert len(response.content) == 5_000
+
+
+def test_info_body_not_truncated_within_limit():
+    app = FastAPI()
+    client = TestClient(app)
+
+    @app.get("/", response_class=responses.PlainTextResponse)
+    def root():
+        return "123456789"
+
+    instrumentation_executed = False
+
+    def instrumentation(info: metrics.Info) -> None:
+        nonlocal instrumentation_executed
+        instrumentation_executed = True
+        assert info.response.body == b"123456789"
+        assert not info.response_body_truncated
+
+    Instrumentator(body_handlers=[r".*"], max_body_size=9).instrument(app).add(
+        instrumentation
+    )
+
+    client.get("/")
+    assert instrumentation_executed
+
+
+def test_info_body_observers():
+    app = FastAPI()
+    client = TestClient(app)
+
+    @app.get("/")
+    def root():
+        return responses.StreamingResponse(("x" * 1_000 for _ in range(5)))
+
+    @app.get("/other")
+    def other():
+        return "other"
+
+    digests = {}
+
+    def instrumentation(info: metrics.Info) -> None:
+        assert info.response_body == b""
+        if info.response_body_observers is not None:
+            digests[info.modified_handler] = info.response_body_observers[0].hexdigest()
+
+    Instrumentator(
+        body_handlers=[r"^/$"], body_observers=[hashlib.sha256], should_use_lean_info=True
+    ).instrument(app).add(instrumentation)
+
+    client.get("/")
+    client.get("/other")
+    assert digests == {"/": hashlib.sha256(b"x" * 5_000).hexdigest()}
@@ -0,0 +1,355 @@
+import pytest
+from fastapi import APIRouter, FastAPI
+from helpers import utils
+from prometheus_client import REGISTRY
+from starlette.requests import Request
+from starlette.testclient import TestClient
+
+from prometheus_fastapi_instrumentator import Instrumentator
+from prometheus_fastapi_instrumentator.route_resolution import (
+    RouteIndex,
+    RouteNameCache,
+    get_route_name,
+)
+
+# ------------------------------------------------------------------------------
+# Setup
+
+
+def create_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/")
+    def read_root():
+        return "Hello World!"
+
+    @app.get("/items/{item_id}")
+    def read_item(item_id: int):
+        return {"item_id": item_id}
+
+    router = APIRouter()
+
+    @router.get("/{user_id}")
+    def read_user(user_id: int):
+        return {"user_id": user_id}
+
+    app.include_router(router, prefix="/api/users")
+
+    return app
+
+
+def make_request(
+    app: FastAPI, path: str, method: str = "GET", root_path: str = ""
+) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "method": method,
+            "path": path,
+            "root_path": root_path,
+            "headers": [],
+            "query_string": b"",
+            "app": app,
+        }
+    )
+
+
+# ------------------------------------------------------------------------------
+# Route name cache
+
+
+def test_route_name_cache_hit_and_miss():
+    app = create_app()
+    cache = RouteNameCache(maxsize=8)
+
+    assert get_route_name(make_request(app, "/items/1"), cache) == "/items/{item_id}"
+    assert get_route_name(make_request(app, "/items/1"), cache) == "/items/{item_id}"
+    assert get_route_name(make_request(app, "/api/users/7"), cache) == (
+        "/api/users/{user_id}"
+    )
+
+    assert cache.info() == {
+        "hits": 1,
+        "misses": 2,
+        "evictions": 0,
+        "rejections": 0,
+        "size": 2,
+        "maxsize": 8,
+    }
+
+
+def test_route_name_cache_rejects_untemplated():
+    app = create_app()
+    cache = RouteNameCache(maxsize=8)
+
+    for i in range(20):
+        assert get_route_name(make_request(app, f"/scan/{i}"), cache) is None
+
+    assert len(cache) == 0
+    assert cache.rejections == 20
+
+
+def test_route_name_cache_evicts_least_recently_used():
+    cache = RouteNameCache(maxsize=2)
+
+    cache.put("a", "/a")
+    cache.put("b", "/b")
+    assert cache.get("a") == "/a"
+    cache.put("c", "/c")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "/a"
+    assert cache.get("c") == "/c"
+    assert cache.evictions == 1
+
+
+def test_route_name_cache_key_includes_method():
+    app = create_app()
+    cache = RouteNameCache(maxsize=8)
+
+    get_route_name(make_request(app, "/"), cache)
+    get_route_name(make_request(app, "/", method="POST"), cache)
+
+    assert cache.misses == 2
+
+
+def test_route_name_cache_invalid_size():
+    with pytest.raises(ValueError):
+        RouteNameCache(maxsize=0)
+
+
+def test_route_name_cache_end_to_end():
+    utils.reset_collectors()
+    app = create_app()
+    instrumentator = Instrumentator(
+        should_cache_route_names=True, route_name_cache_size=4
+    ).instrument(app)
+    client = TestClient(app)
+
+    for i in range(10):
+        client.get(f"/items/{i}")
+    client.get("/items/9")
+    client.get("/does_not_exist")
+
+    assert instrumentator.route_name_cache is not None
+    assert instrumentator.route_name_cache.info() == {
+        "hits": 1,
+        "misses": 11,
+        "evictions": 6,
+        "rejections": 1,
+        "size": 4,
+        "maxsize": 4,
+    }
+
+    assert (
+        REGISTRY.get_sample_value(
+            "http_requests_total",
+            {"handler": "/items/{item_id}", "method": "GET", "status": "2xx"},
+        )
+        == 11
+    )
+    assert (
+        REGISTRY.get_sample_value(
+            "http_requests_total",
+            {"handler": "none", "method": "GET", "status": "4xx"},
+        )
+        == 1
+    )
+
+
+def test_rebuild_route_index_clears_route_name_cache():
+    utils.reset_collectors()
+    app = create_app()
+    instrumentator = Instrumentator(should_cache_route_names=True).instrument(app)
+    client = TestClient(app)
+
+    client.get("/items/1")
+    assert instrumentator.route_name_cache is not None
+    assert len(instrumentator.route_name_cache) == 1
+
+    instrumentator.rebuild_route_index()
+
+    assert len(instrumentator.route_name_cache) == 0
+
+
+def test_route_name_cache_disabled_by_default():
+    assert Instrumentator().route_name_cache is None
+
+
+# ------------------------------------------------------------------------------
+# Route index
+
+
+def create_users_router() -> APIRouter:
+    inner = APIRouter(prefix="/inner")
+
+    @inner.get("/{thing_id}/detail")
+    def read_thing(thing_id: str):
+        return thing_id
+
+    users = APIRouter()
+
+    @users.get("/")
+    def list_users():
+        return []
+
+    @users.get("/{user_id}")
+    def read_user(user_id: int):
+        return {"user_id": user_id}
+
+    users.include_router(inner)
+
+    return users
+
+
+def create_subapp() -> FastAPI:
+    subapp = FastAPI()
+
+    @subapp.get("/sub")
+    def read_sub():
+        return "sub"
+
+    @subapp.get("/sub/{key}")
+    def read_sub_key(key: str):
+        return key
+
+    return subapp
+
+
+def create_complex_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/")
+    def read_root():
+        return "Hello World!"
+
+    @app.get("/items/{item_id}")
+    def read_item(item_id: int):
+        return {"item_id": item_id}
+
+    @app.get("/items/me")
+    def read_item_me():
+        return "shadowed by /items/{item_id}"
+
+    @app.get("/numbers/{number:int}")
+    def read_number(number: int):
+        return number
+
+    @app.get("/numbers/{name}")
+    def read_number_name(name: str):
+        return name
+
+    @app.post("/items")
+    def create_item():
+        return None
+
+    @app.get("/files/{file_path:path}")
+    def read_file(file_path: str):
+        return file_path
+
+    @app.get("/slash/")
+    def read_slash():
+        return "slash"
+
+    app.include_router(create_users_router(), prefix="/api/users")
+    app.mount("/subapi", create_subapp())
+
+    async def static(scope, receive, send):
+        pass
+
+    app.mount("/static", static)
+
+    return app
+
+
+COMPLEX_APP_PATHS = [
+    "/",
+    "/items/1",
+    "/items/me",
+    "/items",
+    "/items/",
+    "/numbers/42",
+    "/numbers/-1",
+    "/numbers/abc",
+    "/files/a/b/c.txt",
+    "/files/",
+    "/files",
+    "/slash",
+    "/slash/",
+    "/api/users/",
+    "/api/users",
+    "/api/users/5",
+    "/api/users/abc",
+    "/api/users/inner/x/detail",
+    "/api/users/inner/x",
+    "/subapi/sub",
+    "/subapi/sub/",
+    "/subapi/sub/k",
+    "/subapi",
+    "/subapi/",
+    "/subapi/nope",
+    "/static/css/app.css",
+    "/static",
+    "/does_not_exist",
+    "/does/not/exist/",
+]
+
+
+@pytest.mark.parametrize("method", ["GET", "POST", "DELETE"])
+@pytest.mark.parametrize("path", COMPLEX_APP_PATHS)
+def test_route_index_matches_recursive_matcher(path: str, method: str):
+    app = create_complex_app()
+    request = make_request(app, path, method=method)
+
+    assert get_route_name(request, index=RouteIndex()) == get_route_name(request)
+
+
+@pytest.mark.parametrize(
+    "path", ["/prefix", "/prefix/", "/prefix/items/1", "/prefixed/items/1", "/items/1"]
+)
+def test_route_index_respects_root_path(path: str):
+    app = create_complex_app()
+    request = make_request(app, path, root_path="/prefix")
+
+    assert get_route_name(request, index=RouteIndex()) == get_route_name(request)
+
+
+def test_route_index_rebuild():
+    app = create_app()
+    index = RouteIndex()
+
+    assert get_route_name(make_request(app, "/late"), index=index) is None
+
+    @app.get("/late")
+    def read_late():
+        return "late"
+
+    index.rebuild(app)
+
+    assert get_route_name(make_request(app, "/late"), index=index) == "/late"
+
+
+def test_route_index_end_to_end():
+    utils.reset_collectors()
+    app = create_complex_app()
+    instrumentator = Instrumentator(should_index_routes=True).instrument(app)
+    client = TestClient(app)
+
+    client.get("/api/users/inner/x/detail")
+    client.get("/subapi/sub/k")
+
+    @app.get("/late")
+    def read_late():
+        return "late"
+
+    instrumentator.rebuild_route_index()
+    client.get("/late")
+
+    for handler in ["/api/users/inner/{thing_id}/detail", "/subapi/sub/{key}", "/late"]:
+        assert (
+            REGISTRY.get_sample_value(
+                "http_requests_total",
+                {"handler": handler, "method": "GET", "status": "2xx"},
+            )
+            == 1
+        )
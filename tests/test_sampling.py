@@ -0,0 +1,246 @@
+import pytest
+from fastapi import FastAPI
+from helpers import utils
+from prometheus_client import REGISTRY, CollectorRegistry
+from starlette.testclient import TestClient
+
+from prometheus_fastapi_instrumentator import Instrumentator, metrics
+from prometheus_fastapi_instrumentator import middleware as middleware_module
+from prometheus_fastapi_instrumentator.middleware import (
+    PrometheusInstrumentatorMiddleware,
+)
+from prometheus_fastapi_instrumentator.sampling import AdaptiveSampler
+
+# ------------------------------------------------------------------------------
+# Setup
+
+
+def create_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/")
+    def read_root():
+        return "Hello World!"
+
+    @app.get("/always")
+    def read_always():
+        return "Always"
+
+    return app
+
+
+def patch_random(monkeypatch, values: list) -> None:
+    values = iter(values)
+    monkeypatch.setattr(middleware_module.random, "random", lambda: next(values))
+
+
+def get_sample(name: str, labels: dict = {}) -> float:
+    return REGISTRY.get_sample_value(name, labels)
+
+
+# ------------------------------------------------------------------------------
+# Tests
+
+
+def test_sampled_counters_and_sums_scaled(monkeypatch):
+    utils.reset_collectors()
+    app = create_app()
+    Instrumentator(sampling_rate=0.5).instrument(app)
+    client = TestClient(app)
+    patch_random(monkeypatch, [0.1, 0.9, 0.2, 0.6])
+
+    for _ in range(4):
+        client.get("/")
+
+    assert (
+        get_sample(
+            "http_requests_total",
+            {"handler": "/", "method": "GET", "status": "2xx"},
+        )
+        == 4
+    )
+    assert get_sample("http_response_size_bytes_count", {"handler": "/"}) == 4
+    assert get_sample("http_response_size_bytes_sum", {"handler": "/"}) == 4 * len(
+        b'"Hello World!"'
+    )
+    assert get_sample("http_request_duration_highr_seconds_count") == 2
+    assert (
+        get_sample(
+            "http_request_duration_seconds_count",
+            {"handler": "/", "method": "GET"},
+        )
+        == 2
+    )
+
+
+def test_handler_sampling_rates(monkeypatch):
+    utils.reset_collectors()
+    app = create_app()
+    Instrumentator(sampling_rate=0.5, handler_sampling_rates={"/always": 1.0}).instrument(
+        app
+    )
+    client = TestClient(app)
+    patch_random(monkeypatch, [0.9, 0.9])
+
+    client.get("/")
+    client.get("/")
+    client.get("/always")
+
+    assert (
+        get_sample(
+            "http_requests_total",
+            {"handler": "/", "method": "GET", "status": "2xx"},
+        )
+        is None
+    )
+    assert (
+        get_sample(
+            "http_requests_total",
+            {"handler": "/always", "method": "GET", "status": "2xx"},
+        )
+        == 1
+    )
+    assert get_sample("http_request_sampling_rate", {"handler": "__default__"}) == 0.5
+    assert get_sample("http_request_sampling_rate", {"handler": "/always"}) == 1.0
+
+
+def test_sample_weight_passed_to_instrumentations(monkeypatch):
+    utils.reset_collectors()
+    app = create_app()
+    weights = []
+
+    def instrumentation(info: metrics.Info) -> None:
+        weights.append(info.sample_weight)
+
+    Instrumentator(sampling_rate=0.25).add(instrumentation).instrument(app)
+    client = TestClient(app)
+    patch_random(monkeypatch, [0.1, 0.5])
+
+    client.get("/")
+    client.get("/")
+
+    assert weights == [4.0]
+
+
+def test_no_sampling_gauge_by_default():
+    utils.reset_collectors()
+    app = create_app()
+    Instrumentator().instrument(app)
+    TestClient(app).get("/")
+
+    assert get_sample("http_request_sampling_rate", {"handler": "__default__"}) is None
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"sampling_rate": 0.0},
+        {"sampling_rate": 1.5},
+        {"handler_sampling_rates": {"/": -0.1}},
+    ],
+)
+def test_invalid_sampling_rate(kwargs: dict):
+    with pytest.raises(ValueError):
+        PrometheusInstrumentatorMiddleware(
+            create_app(), registry=CollectorRegistry(), **kwargs
+        )
+
+
+def test_sampling_rate_gauge_namespace_and_shared_registry():
+    registry = CollectorRegistry()
+    for handler in ("/a", "/b"):
+        PrometheusInstrumentatorMiddleware(
+            create_app(),
+            registry=registry,
+            handler_sampling_rates={handler: 0.5},
+            metric_namespace="ns",
+            metric_subsystem="sub",
+        )
+
+    assert registry.get_sample_value("http_request_sampling_rate") is None
+    for handler in ("/a", "/b"):
+        assert (
+            registry.get_sample_value(
+                "ns_sub_http_request_sampling_rate", {"handler": handler}
+            )
+            == 0.5
+        )
+
+
+# ------------------------------------------------------------------------------
+# Adaptive sampling
+
+
+def test_adaptive_sampler_decreases_and_recovers():
+    registry = CollectorRegistry()
+    sampler = AdaptiveSampler(budget_percent=10, min_scale=0.2, registry=registry)
+
+    # Overhead of 50 % exceeds budget.
+    assert sampler.record(0.5, 1.0, now=0.0) is False
+    assert sampler.record(0.5, 1.0, now=1.0) is True
+    assert sampler.scale == 0.5
+    assert registry.get_sample_value("http_instrumentation_overhead_ratio") == 0.5
+    assert registry.get_sample_value("http_instrumentation_sampling_scale") == 0.5
+
+    sampler.record(0.5, 1.0, now=2.0)
+    sampler.record(0.5, 1.0, now=3.0)
+    assert sampler.scale == 0.2
+
+    # Overhead within budget but without enough headroom.
+    sampler.record(0.08, 1.0, now=4.0)
+    assert sampler.scale == 0.2
+
+    # Overhead of 1 % is well below budget.
+    sampler.record(0.01, 1.0, now=5.0)
+    assert sampler.scale == 0.25
+    assert registry.get_sample_value("http_instrumentation_overhead_seconds") == 0.01
+
+
+def test_adaptive_sampler_shared_registry():
+    registry = CollectorRegistry()
+    first = AdaptiveSampler(budget_percent=10, registry=registry)
+    second = AdaptiveSampler(budget_percent=10, registry=registry)
+
+    assert second.scale_gauge is first.scale_gauge
+    assert registry.get_sample_value("http_instrumentation_sampling_scale") == 1.0
+
+
+def test_adaptive_sampler_budget_seconds():
+    sampler = AdaptiveSampler(budget_seconds=0.001, registry=CollectorRegistry())
+
+    sampler.record(0.002, 0.1, now=0.0)
+    sampler.record(0.002, 0.1, now=0.5)
+    sampler.record(0.002, 0.1, now=1.0)
+
+    assert sampler.scale == 0.5
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"budget_percent": 1, "budget_seconds": 1},
+        {"budget_percent": 1, "min_scale": 0},
+    ],
+)
+def test_adaptive_sampler_invalid_arguments(kwargs: dict):
+    with pytest.raises(ValueError):
+        AdaptiveSampler(registry=CollectorRegistry(), **kwargs)
+
+
+def test_adaptive_sampling_end_to_end(monkeypatch):
+    utils.reset_collectors()
+    monkeypatch.setattr(AdaptiveSampler, "interval", 0.0)
+    app = create_app()
+    Instrumentator(
+        handler_sampling_rates={"/always": 1.0}, overhead_budget_seconds=1e-12
+    ).instrument(app)
+    client = TestClient(app)
+
+    for _ in range(3):
+        client.get("/always")
+
+    scale = get_sample("http_instrumentation_sampling_scale")
+    assert scale < 1.0
+    assert get_sample("http_request_sampling_rate", {"handler": "/always"}) == scale
+    assert get_sample("http_instrumentation_overhead_seconds") > 0
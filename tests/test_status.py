@@ -0,0 +1,44 @@
+from http import HTTPStatus
+
+import pytest
+
+from prometheus_fastapi_instrumentator import status
+
+
+@pytest.mark.parametrize(
+    "status_code, label, grouped_label",
+    [
+        (100, "100", "1xx"),
+        (200, "200", "2xx"),
+        (HTTPStatus.NOT_FOUND, "404", "4xx"),
+        (599, "599", "5xx"),
+        (600, "600", "6xx"),
+        (1000, "1000", "1xx"),
+    ],
+)
+def test_status_label(status_code: int, label: str, grouped_label: str):
+    assert status.status_label(status_code) == label
+    assert status.status_label(status_code, grouped=True) == grouped_label
+
+
+def test_status_labels_interned():
+    assert status.status_label(201, grouped=True) is status.status_label(299, True)
+    assert status.status_label(HTTPStatus.OK) is status.status_label(200)
+
+
+@pytest.mark.parametrize(
+    "modified_status, expected",
+    [
+        ("200", True),
+        ("2xx", True),
+        ("204", True),
+        ("199", False),
+        ("300", False),
+        ("5xx", False),
+        ("2000", True),
+        (200, True),
+        (HTTPStatus.NOT_FOUND, False),
+    ],
+)
+def test_is_2xx(modified_status, expected: bool):
+    assert status.is_2xx(modified_status) is expected